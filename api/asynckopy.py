@@ -0,0 +1,256 @@
+"""
+asyncio counterpart to api.kopy.Kopy.
+
+This is written against trollius, the Python 2 port of asyncio, so coroutines
+use "yield From(...)" where Python 3 would use "yield from", and return values
+with "raise Return(...)".
+"""
+
+import ssl
+from urllib import urlencode
+from urlparse import urlsplit
+import trollius as asyncio
+from trollius import From, Return
+from api.kopy import Kopy, DeadlineExceeded
+
+class Response(object):
+
+    """
+    The parts of an HTTP response AsyncKopy cares about. Header names are
+    lower-cased.
+    """
+
+    def __init__(self, status, headers, body):
+
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+class AsyncKopy(Kopy):
+
+    """
+    Implementation of the kopy.io API for asyncio programs.
+
+    createDocument and retrieveDocument are coroutines; everything else
+    (validation, padding, error messages) is inherited from Kopy. Requests are
+    made over non-blocking connections, of which up to poolSize are kept
+    alive; encryption and decryption run in executor (by default, the loop's
+    thread pool), so they don't hold up the event loop.
+
+    The bulk methods inherited from Kopy aren't coroutines, and shouldn't be
+    used; asyncio.gather() does the same job. Nor are GETs hedged.
+    """
+
+    def __init__(self, loop=None, executor=None, poolSize=None, timeout=None,
+                 retries=None, backend=None, url=None):
+
+        Kopy.__init__(self, poolSize=poolSize, timeout=timeout, retries=retries,
+                      backend=backend, url=url)
+        self.loop = loop or asyncio.get_event_loop()
+        self.executor = executor
+        self.slots = asyncio.Semaphore(self.poolSize, loop=self.loop)
+        self.idle = {} # (host, port, tls) -> [(reader, writer), ...]
+
+    def _newSession(self):
+
+        return None # connections are managed by _connect instead
+
+    def _run(self, function, *args):
+        """
+        Run a CPU-bound function in the executor.
+        """
+
+        return self.loop.run_in_executor(self.executor, function, *args)
+
+    @asyncio.coroutine
+    def _connect(self, host, port, tls):
+        """
+        Return an idle keep-alive connection to host, or open a new one.
+        """
+
+        idle = self.idle.get((host, port, tls))
+        while idle:
+            reader, writer = idle.pop()
+            if not reader.at_eof(): raise Return((reader, writer))
+            writer.close()
+
+        context = None
+        if tls:
+            context = ssl.create_default_context()
+            if not self.verifyCert:
+                context.check_hostname = False
+                context.verify_mode = ssl.CERT_NONE
+
+        connection = yield From(asyncio.open_connection(host, port, ssl=context,
+                                                        loop=self.loop))
+        raise Return(connection)
+
+    @asyncio.coroutine
+    def _readResponse(self, reader):
+
+        line = yield From(reader.readline())
+        if not line: raise asyncio.IncompleteReadError(line, None)
+        version, status = line.split(None, 2)[:2]
+
+        headers = {}
+        while True:
+            line = yield From(reader.readline())
+            if line in ["\r\n", "\n", ""]: break
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = []
+            while True:
+                size = int((yield From(reader.readline())).split(";")[0], 16)
+                chunk = yield From(reader.readexactly(size + 2)) # + CRLF
+                if not size: break
+                body.append(chunk[:-2])
+            body = "".join(body)
+        elif "content-length" in headers:
+            body = yield From(reader.readexactly(int(headers["content-length"])))
+        else:
+            body = yield From(reader.read())
+            headers["connection"] = "close"
+
+        keepAlive = version == "HTTP/1.1" and \
+                    headers.get("connection", "").lower() != "close"
+        raise Return((Response(int(status), headers, body), keepAlive))
+
+    @asyncio.coroutine
+    def _send(self, method, url, body=None, headers=None):
+
+        url = urlsplit(url)
+        tls = url.scheme == "https"
+        host, port = url.hostname, url.port or (443 if tls else 80)
+        path = url.path + ("?" + url.query if url.query else "")
+
+        request = ["{} {} HTTP/1.1".format(method, path or "/"),
+                   "Host: {}".format(url.netloc),
+                   "Content-Length: {}".format(len(body or ""))]
+        request += ["{}: {}".format(k, v) for k, v in (headers or {}).items()]
+        request = "\r\n".join(request) + "\r\n\r\n" + (body or "")
+
+        with (yield From(self.slots)):
+            reader, writer = yield From(self._connect(host, port, tls))
+            try:
+                writer.write(request)
+                response, keepAlive = yield From(self._readResponse(reader))
+            except BaseException:
+                writer.close()
+                raise
+
+            if keepAlive:
+                self.idle.setdefault((host, port, tls), []).append((reader, writer))
+            else:
+                writer.close()
+
+        raise Return(response)
+
+    @asyncio.coroutine
+    def _request(self, method, url, body=None, headers=None):
+        """
+        Make an HTTP request, with the same timeout and retry behavior as
+        Kopy._request.
+        """
+
+        for attempt in range(self.retries + 1):
+            last = attempt == self.retries
+            try:
+                with self._phase("http") as phase:
+                    response = yield From(asyncio.wait_for(
+                        self._send(method, url, body, headers), self.timeout,
+                        loop=self.loop))
+                    phase.bytes = len(response.body)
+            except (EnvironmentError, asyncio.TimeoutError,
+                    asyncio.IncompleteReadError):
+                if last: raise
+            else:
+                if (response.status < 500 and response.status != 429) or last:
+                    raise Return(response)
+            yield From(asyncio.sleep(self.retryBackoff * 2 ** attempt,
+                                     loop=self.loop))
+
+    @asyncio.coroutine
+    def _postDocument(self, document, encryption=False, keep=600, **extra):
+
+        body = urlencode(self._composeDocument(document, encryption, keep, **extra))
+        response = yield From(self._request("POST", self.url, body,
+                    {"Content-Type": "application/x-www-form-urlencoded"}))
+        raise Return(self._parseDocument(response.body))
+
+    @asyncio.coroutine
+    def _getDocument(self, documentId):
+
+        response = yield From(self._request("GET", self.url + documentId))
+        self._checkResponse(response.status, response.headers.get("content-type"))
+        raise Return(self._parseDocument(response.body))
+
+    @asyncio.coroutine
+    def _withDeadline(self, coroutine, deadline):
+        """
+        Run coroutine, raising DeadlineExceeded if it takes longer than
+        deadline seconds, or self.deadline.
+        """
+
+        if deadline is None: deadline = self.deadline
+        start = self.loop.time()
+        try:
+            result = yield From(asyncio.wait_for(coroutine, deadline,
+                                                 loop=self.loop))
+        except asyncio.TimeoutError:
+            if deadline is None or self.loop.time() - start < deadline: raise
+            raise DeadlineExceeded("The operation took too long.")
+        raise Return(result)
+
+    @asyncio.coroutine
+    def createDocument(self, document, passphrase=None, keep=600,
+                       compression=None, binary=False, deadline=None, **extra):
+        """
+        Coroutine version of Kopy.createDocument. A deadline cancels whatever
+        is in progress when it passes, though encryption already running in
+        the executor finishes in the background.
+        """
+
+        identifier = yield From(self._withDeadline(self._createDocument(document,
+                                passphrase, keep, compression, binary, **extra),
+                                deadline))
+        raise Return(identifier)
+
+    @asyncio.coroutine
+    def _createDocument(self, document, passphrase, keep, compression, binary,
+                        **extra):
+
+        document, fields = yield From(self._run(self._encodeDocument, document,
+                                                passphrase, compression, binary))
+        extra.update(fields)
+        encryption = passphrase != None and self.scheme
+        identifier = yield From(self._postDocument(document, encryption=encryption,
+                                                   keep=keep, **extra))
+        raise Return(self._documentKey(identifier))
+
+    @asyncio.coroutine
+    def retrieveDocument(self, documentId, passphrase=None, deadline=None):
+        """
+        Coroutine version of Kopy.retrieveDocument.
+        """
+
+        document = yield From(self._withDeadline(self._retrieveDocument(
+                              documentId, passphrase), deadline))
+        raise Return(document)
+
+    @asyncio.coroutine
+    def _retrieveDocument(self, documentId, passphrase):
+
+        document = yield From(self._getDocument(documentId))
+        document = yield From(self._run(self._openDocument, document, passphrase))
+        raise Return(document)
+
+    def close(self):
+        """
+        Close idle connections.
+        """
+
+        for connections in self.idle.values():
+            for reader, writer in connections: writer.close()
+        self.idle = {}
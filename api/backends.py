@@ -0,0 +1,493 @@
+"""
+Interchangeable implementations of the cryptographic primitives Kopy needs:
+AES-CBC, OpenSSL's key derivation and PKCS#7 padding, and for the "chunked"
+scheme, AES-CTR, HMAC-SHA256 and PBKDF2.
+
+Every backend produces byte-identical, OpenSSL-compatible output; they only
+differ in speed and in what has to be installed. getBackend() picks one.
+"""
+
+import hmac
+import os
+import warnings
+from hashlib import md5, pbkdf2_hmac, sha256
+from struct import pack, unpack
+from time import time
+
+class Backend(object):
+
+    """
+    Base class for crypto backends. Subclasses provide newCipher; key
+    derivation and padding are plain string operations, shared by all of them.
+    """
+
+    name = None
+
+    @classmethod
+    def available(cls):
+        """ Returns True if the backend's dependencies are installed. """
+
+        return True
+
+    def newCipher(self, key, iv):
+        """
+        Return an AES-CBC cipher object with encrypt() and decrypt() methods.
+        Like PyCrypto's, it carries the chaining state from one call to the
+        next, so a message can be processed a few blocks at a time.
+        """
+
+        raise NotImplementedError
+
+    def newCTR(self, key, counter):
+        """
+        Return an AES-CTR cipher object with an encrypt() method (which also
+        decrypts), starting from the 16-byte counter block, which counts up as
+        a big-endian integer. It carries on from one call to the next.
+        """
+
+        raise NotImplementedError
+
+    def newHMAC(self, key):
+        """
+        Return an HMAC-SHA256 object with update() and digest() methods.
+        """
+
+        return hmac.new(key, digestmod=sha256)
+
+    def pbkdf2(self, password, salt, iterations, length):
+        """
+        PBKDF2 with HMAC-SHA256.
+        """
+
+        return pbkdf2_hmac("sha256", password, salt, iterations, length)
+
+    def deriveKey(self, password, salt, keyLength, ivLength):
+        """
+        Derive a key and IV from a password and salt, the same way as OpenSSL's
+        EVP_BytesToKey with MD5 and one iteration.
+        """
+
+        digest = md5(password + salt).digest()
+        output = [digest]
+        length = len(digest)
+        while length < keyLength + ivLength:
+            digest = md5(digest + password + salt).digest()
+            output.append(digest)
+            length += len(digest)
+        output = "".join(output)
+        return output[:keyLength], output[keyLength:keyLength + ivLength]
+
+    def pad(self, message, blockSize):
+        """
+        Add PKCS#7 padding, to a multiple of blockSize.
+        """
+
+        pad = blockSize - len(message) % blockSize
+        return message + chr(pad) * pad
+
+    def unpad(self, message, blockSize):
+        """
+        Remove PKCS#7 padding, checking that it's well-formed.
+        """
+
+        if len(message) % blockSize != 0 or not message:
+            raise Exception("Message is not properly sized.")
+
+        pad = ord(message[-1])
+        if pad > blockSize or pad == 0: raise Exception("Bad padding.")
+        if message[-pad:] != chr(pad) * pad: raise Exception("Bad padding.")
+
+        return message[:-pad]
+
+class PyCryptoBackend(Backend):
+
+    """
+    AES from PyCrypto, which kopycat has always used.
+    """
+
+    name = "pycrypto"
+
+    @classmethod
+    def available(cls):
+
+        try:
+            import Crypto.Cipher.AES
+        except ImportError:
+            return False
+        return True
+
+    def newCipher(self, key, iv):
+
+        from Crypto.Cipher import AES
+        return AES.new(key, AES.MODE_CBC, iv)
+
+    def newCTR(self, key, counter):
+
+        from Crypto.Cipher import AES
+        from Crypto.Util import Counter
+        return AES.new(key, AES.MODE_CTR, counter=Counter.new(128,
+                       initial_value=long(counter.encode("hex"), 16)))
+
+class CryptographyCipher(object):
+
+    """
+    Adapts a cryptography Cipher to the PyCrypto-style interface; encryption
+    and decryption contexts are created on first use.
+    """
+
+    def __init__(self, cipher):
+
+        self.cipher = cipher
+        self.encryptor = self.decryptor = None
+
+    def encrypt(self, data):
+
+        if self.encryptor is None: self.encryptor = self.cipher.encryptor()
+        return self.encryptor.update(data)
+
+    def decrypt(self, data):
+
+        if self.decryptor is None: self.decryptor = self.cipher.decryptor()
+        return self.decryptor.update(data)
+
+class CryptographyHMAC(object):
+
+    """
+    Adapts a cryptography HMAC to hashlib's interface.
+    """
+
+    def __init__(self, hmac):
+
+        self.hmac = hmac
+
+    def update(self, data):
+
+        self.hmac.update(data)
+
+    def digest(self):
+
+        return self.hmac.finalize()
+
+class CryptographyBackend(Backend):
+
+    """
+    AES from the cryptography package (cryptography.io), backed by OpenSSL.
+    """
+
+    name = "cryptography"
+
+    @classmethod
+    def available(cls):
+
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore") # Python 2 deprecation notice
+                import cryptography.hazmat.primitives.ciphers
+        except ImportError:
+            return False
+        return True
+
+    def __init__(self):
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            from cryptography.hazmat.backends import default_backend
+            from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+        self.openssl = default_backend()
+        self.Cipher, self.AES, self.CBC = Cipher, algorithms.AES, modes.CBC
+        self.CTR = modes.CTR
+
+    def newCipher(self, key, iv):
+
+        return CryptographyCipher(self.Cipher(self.AES(key), self.CBC(iv),
+                                              backend=self.openssl))
+
+    # OpenSSL lets go of the GIL, unless Python's hashlib was built without it,
+    # so these run in parallel across threads; see api.chunked
+
+    def newCTR(self, key, counter):
+
+        return CryptographyCipher(self.Cipher(self.AES(key), self.CTR(counter),
+                                              backend=self.openssl))
+
+    def newHMAC(self, key):
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            from cryptography.hazmat.primitives import hashes, hmac
+        return CryptographyHMAC(hmac.HMAC(key, hashes.SHA256(), self.openssl))
+
+    def pbkdf2(self, password, salt, iterations, length):
+
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            from cryptography.hazmat.primitives import hashes
+            from cryptography.hazmat.primitives.kdf.pbkdf2 import PBKDF2HMAC
+        return PBKDF2HMAC(hashes.SHA256(), length, salt, iterations,
+                          self.openssl).derive(password)
+
+class PurePythonCipher(object):
+
+    """
+    AES-CBC in pure Python, using the usual 32-bit lookup table construction
+    from the Rijndael reference code. Slow, but needs nothing installed.
+    """
+
+    tables = None
+
+    @classmethod
+    def _buildTables(cls):
+
+        def xtime(a):
+            return ((a << 1) ^ (0x1b if a & 0x80 else 0)) & 0xff
+
+        def mul(a, b):
+            output = 0
+            while b:
+                if b & 1: output ^= a
+                a, b = xtime(a), b >> 1
+            return output
+
+        def rotate(word, n):
+            return ((word >> n) | (word << (32 - n))) & 0xffffffff
+
+        # S-box, from the multiplicative inverse and the affine transform;
+        # 3 generates GF(2^8), so inverses come from log and antilog tables
+        exp, log = [0] * 255, [0] * 256
+        x = 1
+        for i in range(255):
+            exp[i], log[x] = x, i
+            x ^= xtime(x)
+        inverse = [0] + [exp[-log[a] % 255] for a in range(1, 256)]
+
+        sbox = [0] * 256
+        for a in range(256):
+            b = inverse[a]
+            s = b
+            for i in range(4):
+                b = ((b << 1) | (b >> 7)) & 0xff
+                s ^= b
+            sbox[a] = s ^ 0x63
+        sboxInverse = [0] * 256
+        for a in range(256): sboxInverse[sbox[a]] = a
+
+        te = [(mul(s, 2) << 24) | (s << 16) | (s << 8) | mul(s, 3) for s in sbox]
+        td = [(mul(s, 14) << 24) | (mul(s, 9) << 16) | (mul(s, 13) << 8) |
+              mul(s, 11) for s in sboxInverse]
+
+        cls.tables = (sbox, sboxInverse,
+                      [[rotate(w, n) for w in te] for n in (0, 8, 16, 24)],
+                      [[rotate(w, n) for w in td] for n in (0, 8, 16, 24)])
+
+    def __init__(self, key, iv):
+
+        if self.tables is None: self._buildTables()
+        sbox, sboxInverse, te, td = self.tables
+
+        if not len(key) in [16, 24, 32]: raise Exception("Bad key length.")
+        if len(iv) != 16: raise Exception("Bad IV length.")
+
+        nk = len(key) / 4
+        self.rounds = rounds = nk + 6
+        w = list(unpack(">{}I".format(nk), key))
+        rcon = 1
+        for i in range(nk, 4 * (rounds + 1)):
+            t = w[i - 1]
+            if i % nk == 0:
+                t = (sbox[(t >> 16) & 0xff] << 24) | (sbox[(t >> 8) & 0xff] << 16) | \
+                    (sbox[t & 0xff] << 8) | sbox[t >> 24]
+                t ^= rcon << 24
+                rcon = ((rcon << 1) ^ (0x1b if rcon & 0x80 else 0)) & 0xff
+            elif nk > 6 and i % nk == 4:
+                t = (sbox[t >> 24] << 24) | (sbox[(t >> 16) & 0xff] << 16) | \
+                    (sbox[(t >> 8) & 0xff] << 8) | sbox[t & 0xff]
+            w.append(w[i - nk] ^ t)
+        self.encryptKeys = w
+
+        # Decryption uses the round keys in reverse, with InvMixColumns applied
+        # to the inner ones ("equivalent inverse cipher", FIPS-197 5.3.5)
+        d = []
+        for r in range(rounds + 1):
+            words = w[4 * (rounds - r):4 * (rounds - r) + 4]
+            if 0 < r < rounds:
+                words = [td[0][sbox[x >> 24]] ^ td[1][sbox[(x >> 16) & 0xff]] ^
+                         td[2][sbox[(x >> 8) & 0xff]] ^ td[3][sbox[x & 0xff]]
+                         for x in words]
+            d += words
+        self.decryptKeys = d
+
+        self.iv = unpack(">4I", iv)
+
+    def _encryptBlock(self, s0, s1, s2, s3):
+
+        sbox, sboxInverse, (t0, t1, t2, t3), td = self.tables
+        k = self.encryptKeys
+        s0 ^= k[0]; s1 ^= k[1]; s2 ^= k[2]; s3 ^= k[3]
+        for r in range(4, 4 * self.rounds, 4):
+            s0, s1, s2, s3 = (
+                t0[s0 >> 24] ^ t1[(s1 >> 16) & 0xff] ^ t2[(s2 >> 8) & 0xff] ^ t3[s3 & 0xff] ^ k[r],
+                t0[s1 >> 24] ^ t1[(s2 >> 16) & 0xff] ^ t2[(s3 >> 8) & 0xff] ^ t3[s0 & 0xff] ^ k[r + 1],
+                t0[s2 >> 24] ^ t1[(s3 >> 16) & 0xff] ^ t2[(s0 >> 8) & 0xff] ^ t3[s1 & 0xff] ^ k[r + 2],
+                t0[s3 >> 24] ^ t1[(s0 >> 16) & 0xff] ^ t2[(s1 >> 8) & 0xff] ^ t3[s2 & 0xff] ^ k[r + 3])
+        r = 4 * self.rounds
+        return (
+            ((sbox[s0 >> 24] << 24) | (sbox[(s1 >> 16) & 0xff] << 16) |
+             (sbox[(s2 >> 8) & 0xff] << 8) | sbox[s3 & 0xff]) ^ k[r],
+            ((sbox[s1 >> 24] << 24) | (sbox[(s2 >> 16) & 0xff] << 16) |
+             (sbox[(s3 >> 8) & 0xff] << 8) | sbox[s0 & 0xff]) ^ k[r + 1],
+            ((sbox[s2 >> 24] << 24) | (sbox[(s3 >> 16) & 0xff] << 16) |
+             (sbox[(s0 >> 8) & 0xff] << 8) | sbox[s1 & 0xff]) ^ k[r + 2],
+            ((sbox[s3 >> 24] << 24) | (sbox[(s0 >> 16) & 0xff] << 16) |
+             (sbox[(s1 >> 8) & 0xff] << 8) | sbox[s2 & 0xff]) ^ k[r + 3])
+
+    def _decryptBlock(self, s0, s1, s2, s3):
+
+        sbox = self.tables[1] # the inverse S-box
+        t0, t1, t2, t3 = self.tables[3]
+        k = self.decryptKeys
+        s0 ^= k[0]; s1 ^= k[1]; s2 ^= k[2]; s3 ^= k[3]
+        for r in range(4, 4 * self.rounds, 4):
+            s0, s1, s2, s3 = (
+                t0[s0 >> 24] ^ t1[(s3 >> 16) & 0xff] ^ t2[(s2 >> 8) & 0xff] ^ t3[s1 & 0xff] ^ k[r],
+                t0[s1 >> 24] ^ t1[(s0 >> 16) & 0xff] ^ t2[(s3 >> 8) & 0xff] ^ t3[s2 & 0xff] ^ k[r + 1],
+                t0[s2 >> 24] ^ t1[(s1 >> 16) & 0xff] ^ t2[(s0 >> 8) & 0xff] ^ t3[s3 & 0xff] ^ k[r + 2],
+                t0[s3 >> 24] ^ t1[(s2 >> 16) & 0xff] ^ t2[(s1 >> 8) & 0xff] ^ t3[s0 & 0xff] ^ k[r + 3])
+        r = 4 * self.rounds
+        return (
+            ((sbox[s0 >> 24] << 24) | (sbox[(s3 >> 16) & 0xff] << 16) |
+             (sbox[(s2 >> 8) & 0xff] << 8) | sbox[s1 & 0xff]) ^ k[r],
+            ((sbox[s1 >> 24] << 24) | (sbox[(s0 >> 16) & 0xff] << 16) |
+             (sbox[(s3 >> 8) & 0xff] << 8) | sbox[s2 & 0xff]) ^ k[r + 1],
+            ((sbox[s2 >> 24] << 24) | (sbox[(s1 >> 16) & 0xff] << 16) |
+             (sbox[(s0 >> 8) & 0xff] << 8) | sbox[s3 & 0xff]) ^ k[r + 2],
+            ((sbox[s3 >> 24] << 24) | (sbox[(s2 >> 16) & 0xff] << 16) |
+             (sbox[(s1 >> 8) & 0xff] << 8) | sbox[s0 & 0xff]) ^ k[r + 3])
+
+    def encrypt(self, data):
+
+        if len(data) % 16: raise Exception("Input must be a multiple of 16 bytes.")
+        words = unpack(">{}I".format(len(data) / 4), data)
+        output = []
+        c0, c1, c2, c3 = self.iv
+        for i in range(0, len(words), 4):
+            c0, c1, c2, c3 = self._encryptBlock(words[i] ^ c0, words[i + 1] ^ c1,
+                                                words[i + 2] ^ c2, words[i + 3] ^ c3)
+            output += (c0, c1, c2, c3)
+        self.iv = c0, c1, c2, c3
+        return pack(">{}I".format(len(output)), *output)
+
+    def decrypt(self, data):
+
+        if len(data) % 16: raise Exception("Input must be a multiple of 16 bytes.")
+        words = unpack(">{}I".format(len(data) / 4), data)
+        output = []
+        p0, p1, p2, p3 = self.iv
+        for i in range(0, len(words), 4):
+            c = words[i:i + 4]
+            d0, d1, d2, d3 = self._decryptBlock(*c)
+            output += (d0 ^ p0, d1 ^ p1, d2 ^ p2, d3 ^ p3)
+            p0, p1, p2, p3 = c
+        self.iv = p0, p1, p2, p3
+        return pack(">{}I".format(len(output)), *output)
+
+class PurePythonCTR(object):
+
+    """
+    AES-CTR, using PurePythonCipher's block function.
+    """
+
+    def __init__(self, key, counter):
+
+        self.cipher = PurePythonCipher(key, "\x00" * 16)
+        self.counter = long(counter.encode("hex"), 16)
+        self.keystream = "" # left over from the last call
+
+    def encrypt(self, data):
+
+        if not data: return ""
+        data = data[:] # a str, if it was a buffer
+        words = []
+        for i in range((len(data) - len(self.keystream) + 15) / 16):
+            c = self.counter
+            words += self.cipher._encryptBlock(c >> 96, (c >> 64) & 0xffffffff,
+                                               (c >> 32) & 0xffffffff,
+                                               c & 0xffffffff)
+            self.counter = (c + 1) % 2 ** 128
+        keystream = self.keystream + pack(">{}I".format(len(words)), *words)
+        self.keystream = keystream[len(data):]
+        mixed = long(data.encode("hex"), 16) ^ \
+                long(keystream[:len(data)].encode("hex"), 16)
+        return ("%0*x" % (2 * len(data), mixed)).decode("hex")
+
+    decrypt = encrypt
+
+class PurePythonBackend(Backend):
+
+    """
+    The fallback, when neither PyCrypto nor cryptography is installed.
+    """
+
+    name = "python"
+
+    def newCipher(self, key, iv):
+
+        return PurePythonCipher(key, iv)
+
+    def newCTR(self, key, counter):
+
+        return PurePythonCTR(key, counter)
+
+backends = [CryptographyBackend, PyCryptoBackend, PurePythonBackend]
+# in order of preference, if there's no time to benchmark them
+
+fastest = None # cached result of getBackend()'s benchmark
+
+def availableBackends():
+    """ Returns the backend classes which can be used on this system. """
+
+    return [backend for backend in backends if backend.available()]
+
+def measure(backend, size=1024 * 1024, seconds=None):
+    """
+    Returns a backend's AES-CBC throughput in MB/s, encrypting then decrypting
+    size bytes. If seconds is given, repeat for at least that long.
+    """
+
+    key, iv = "\x00" * 32, "\x00" * 16
+    data = "\x00" * size
+    total, start = 0, time()
+    while True:
+        backend.newCipher(key, iv).decrypt(backend.newCipher(key, iv).encrypt(data))
+        total += 2 * size
+        if not seconds or time() - start >= seconds: break
+    return total / (time() - start) / 1024 / 1024
+
+def getBackend(name=None):
+    """
+    Return an instance of the backend called name. If no name is given, use
+    the one named by the KOPY_BACKEND environment variable, or else the
+    fastest one installed, as measured by a short benchmark the first time.
+    """
+
+    global fastest
+
+    name = name or os.environ.get("KOPY_BACKEND")
+    if name:
+        for backend in backends:
+            if backend.name == name:
+                if not backend.available():
+                    raise Exception("Crypto backend {} isn't installed.".format(name))
+                return backend()
+        raise Exception("Unknown crypto backend: {}.".format(name))
+
+    if fastest is None:
+        native = [backend() for backend in availableBackends()
+                  if backend is not PurePythonBackend]
+        if not native:
+            fastest = PurePythonBackend
+        elif len(native) == 1:
+            fastest = type(native[0])
+        else:
+            fastest = type(max(native, key=lambda b: measure(b, 64 * 1024)))
+    return fastest()
@@ -0,0 +1,160 @@
+"""
+Encrypting and decrypting whole directory trees of local files, with no
+network involved, spread across a pool of processes.
+
+Encrypted files are exactly what "openssl enc -aes-256-cbc -a -md md5" makes:
+base 64, wrapped at 64 characters, so they can be decrypted with
+
+    openssl enc -d -aes-256-cbc -a -md md5 -in file.enc
+
+(OpenSSL before 1.1 used md5 for key derivation by default, so "-md md5" can
+be left out there.)
+"""
+
+import os
+from multiprocessing import Pool, cpu_count
+from time import time
+
+from api.kopy import Kopy
+
+suffix = ".enc"
+
+class Wrapper(object):
+
+    """
+    File-like object which writes base 64 to destination with a newline
+    every width characters, and at the end, as OpenSSL does.
+    """
+
+    def __init__(self, destination, width=64):
+
+        self.destination = destination
+        self.width = width
+        self.column = 0
+
+    def write(self, data):
+
+        while data:
+            line = data[:self.width - self.column]
+            data = data[len(line):]
+            self.destination.write(line)
+            self.column += len(line)
+            if self.column == self.width:
+                self.destination.write("\n")
+                self.column = 0
+
+    def close(self):
+
+        if self.column: self.destination.write("\n")
+        self.column = 0
+
+kopy = None # each worker process's Kopy, created by its first task
+
+def _work(task):
+    """
+    Encrypt or decrypt one file, in a worker process. Returns
+    (source, bytes read, error message or None).
+    """
+
+    global kopy
+    operation, source, destination, passphrase, backend = task
+    if kopy is None: kopy = Kopy(backend=backend)
+
+    partial = destination + ".part"
+    try:
+        directory = os.path.dirname(destination)
+        if directory and not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory): raise # another worker made it
+
+        with open(source, "rb") as f, open(partial, "wb") as output:
+            if operation == "encrypt":
+                wrapper = Wrapper(output)
+                kopy.encryptStream(f, wrapper, passphrase)
+                wrapper.close()
+            else:
+                kopy.decryptStream(f, output, passphrase)
+        os.rename(partial, destination)
+        return source, os.path.getsize(source), None
+    except Exception as e:
+        if os.path.exists(partial): os.unlink(partial)
+        return source, 0, str(e) or e.__class__.__name__
+
+class Batch(object):
+
+    """
+    Encrypts (or, if operation is "decrypt", decrypts) every file under
+    source into the same place under destination, from processes worker
+    processes; by default, one per CPU. Encrypted files get a ".enc" suffix,
+    which decryption removes.
+    """
+
+    def __init__(self, operation, source, destination, passphrase,
+                 processes=None, backend=None):
+
+        if not operation in ["encrypt", "decrypt"]:
+            raise Exception("Unknown operation: {}.".format(operation))
+        if not os.path.isdir(source):
+            raise Exception("{} isn't a directory.".format(source))
+
+        inside = os.path.join(os.path.realpath(source), "")
+        if os.path.join(os.path.realpath(destination), "").startswith(inside):
+            raise Exception("The destination can't be inside the source.")
+
+        self.operation = operation
+        self.source = source
+        self.destination = destination
+        self.passphrase = passphrase
+        self.processes = processes or cpu_count()
+        self.backend = backend
+
+        self.files = 0
+        self.bytes = 0
+        self.errors = [] # (path, message)
+        self.elapsed = 0
+
+    def tasks(self):
+        """ Yields a task for _work for each file under source. """
+
+        for directory, directories, files in os.walk(self.source):
+            directories.sort()
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                target = os.path.relpath(path, self.source)
+                if self.operation == "encrypt":
+                    target += suffix
+                elif target.endswith(suffix):
+                    target = target[:-len(suffix)]
+                yield (self.operation, path, os.path.join(self.destination, target),
+                       self.passphrase, self.backend)
+
+    def run(self, log=None):
+        """
+        Process every file, writing any failures to log as they happen.
+        """
+
+        start = time()
+        pool = Pool(self.processes)
+        try:
+            for path, size, error in pool.imap_unordered(_work, self.tasks()):
+                self.files += 1
+                self.bytes += size
+                if error:
+                    self.errors.append((path, error))
+                    if log: log.write("{}: {}\n".format(path, error))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        self.elapsed = time() - start
+        return self
+
+    def report(self):
+
+        megabytes = self.bytes / 1024.0 ** 2
+        return ("{}ed {} files ({} failed), {:.1f} MB in {:.2f} s: {:.1f} MB/s " + \
+                "across {} processes").format(self.operation.capitalize(),
+                self.files, len(self.errors), megabytes, self.elapsed,
+                megabytes / self.elapsed if self.elapsed else 0, self.processes)
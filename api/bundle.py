@@ -0,0 +1,162 @@
+"""
+Bundles: many small files packed into one document, so sharing a directory
+takes one upload rather than one per file, and any of the files can be read
+back without the others.
+
+A bundle starts with a line identifying it, then its index as JSON on one
+line: a list of entries, each with the file's name, offset, size, mode
+(permissions, or null) and sha256. After that come the files' contents, one
+after another; offsets count from the end of the index.
+"""
+
+from hashlib import sha256
+from simplejson import dumps, loads
+
+from api.kopy import readable
+
+version = "1"
+magic = "kopycat bundle {}\n".format(version)
+
+class Finished(Exception):
+
+    """
+    Raised by Reader.write when nothing more of the bundle is wanted.
+    """
+
+def checkName(name):
+    """
+    Raise an exception unless name is a relative path which stays inside
+    the directory it's extracted to.
+    """
+
+    parts = name.split("/")
+    if not name or "\0" in name or "\\" in name or \
+       any(part in ["", ".", ".."] for part in parts):
+        raise Exception("Bad name for a bundle entry: {!r}.".format(name))
+
+def checkMode(mode):
+    """
+    Raise an exception unless mode is None or plain permissions: no setuid,
+    setgid or sticky bits, which a bundle from someone else mustn't set.
+    """
+
+    if mode is not None and (not isinstance(mode, (int, long)) or
+                             isinstance(mode, bool) or not 0 <= mode <= 0777):
+        raise Exception("Bad mode for a bundle entry: {!r}.".format(mode))
+
+def pack(entries):
+    """
+    Returns a bundle, as a bytearray, of entries: (name, data) or
+    (name, data, mode) tuples, where data may be any buffer, such as an mmap
+    of the file.
+    """
+
+    index, offset = [], 0
+    entries = [tuple(entry) + (None,) * (3 - len(entry)) for entry in entries]
+    for name, data, mode in entries:
+        checkName(name)
+        checkMode(mode)
+        if any(entry["name"] == name for entry in index):
+            raise Exception("{} is in the bundle twice.".format(name))
+        index.append({"name": name, "offset": offset, "size": len(data),
+                      "mode": mode, "sha256": sha256(readable(data)).hexdigest()})
+        offset += len(data)
+
+    bundle = bytearray(magic + dumps(index) + "\n")
+    for name, data, mode in entries: bundle += readable(data)
+    return bundle
+
+class Reader(object):
+
+    """
+    File-like object which unpacks a bundle written to it a chunk at a time
+    (by Kopy.streamDocument, say), so only the wanted entries are held, and
+    then only a chunk at a time.
+
+    Once the index has arrived, it's kept in index, and open(entry) is called
+    for each entry in names (by default, all of them) to get a file-like
+    object for its contents, which is closed at the end of the entry. Other
+    entries are skipped. Once nothing more is wanted (straight after the
+    index, if there's no open), write raises Finished, so the rest needn't
+    be read.
+    """
+
+    def __init__(self, open=None, names=None):
+
+        self.open = open
+        self.names = names
+        self.index = None
+        self.header = ""
+        self.pending = [] # entries wanted, by offset
+        self.position = 0 # in the contents
+        self.current = None # (entry, file, hash) being written
+
+    def write(self, data):
+
+        if self.index is None:
+            data = self._readHeader(data)
+            if data is None: return
+
+        while True:
+            if self.current:
+                entry, f, digest = self.current
+                piece = data[:entry["offset"] + entry["size"] - self.position]
+                if piece:
+                    f.write(piece)
+                    digest.update(piece)
+                    self.position += len(piece)
+                    data = data[len(piece):]
+                if self.position < entry["offset"] + entry["size"]: return
+                self._finishEntry()
+
+            if not self.pending: raise Finished()
+            skip = self.pending[0]["offset"] - self.position
+            if skip > len(data):
+                self.position += len(data)
+                return
+            self.position += skip
+            data = data[skip:]
+            entry = self.pending.pop(0)
+            self.current = entry, self.open(entry), sha256()
+
+    def close(self):
+        """ Check nothing wanted was missing from the bundle. """
+
+        if self.index is None or self.current or self.pending:
+            raise Exception("The bundle is incomplete.")
+
+    def _readHeader(self, data):
+        """
+        Collect the header; returns the data following it, or None if it
+        isn't all there yet.
+        """
+
+        self.header += data
+        if not self.header.startswith(magic[:len(self.header)]):
+            raise Exception("Document isn't a bundle.")
+        end = self.header.find("\n", len(magic))
+        if end == -1: return None
+
+        self.index = loads(self.header[len(magic):end])
+        data, self.header = self.header[end + 1:], None
+        for entry in self.index:
+            checkName(entry["name"])
+            checkMode(entry.get("mode"))
+
+        if self.open is None: raise Finished()
+        names = set(entry["name"] for entry in self.index)
+        missing = sorted(set(self.names or []) - names)
+        if missing:
+            raise Exception("Not in the bundle: {}.".format(", ".join(missing)))
+        self.pending = sorted((entry for entry in self.index
+                               if self.names is None or entry["name"] in self.names),
+                              key=lambda entry: entry["offset"])
+        return data
+
+    def _finishEntry(self):
+
+        entry, f, digest = self.current
+        self.current = None
+        f.close()
+        if digest.hexdigest() != entry["sha256"]:
+            raise Exception("{} is corrupt.".format(entry["name"]))
@@ -0,0 +1,209 @@
+"""
+A persistent, size-bounded cache of documents retrieved from kopy.io, and an
+index of documents uploaded there.
+"""
+
+import os
+from threading import Lock
+from time import time
+
+def defaultPath(name):
+    """ Returns the path of a file in kopycat's cache directory. """
+
+    root = os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache")
+    return os.path.join(root, "kopycat", name)
+
+def connect(path):
+    """
+    Open (creating if need be) an sqlite database only the user can read,
+    which is safe to use from several threads as long as they hold a lock.
+    """
+
+    import sqlite3 # only needed if there's a cache, so not at startup
+
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory): os.makedirs(directory, 0700)
+    os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0600))
+    return sqlite3.connect(path, check_same_thread=False)
+
+class DocumentCache(object):
+
+    """
+    Keeps the server's JSON response for each document, exactly as received;
+    encrypted documents stay encrypted at rest. Plaintext documents, of course,
+    don't. Kopy stores them under the document's URL rather than just its
+    identifier, so the same identifier on two servers isn't confused.
+
+    Entries expire after the document's keep window, or maxAge seconds if it's
+    shorter or unknown. kopy.io doesn't say when a document was created, so
+    the keep window is counted from when it was fetched, and is an upper bound.
+    When the cache grows past maxBytes, the least recently used entries go.
+    """
+
+    maxBytes = 64 * 1024 * 1024
+    maxAge = 24 * 3600
+
+    clock = staticmethod(time)
+
+    def __init__(self, path=None, maxBytes=None, maxAge=None):
+
+        if maxBytes != None: self.maxBytes = maxBytes
+        if maxAge != None: self.maxAge = maxAge
+
+        self.path = path or defaultPath("documents.sqlite")
+        self.lock = Lock()
+        self.db = connect(self.path)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS documents (id TEXT " + \
+                            "PRIMARY KEY, body TEXT, size INTEGER, " + \
+                            "expires REAL, used REAL)")
+            self.db.execute("CREATE INDEX IF NOT EXISTS documentsUsed " + \
+                            "ON documents (used)")
+
+    def get(self, documentId):
+        """
+        Returns the cached response for documentId, or None.
+        """
+
+        now = self.clock()
+        with self.lock, self.db:
+            row = self.db.execute("SELECT body, expires FROM documents " + \
+                                  "WHERE id = ?", (documentId,)).fetchone()
+            if row is None: return None
+            if row[1] <= now:
+                self.db.execute("DELETE FROM documents WHERE id = ?", (documentId,))
+                return None
+            self.db.execute("UPDATE documents SET used = ? WHERE id = ?",
+                            (now, documentId))
+            return row[0]
+
+    def put(self, documentId, body, keep=None):
+        """
+        Cache a response for documentId, which the server keeps for keep
+        seconds.
+        """
+
+        try:
+            lifetime = min(int(keep), self.maxAge)
+        except (TypeError, ValueError):
+            lifetime = self.maxAge
+
+        size = len(body)
+        if lifetime <= 0 or size > self.maxBytes: return
+
+        now = self.clock()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO documents VALUES (?, ?, ?, ?, ?)",
+                            (documentId, body, size, now + lifetime, now))
+            self._evict(now)
+
+    def _evict(self, now):
+
+        self.db.execute("DELETE FROM documents WHERE expires <= ?", (now,))
+        total = self.db.execute("SELECT SUM(size) FROM documents").fetchone()[0] or 0
+        if total <= self.maxBytes: return
+
+        evicted = []
+        for documentId, size in self.db.execute("SELECT id, size FROM " + \
+                                                "documents ORDER BY used"):
+            if total <= self.maxBytes: break
+            evicted.append((documentId,))
+            total -= size
+        self.db.executemany("DELETE FROM documents WHERE id = ?", evicted)
+
+    def size(self):
+        """ Returns the number of bytes cached. """
+
+        with self.lock:
+            return self.db.execute("SELECT SUM(size) FROM documents").fetchone()[0] or 0
+
+    def clear(self):
+
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM documents")
+
+class UploadIndex(object):
+
+    """
+    Remembers what's been uploaded, so uploading the same thing again can
+    return the earlier document instead. Each upload is keyed by a hash of
+    its contents and of how it was uploaded (server, passphrase, keep,
+    compression and so on; see key()), and maps to the document's identifier, its
+    passphrase and when it expires.
+
+    Generated passphrases are stored as they are, so they can be handed out
+    again; like the document cache, the database is only readable by the
+    user. Explicit passphrases only go into the hash.
+
+    An earlier upload is only reused if it has at least minimumLife seconds
+    left, so the document returned may expire sooner than a new one would.
+    hits and misses count lookups.
+    """
+
+    minimumLife = 60
+
+    clock = staticmethod(time)
+
+    def __init__(self, path=None, minimumLife=None):
+
+        if minimumLife != None: self.minimumLife = minimumLife
+
+        self.path = path or defaultPath("uploads.sqlite")
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.db = connect(self.path)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS uploads (key TEXT " + \
+                            "PRIMARY KEY, id TEXT, passphrase TEXT, expires REAL)")
+
+    def key(self, document, passphrase=None, generated=False, **options):
+        """
+        Returns the key for uploading document (any buffer) with passphrase,
+        or with a generated one, and any other options which change what's
+        stored, such as the server's URL, keep or compression. keep has to be
+        one of them, or asking for a paste to be kept for a month could
+        return one uploaded to last ten minutes.
+        """
+
+        from hashlib import sha256
+        from simplejson import dumps
+        from api.kopy import readable
+
+        key = sha256("generated" if generated else "plaintext"
+                     if passphrase is None else "encrypted\0" + passphrase)
+        key.update("\0" + dumps(options, sort_keys=True) + "\0")
+        key.update(sha256(readable(document)).digest())
+        return key.hexdigest()
+
+    def get(self, key):
+        """
+        Returns (identifier, passphrase) of an earlier upload with key which
+        hasn't expired, or None.
+        """
+
+        now = self.clock()
+        with self.lock, self.db:
+            row = self.db.execute("SELECT id, passphrase, expires FROM uploads " + \
+                                  "WHERE key = ?", (key,)).fetchone()
+            if row is None or row[2] < now + self.minimumLife:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return str(row[0]), row[1] and row[1].encode("utf-8")
+
+    def put(self, key, documentId, passphrase, keep):
+        """
+        Record an upload, which the server keeps for keep seconds.
+        """
+
+        now = self.clock()
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO uploads VALUES (?, ?, ?, ?)",
+                            (key, documentId, passphrase, now + int(keep)))
+            self.db.execute("DELETE FROM uploads WHERE expires <= ?", (now,))
+
+    def clear(self):
+
+        with self.lock, self.db:
+            self.db.execute("DELETE FROM uploads")
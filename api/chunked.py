@@ -0,0 +1,238 @@
+"""
+The "chunked" encryption scheme: the document is cut into fixed-size chunks,
+each encrypted with AES-256-CTR and authenticated with HMAC-SHA256 on its
+own, so they can be encrypted and decrypted in parallel, and a corrupted
+chunk is rejected before it's decrypted (or anything after it downloaded.)
+Only kopycat can read these documents; the "encrypted" scheme remains the
+default, as the kopy.io web site can read that.
+
+Before base 64 encoding, a document is a header, then its chunks:
+
+    magic (8 bytes) | chunk size (4) | PBKDF2 iterations (4) | salt (16)
+    ciphertext (chunk size bytes, less for the last chunk) | tag (32)
+    ...
+
+The AES and HMAC keys are the two halves of 64 bytes of PBKDF2-HMAC-SHA256
+from the passphrase and salt. Chunk i is encrypted with the counter starting
+at i << 64, and its tag covers the header, i, whether it's the last chunk,
+and its ciphertext, so chunks can't be swapped, dropped or cut short without
+it being noticed. There's always at least one chunk.
+"""
+
+from base64 import b64encode
+from struct import pack, unpack
+
+from api.kopy import Base64Decoder, readable, toBytes
+
+magic = "KopyCH01"
+headerFormat = ">8sII16s"
+headerLength = 32
+tagLength = 32
+
+chunkSize = 64 * 1024 # bytes of plaintext per chunk
+iterations = 100000 # of PBKDF2, for new documents
+
+# The header comes from whoever made the document, so documents demanding
+# much more work or memory than kopycat's own are refused
+maxIterations = 10 * iterations
+maxChunkSize = 16 * chunkSize
+
+_pool = None # threads shared by every Kopy
+
+def _map(function, items):
+    """
+    map() across a pool of one thread per CPU, which is created the first
+    time there's more than one item. The backends which do their work in
+    OpenSSL let go of the GIL, so chunks really are processed in parallel.
+    """
+
+    global _pool
+    if len(items) < 2: return map(function, items)
+    if _pool is None:
+        from multiprocessing import cpu_count
+        from multiprocessing.pool import ThreadPool
+        _pool = ThreadPool(cpu_count())
+    return _pool.map(function, items)
+
+class Keys(object):
+
+    """
+    The keys for one document, and what it takes to encrypt or decrypt its
+    chunks.
+    """
+
+    def __init__(self, kopy, passphrase, salt, size=None, rounds=None):
+        """
+        size and rounds default to chunkSize and iterations.
+        """
+
+        if size is None: size = chunkSize
+        if rounds is None: rounds = iterations
+        if not 0 < rounds <= maxIterations: raise Exception("Bad iteration count.")
+        if not 0 < size <= maxChunkSize: raise Exception("Bad chunk size.")
+        if len(salt) != 16: raise Exception("Bad salt.")
+
+        self.backend = kopy.backend
+        self.chunkSize = size
+        self.header = pack(headerFormat, magic, size, rounds, salt)
+        with kopy._phase("derive"):
+            keys = self.backend.pbkdf2(toBytes(passphrase), salt, rounds, 64)
+        self.aesKey, self.macKey = keys[:32], keys[32:]
+
+    @classmethod
+    def fromHeader(cls, kopy, passphrase, header):
+
+        if len(header) < headerLength or not header.startswith(magic):
+            raise Exception("Bad chunked header.")
+        found, size, count, salt = unpack(headerFormat, header[:headerLength])
+        return cls(kopy, passphrase, salt, size, count)
+
+    def _tag(self, index, final, ciphertext):
+
+        mac = self.backend.newHMAC(self.macKey)
+        mac.update(self.header)
+        mac.update(pack(">QB", index, final))
+        mac.update(ciphertext)
+        return mac.digest()
+
+    def _ctr(self, index):
+
+        return self.backend.newCTR(self.aesKey, pack(">QQ", index, 0))
+
+    def seal(self, chunk):
+        """
+        Takes (index, whether it's the last chunk, plaintext), and returns
+        the chunk's ciphertext and tag.
+        """
+
+        index, final, plaintext = chunk
+        ciphertext = self._ctr(index).encrypt(readable(plaintext))
+        return ciphertext + self._tag(index, final, ciphertext)
+
+    def open(self, chunk):
+        """
+        Takes (index, whether it's the last chunk, ciphertext and tag),
+        checks the tag, then returns the plaintext.
+        """
+
+        from hmac import compare_digest
+
+        index, final, chunk = chunk
+        ciphertext, tag = chunk[:-tagLength], chunk[-tagLength:]
+        if len(chunk) < tagLength or \
+           not compare_digest(tag, self._tag(index, final, ciphertext)):
+            raise Exception("Chunk {} is corrupt, or the passphrase is wrong."
+                            .format(index))
+        return self._ctr(index).encrypt(ciphertext)
+
+class Encryptor(object):
+
+    """
+    Encrypts a document a chunk at a time, like kopy.Encryptor; each call
+    to update() encrypts whatever whole chunks it can in parallel. The last
+    chunk of plaintext seen is held back, since it may turn out to be the
+    final one.
+    """
+
+    def __init__(self, kopy, passphrase, salt=None):
+
+        self.kopy = kopy
+        self.keys = Keys(kopy, passphrase, salt or kopy._randomBytes(16))
+        self.index = 0
+        self.plaintext = ""
+        self.ciphertext = self.keys.header # < 3 bytes, waiting to be b64'd
+        self.finished = False
+
+    def _encode(self, ciphertext):
+
+        ciphertext = self.ciphertext + ciphertext
+        end = len(ciphertext) - len(ciphertext) % 3
+        self.ciphertext = ciphertext[end:]
+        return b64encode(ciphertext[:end])
+
+    def _seal(self, plaintext, final=False):
+
+        size = self.keys.chunkSize
+        chunks = [(self.index + i, final and start + size >= len(plaintext),
+                   buffer(plaintext, start, size))
+                  for i, start in enumerate(range(0, len(plaintext), size) or [0])]
+        self.index += len(chunks)
+        with self.kopy._phase("encrypt", len(plaintext)):
+            return "".join(_map(self.keys.seal, chunks))
+
+    def update(self, chunk):
+
+        if self.finished: raise Exception("Encryptor has already been finalized.")
+
+        plaintext = self.plaintext + toBytes(chunk) if self.plaintext else readable(chunk)
+        end = (len(plaintext) - 1) / self.keys.chunkSize * self.keys.chunkSize
+        if end <= 0:
+            self.plaintext = toBytes(plaintext)
+            return ""
+        self.plaintext = toBytes(buffer(plaintext, end))
+        return self._encode(self._seal(buffer(plaintext, 0, end)))
+
+    def finalize(self):
+
+        if self.finished: raise Exception("Encryptor has already been finalized.")
+        self.finished = True
+
+        ciphertext = self.ciphertext + self._seal(self.plaintext, True)
+        self.ciphertext = self.plaintext = ""
+        return b64encode(ciphertext)
+
+class Decryptor(object):
+
+    """
+    Decrypts base 64 chunked ciphertext a chunk at a time; each call to
+    update() checks and decrypts whatever whole chunks have arrived, in
+    parallel, and raises an exception at the first corrupt one. The last
+    chunk is held back until finalize(), so it can be checked as such.
+    """
+
+    def __init__(self, kopy, passphrase):
+
+        self.kopy = kopy
+        self.passphrase = passphrase
+        self.keys = None # created once the header has been read
+        self.decoder = Base64Decoder()
+        self.index = 0
+        self.ciphertext = ""
+        self.finished = False
+
+    def _open(self, ciphertext, final=False):
+
+        size = self.keys.chunkSize + tagLength
+        chunks = [(self.index + i, final and start + size >= len(ciphertext),
+                   ciphertext[start:start + size])
+                  for i, start in enumerate(range(0, len(ciphertext), size) or [0])]
+        self.index += len(chunks)
+        with self.kopy._phase("decrypt", len(ciphertext)):
+            return "".join(_map(self.keys.open, chunks))
+
+    def update(self, chunk):
+
+        if self.finished: raise Exception("Decryptor has already been finalized.")
+
+        self.ciphertext += self.decoder.update(chunk)
+        if self.keys is None:
+            if len(self.ciphertext) < headerLength: return ""
+            self.keys = Keys.fromHeader(self.kopy, self.passphrase,
+                                        self.ciphertext)
+            self.ciphertext = self.ciphertext[headerLength:]
+
+        size = self.keys.chunkSize + tagLength
+        end = (len(self.ciphertext) - 1) / size * size
+        if end <= 0: return ""
+        ciphertext = self.ciphertext[:end]
+        self.ciphertext = self.ciphertext[end:]
+        return self._open(ciphertext)
+
+    def finalize(self):
+
+        if self.finished: raise Exception("Decryptor has already been finalized.")
+        self.finished = True
+
+        self.decoder.finalize()
+        if self.keys is None: raise Exception("Bad chunked header.")
+        return self._open(self.ciphertext, True)
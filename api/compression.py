@@ -0,0 +1,68 @@
+"""
+Compression codecs for documents, applied before encryption.
+
+zlib is always available; lzma needs Python 3 or the backports.lzma package.
+"""
+
+import zlib
+
+try:
+    import lzma
+except ImportError:
+    try:
+        from backports import lzma
+    except ImportError:
+        lzma = None
+
+zlibLevel = 6
+lzmaThreshold = 1024 * 1024 # "auto" prefers lzma for documents at least this big
+
+def available():
+    """ Returns the names of the codecs which can be used. """
+
+    return ["zlib"] + (["lzma"] if lzma else [])
+
+def choose(size):
+    """
+    Pick a codec for a document of size bytes: lzma compresses text better,
+    but is much slower, so it's only worth it for big documents.
+    """
+
+    return "lzma" if lzma and size >= lzmaThreshold else "zlib"
+
+def _check(codec):
+
+    if not codec in available():
+        raise Exception("Unknown or unavailable compression: {}.".format(codec))
+
+def compress(data, codec):
+
+    _check(codec)
+    if codec == "zlib": return zlib.compress(data, zlibLevel)
+    return lzma.compress(data)
+
+def decompress(data, codec):
+
+    _check(codec)
+    if codec == "zlib": return zlib.decompress(data)
+    return lzma.decompress(data)
+
+def compressor(codec):
+    """
+    Returns an object whose compress() method takes data a chunk at a time,
+    and whose flush() method returns the rest.
+    """
+
+    _check(codec)
+    if codec == "zlib": return zlib.compressobj(zlibLevel)
+    return lzma.LZMACompressor()
+
+def decompressor(codec):
+    """
+    Returns an object whose decompress() method takes compressed data a chunk
+    at a time.
+    """
+
+    _check(codec)
+    if codec == "zlib": return zlib.decompressobj()
+    return lzma.LZMADecompressor()
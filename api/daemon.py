@@ -0,0 +1,270 @@
+"""
+A resident process which runs kopycat commands on behalf of short-lived
+clients, over a Unix socket, so they skip interpreter startup, imports, and
+(thanks to its warm connection pool) TCP and TLS handshakes.
+
+Both directions are a series of frames: a channel byte, a 4-byte big-endian
+length and a payload. The client sends its working directory ("c"), each
+argument ("a") and "r" to run. The daemon answers with stdout ("o") and
+stderr ("e") frames as they're written, and finally the exit status ("x").
+stdin is only read when the command asks for it: the daemon sends "w", and
+the client answers with an "i" frame of whatever it could read, which is
+empty at the end. So commands which don't read stdin leave it alone, for
+whatever comes after them (say, the rest of a shell loop's input.)
+"""
+
+import errno
+import os
+import socket
+from struct import pack, unpack
+
+from api.cache import defaultPath
+
+chunkSize = 64 * 1024
+
+def defaultSocket():
+    """
+    Returns where the daemon listens: $XDG_RUNTIME_DIR/kopycat.sock, or in
+    kopycat's cache directory.
+    """
+
+    if os.environ.get("XDG_RUNTIME_DIR"):
+        return os.path.join(os.environ["XDG_RUNTIME_DIR"], "kopycat.sock")
+    return defaultPath("daemon.sock")
+
+def sendFrame(sock, channel, payload=""):
+
+    sock.sendall(channel + pack(">I", len(payload)) + payload)
+
+def _recvExactly(sock, length):
+
+    data = []
+    while length:
+        chunk = sock.recv(min(length, chunkSize))
+        if not chunk: raise EOFError("Connection closed mid-frame.")
+        data.append(chunk)
+        length -= len(chunk)
+    return "".join(data)
+
+def recvFrame(sock):
+    """
+    Returns (channel, payload), or (None, None) if the connection closed
+    between frames.
+    """
+
+    header = sock.recv(5, socket.MSG_WAITALL)
+    if not header: return None, None
+    if len(header) < 5: header += _recvExactly(sock, 5 - len(header))
+    channel, length = header[0], unpack(">I", header[1:])[0]
+    return channel, _recvExactly(sock, length)
+
+class FrameWriter(object):
+
+    """
+    File-like object which sends whatever's written to it as frames on one
+    channel.
+    """
+
+    def __init__(self, sock, channel):
+
+        self.sock = sock
+        self.channel = channel
+
+    def write(self, data):
+
+        if data: sendFrame(self.sock, self.channel, data)
+
+    def flush(self):
+
+        pass
+
+    def isatty(self):
+
+        return False
+
+class FrameReader(object):
+
+    """
+    File-like object which reads the client's stdin from "i" frames.
+    """
+
+    def __init__(self, sock):
+
+        self.sock = sock
+        self.buffer = ""
+        self.finished = False
+
+    def _fill(self):
+
+        sendFrame(self.sock, "w")
+        channel, payload = recvFrame(self.sock)
+        if channel != "i" or not payload:
+            self.finished = True
+        else:
+            self.buffer += payload
+
+    def read(self, size=-1):
+
+        while not self.finished and (size < 0 or len(self.buffer) < size):
+            self._fill()
+        if size < 0: size = len(self.buffer)
+        data, self.buffer = self.buffer[:size], self.buffer[size:]
+        return data
+
+    def readline(self):
+
+        while not self.finished and not "\n" in self.buffer: self._fill()
+        end = self.buffer.find("\n") + 1 or len(self.buffer)
+        line, self.buffer = self.buffer[:end], self.buffer[end:]
+        return line
+
+    def __iter__(self):
+
+        return iter(self.readline, "")
+
+    def isatty(self):
+
+        return False
+
+def call(path, args, stdin, stdout, stderr, cwd=None):
+    """
+    Run a command in the daemon listening at path, relaying stdin (as the
+    daemon asks for it), stdout and stderr. Returns its exit status, or None
+    if no daemon is listening, in which case nothing has been read from
+    stdin.
+    """
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except socket.error:
+        sock.close()
+        return None
+
+    try:
+        sendFrame(sock, "c", cwd or os.getcwd())
+        for arg in args: sendFrame(sock, "a", arg)
+        sendFrame(sock, "r")
+
+        while True:
+            channel, payload = recvFrame(sock)
+            if channel == "o":
+                stdout.write(payload)
+                stdout.flush()
+            elif channel == "e":
+                stderr.write(payload)
+            elif channel == "w":
+                try:
+                    chunk = os.read(stdin.fileno(), chunkSize)
+                except EnvironmentError:
+                    chunk = "" # as good as the end of it
+                sendFrame(sock, "i", chunk)
+            elif channel == "x":
+                return int(payload)
+            else:
+                raise Exception("The daemon hung up.")
+    finally:
+        sock.close()
+
+class Daemon(object):
+
+    """
+    Listens on a Unix socket, only the user can connect to, and calls
+    run(args, stdin, stdout, stderr) for each client, in its working
+    directory; run returns the exit status.
+
+    Clients are served one at a time, since commands change the working
+    directory.
+    """
+
+    def __init__(self, path, run):
+
+        self.path = path
+        self.run = run
+        self.sock = None
+
+    def listen(self):
+        """
+        Bind the socket; fails if another daemon is already listening there.
+        """
+
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory): os.makedirs(directory, 0700)
+
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except socket.error:
+            pass # nobody's listening; any socket file left there is stale
+        else:
+            raise Exception("A daemon is already listening on {}.".format(self.path))
+        finally:
+            probe.close()
+
+        try:
+            os.unlink(self.path)
+        except OSError as e:
+            if e.errno != errno.ENOENT: raise
+
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0177)
+        try:
+            self.sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        self.sock.listen(16)
+        return self
+
+    def serve(self):
+        """
+        Serve clients until stop() is called.
+        """
+
+        try:
+            while self.sock:
+                try:
+                    client = self.sock.accept()[0]
+                except socket.error:
+                    if self.sock is None: return # stopped
+                    raise
+                try:
+                    self._handle(client)
+                except (EnvironmentError, socket.error, EOFError):
+                    pass # the client went away
+                finally:
+                    client.close()
+        finally:
+            self.stop()
+
+    def _handle(self, client):
+
+        cwd, args = None, []
+        while True:
+            channel, payload = recvFrame(client)
+            if channel == "c": cwd = payload
+            elif channel == "a": args.append(payload)
+            elif channel == "r": break
+            else: return
+
+        previous = os.getcwd()
+        os.chdir(cwd or previous)
+        try:
+            status = self.run(args, FrameReader(client), FrameWriter(client, "o"),
+                              FrameWriter(client, "e"))
+        finally:
+            os.chdir(previous)
+        sendFrame(client, "x", str(status or 0))
+
+    def stop(self):
+
+        sock, self.sock = self.sock, None
+        if sock is None: return
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+        sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
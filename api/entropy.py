@@ -0,0 +1,51 @@
+"""
+A pool of random bytes from the OS, read in bulk, for salts and generated
+passphrases.
+"""
+
+import os
+from threading import Lock
+
+class EntropyPool(object):
+
+    """
+    Hands out bytes from os.urandom, which is read refillSize bytes at a
+    time, so each salt or passphrase costs a slice rather than a system call
+    (or, as it was, a Python call per byte.) Safe to use from several
+    threads.
+
+    After a fork(), the child throws away whatever it inherited and starts
+    afresh, so parent and child never hand out the same bytes. Bytes waiting
+    in the pool are in the process' memory, of course; keep refillSize small.
+    """
+
+    refillSize = 4096
+
+    def __init__(self, refillSize=None):
+
+        if refillSize != None: self.refillSize = refillSize
+        self._reset()
+
+    def _reset(self):
+
+        self.pid = os.getpid()
+        self.lock = Lock() # not one another thread held when we forked
+        self.buffer = ""
+        self.position = 0
+
+    def read(self, length):
+        """ Returns length random bytes. """
+
+        if length <= 0: raise Exception("length must be a positive integer.")
+        if os.getpid() != self.pid: self._reset()
+
+        with self.lock:
+            if self.position + length > len(self.buffer):
+                self.buffer = self.buffer[self.position:] + \
+                              os.urandom(max(self.refillSize, length))
+                self.position = 0
+            data = self.buffer[self.position:self.position + length]
+            self.position += length
+            return data
+
+pool = EntropyPool() # shared by every Kopy in the process
@@ -0,0 +1,127 @@
+"""
+Following a growing file, like tail -f, and cutting what's appended to it
+into segments to upload.
+"""
+
+import io
+import os
+from time import time, sleep
+
+class Follower(object):
+
+    """
+    Reads what's appended to the file at path, from offset on (by default,
+    its current end), and hands it out in segments: a segment is due when
+    segmentSize bytes have arrived, or interval seconds after the first of
+    them did. Only new bytes are ever read.
+
+    If the file is truncated, it's followed from its new start; if it's
+    replaced (say, by log rotation), whatever was left of the old file is
+    read, then the new one is followed from its start.
+    """
+
+    readSize = 64 * 1024
+
+    def __init__(self, path, segmentSize=1024 ** 2, interval=60, poll=0.5,
+                 offset=None):
+
+        self.path = path
+        self.segmentSize = segmentSize
+        self.interval = interval
+        self.poll = poll # seconds between checks for more data
+
+        self.file = io.open(path, "rb", 0) # stdio's EOF can be sticky
+        self.offset = os.fstat(self.file.fileno()).st_size if offset is None \
+                      else offset
+        self.file.seek(self.offset)
+
+        self.pending = [] # bytes read, but not yet handed out
+        self.size = 0
+        self.started = None # when the first of them arrived
+
+    def next(self, timeout=None):
+        """
+        Wait for the next segment, and return it. Returns None if there's
+        none after timeout seconds.
+        """
+
+        giveUp = None if timeout is None else time() + timeout
+        while True:
+            self._read()
+            if self.size >= self.segmentSize or (self.started != None and
+               time() - self.started >= self.interval):
+                return self.flush()
+
+            wait = self.poll
+            if self.started != None:
+                wait = min(wait, self.started + self.interval - time())
+            if giveUp != None:
+                if time() >= giveUp: return None
+                wait = min(wait, giveUp - time())
+            sleep(max(wait, 0))
+
+    def flush(self):
+        """
+        Returns whatever has been read but not handed out yet, at most
+        segmentSize bytes of it, or None if there's nothing.
+        """
+
+        if not self.size: return None
+        data = "".join(self.pending)
+        segment, rest = data[:self.segmentSize], data[self.segmentSize:]
+        self.pending = [rest] if rest else []
+        self.size = len(rest)
+        self.started = time() if rest else None
+        return segment
+
+    def unread(self, segment):
+        """
+        Put a segment handed out by next() or flush() back, say because it
+        couldn't be uploaded, to be handed out again before anything newer.
+        """
+
+        if not segment: return
+        self.pending.insert(0, segment)
+        self.size += len(segment)
+        if self.started is None: self.started = time()
+
+    def _read(self):
+        """
+        Read whatever has been appended, up to a segment's worth.
+        """
+
+        while self.size < self.segmentSize:
+            chunk = self.file.read(min(self.readSize, self.segmentSize - self.size))
+            if not chunk:
+                if not self._reopen(): return
+                continue
+            if self.started is None: self.started = time()
+            self.pending.append(chunk)
+            self.size += len(chunk)
+            self.offset += len(chunk)
+
+    def _reopen(self):
+        """
+        Handle truncation and replacement of the file, once everything has
+        been read from it; returns True if there may be more to read.
+        """
+
+        try:
+            current = os.stat(self.path)
+        except OSError:
+            return False # between rotation and the new file appearing
+
+        if current.st_ino != os.fstat(self.file.fileno()).st_ino:
+            self.file.close()
+            self.file = io.open(self.path, "rb", 0)
+        elif current.st_size >= self.offset:
+            return False
+        else:
+            self.file.seek(0)
+
+        self.offset = 0
+        return True
+
+    def close(self):
+
+        self.file.close()
@@ -0,0 +1,151 @@
+"""
+Incremental parsing of the server's JSON responses, so a document's data can
+be handled as it arrives rather than once the whole response is in memory.
+"""
+
+import re
+from simplejson import loads
+
+whitespace = " \t\r\n"
+scalar = re.compile(r"(-?[0-9][0-9.eE+-]*|true|false|null)(?=[\s,}])")
+string = re.compile(r'"(?:[^"\\]|\\.)*"', re.S)
+escapes = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n",
+           "r": "\r", "t": "\t"}
+
+class DocumentParser(object):
+
+    """
+    Parses a JSON object whose values are strings, numbers, booleans or null,
+    like the server's responses. feed() returns the pieces of the "data"
+    string decoded so far (as UTF-8); every other field goes into fields,
+    and dataKeys is the set of fields which came before "data".
+    """
+
+    def __init__(self, key="data"):
+
+        self.key = key
+        self.fields = {}
+        self.dataKeys = None # fields seen when the data started
+        self.buffer = ""
+        self.state = "start"
+        self.currentKey = None
+        self.surrogate = None # high half of a \\u escaped surrogate pair
+
+    def feed(self, chunk):
+        """
+        Parse a chunk of the response, returning a list of pieces of data.
+        """
+
+        self.buffer += chunk
+        pieces = []
+        while self.buffer:
+            if self.state == "data":
+                if not self._data(pieces): break
+                continue
+
+            self.buffer = self.buffer.lstrip(whitespace)
+            if not self.buffer: break
+            if not self._token(): break
+        return pieces
+
+    def close(self):
+        """
+        Check the response was complete, and return the fields.
+        """
+
+        if self.state != "end" or self.buffer.strip(whitespace):
+            raise Exception("Incomplete or malformed response.")
+        return self.fields
+
+    def _token(self):
+        """
+        Consume one token outside the data string; False if more input is
+        needed first.
+        """
+
+        c = self.buffer[0]
+        if self.state == "start":
+            if c != "{": raise Exception("Response isn't a JSON object.")
+            self.buffer, self.state = self.buffer[1:], "key"
+
+        elif self.state == "key":
+            if c == "}":
+                self.buffer, self.state = self.buffer[1:], "end"
+                return True
+            match = string.match(self.buffer)
+            if not match: return self._incomplete(c == '"')
+            self.currentKey = loads(match.group())
+            self.buffer, self.state = self.buffer[match.end():], "colon"
+
+        elif self.state == "colon":
+            if c != ":": raise Exception("Malformed response.")
+            self.buffer, self.state = self.buffer[1:], "value"
+
+        elif self.state == "value":
+            if self.currentKey == self.key and c == '"':
+                self.dataKeys = set(self.fields)
+                self.fields[self.key] = None # streamed, not stored
+                self.buffer, self.state = self.buffer[1:], "data"
+                return True
+            match = (string if c == '"' else scalar).match(self.buffer)
+            if not match:
+                return self._incomplete(c == '"' or c in "-0123456789tfn")
+            self.fields[self.currentKey] = loads(match.group())
+            self.buffer, self.state = self.buffer[match.end():], "comma"
+
+        elif self.state == "comma":
+            if c == ",": self.state = "key"
+            elif c == "}": self.state = "end"
+            else: raise Exception("Malformed response.")
+            self.buffer = self.buffer[1:]
+
+        else:
+            raise Exception("Unexpected content after the response.")
+        return True
+
+    def _incomplete(self, plausible):
+
+        if not plausible: raise Exception("Malformed response.")
+        return False
+
+    def _data(self, pieces):
+        """
+        Consume as much of the data string as possible; False if more input
+        is needed first.
+        """
+
+        end = len(self.buffer)
+        quote, backslash = self.buffer.find('"'), self.buffer.find("\\")
+        if quote != -1: end = quote
+        if backslash != -1: end = min(end, backslash)
+        if end:
+            if self.surrogate: raise Exception("Malformed \\u escape.")
+            pieces.append(self.buffer[:end])
+            self.buffer = self.buffer[end:]
+            return True
+
+        if self.buffer[0] == '"':
+            if self.surrogate: raise Exception("Malformed \\u escape.")
+            self.buffer, self.state = self.buffer[1:], "comma"
+            return True
+
+        # An escape sequence
+        if len(self.buffer) < 2: return False
+        c = self.buffer[1]
+        if c in escapes:
+            pieces.append(escapes[c])
+            self.buffer = self.buffer[2:]
+            return True
+        if c != "u": raise Exception("Malformed escape in response.")
+        if len(self.buffer) < 6: return False
+
+        code = int(self.buffer[2:6], 16)
+        self.buffer = self.buffer[6:]
+        if 0xd800 <= code < 0xdc00:
+            self.surrogate = code
+            return True
+        if self.surrogate:
+            code = 0x10000 + ((self.surrogate - 0xd800) << 10) + (code - 0xdc00)
+            self.surrogate = None
+        pieces.append(("\\U%08x" % code).decode("unicode-escape").encode("utf-8"))
+        return True
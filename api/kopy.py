@@ -1,13 +1,22 @@
 """
 Library and utility to interact with kopy.io's API.
+
+requests, simplejson, multiprocessing and the crypto libraries are slow to import, so
+they're imported when first needed, rather than here; kopycat is often run
+in loops where startup time matters.
 """
 
 from base64 import b64encode, b64decode
-from hashlib import md5
-from random import SystemRandom
-from simplejson import loads, dumps
-from requests import get, post 
-from Crypto.Cipher import AES
+from hashlib import sha256
+from collections import deque
+from threading import Event, Lock, Semaphore, Thread
+from string import whitespace
+from time import sleep, time
+from api.backends import Backend, getBackend
+from api import entropy
+from api.compression import compress, compressor, decompress, decompressor, \
+                            choose as chooseCompression
+from api.stats import Timer, percentile
 
 class Kopy(object):
 
@@ -22,7 +31,6 @@ class Kopy(object):
     ivLength = 16
     blockSize = 16
     saltLength = 8
-    passwordRandBytes = 100 # this must be > the length of an md5 hash (32 bytes)
 
     saltPadding = "Salted__" # this is half a block, and the salt is half a block
     ciphertextFormat = saltPadding + "{salt}{ciphertext}" # this is then b64'd
@@ -33,27 +41,212 @@ class Kopy(object):
     # to declare a paste was made with kopycat. Then again, maybe not.
 
     docNotFound = "Document not found."
-    cryptoSchemes = ["default", "encrypted"]
+    cryptoSchemes = ["default", "encrypted", "chunked"]
+    scheme = "encrypted" # for documents with a passphrase; see api.chunked
+
+    compressionThreshold = 4 * 1024 # "auto" leaves smaller documents alone
+
+    streamChunkSize = 64 * 1024 # bytes read per iteration by the *Stream methods
+    pipelineDepth = 4 # chunks held between the stages of createStream
+
+    poolSize = 10 # keep-alive connections held open to the server
+    timeout = 30 # seconds to wait on a connection or response, per attempt
+    retries = 3 # further attempts after connection errors and 5xx responses
+    retryBackoff = 0.5 # seconds before the first retry; doubles each time
+    rateLimit = None # requests per second, at most; see api.scheduler
+    deadline = None # seconds an operation may take in all, retries included
+
+    hedgePercentile = None # e.g. 95 to duplicate GETs slower than that
+    hedgeMinimum = 0.01 # seconds; never duplicate a GET sooner than this
+    hedgeSamples = 20 # GETs to time before hedging starts
+    hedgeWindow = 200 # recent GET latencies the percentile is taken over
+
+    workers = 8 # concurrent requests made by the bulk methods
+    shardSize = 1024 * 1024 # bytes of a file per document, for createMultipart
+
+    def __init__(self, session=None, poolSize=None, timeout=None, retries=None,
+                 backend=None, cache=None, url=None):
+
+        if url != None: self.url = url # any server implementing kopy.io's API
+        if poolSize != None: self.poolSize = poolSize
+        if timeout != None: self.timeout = timeout
+        if retries != None: self.retries = retries
+
+        self.entropy = entropy.pool # salts and generated passphrases come from here
+        self._session = session # created on first use; see the session property
+        self._scheduler = None # likewise
+        self._backend = backend
+        # backend may be an instance or a name from api.backends; by default,
+        # the fastest one installed. It's looked up on first use.
+
+        self.cache = cache # an api.cache.DocumentCache, used by _getDocument
+        self.refreshCache = False # if set, fetch documents even if they're cached
+        self.uploadIndex = None # an api.cache.UploadIndex, used by createDocument
+        self.listeners = [] # called with an api.stats.Event as each phase ends
+
+        self.latencies = deque(maxlen=self.hedgeWindow) # of recent GETs
+        self.hedges = 0 # duplicate GETs sent
+        self.latencyLock = Lock()
+
+    def addListener(self, listener):
+        """
+        Register a callable to receive an api.stats.Event for each phase of
+        each request: "derive" (key derivation), "pad", "encrypt", "base64",
+        "http", "json", "decrypt", "unpad", "compress" and "decompress".
+        Listeners are called from whichever thread did the work.
+        """
 
-    def __init__(self):
+        self.listeners.append(listener)
+
+    def removeListener(self, listener):
+
+        self.listeners.remove(listener)
+
+    def _phase(self, phase, bytes=0):
+        """
+        Returns a context manager which times a phase for the listeners.
+        """
+
+        return Timer(self.listeners, phase, bytes)
+
+    @property
+    def session(self):
+
+        if self._session is None: self._session = self._newSession()
+        return self._session
+
+    @session.setter
+    def session(self, session):
+
+        self._session = session
+
+    @property
+    def scheduler(self):
+        """
+        The api.scheduler.Scheduler every request goes through, allowing up
+        to poolSize requests at once, and rateLimit a second.
+        """
+
+        if self._scheduler is None:
+            from api.scheduler import Scheduler
+            self._scheduler = Scheduler(self.poolSize, rate=self.rateLimit)
+        return self._scheduler
+
+    @scheduler.setter
+    def scheduler(self, scheduler):
+
+        self._scheduler = scheduler
+
+    @property
+    def backend(self):
+
+        if not isinstance(self._backend, Backend):
+            self._backend = getBackend(self._backend)
+        return self._backend
+
+    @backend.setter
+    def backend(self, backend):
+
+        self._backend = backend
+
+    def _newSession(self):
+        """
+        Create a requests session which keeps up to self.poolSize connections
+        alive, so consecutive requests skip the TCP and TLS handshakes.
+        """
+
+        from requests import Session
+        from requests.adapters import HTTPAdapter
+
+        session = Session()
+        adapter = HTTPAdapter(pool_connections=self.poolSize,
+                              pool_maxsize=self.poolSize)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def _until(self, deadline=None):
+        """
+        Returns when an operation given deadline seconds (by default,
+        self.deadline) must be done by, or None if it has as long as it takes.
+        """
+
+        if deadline is None: deadline = self.deadline
+        return None if deadline is None else time() + deadline
+
+    def _remaining(self, until):
+        """
+        Returns the seconds left before until, or None if there's no deadline;
+        raises DeadlineExceeded if it has passed.
+        """
+
+        if until is None: return None
+        remaining = until - time()
+        if remaining <= 0: raise DeadlineExceeded("The operation took too long.")
+        return remaining
+
+    def _request(self, method, url, until=None, retry=True, **kwargs):
+        """
+        Make an HTTP request through the session, once the scheduler lets it
+        through. Connection errors, timeouts, 429s and 5xx responses are
+        retried up to self.retries times (unless retry is unset, say because
+        the body can only be sent once), with exponential backoff; the last
+        response (or exception) is passed on to the caller.
+
+        If there's a deadline (until, from _until), no attempt waits beyond it,
+        and DeadlineExceeded is raised instead of retrying past it. Note the
+        timeout applies to each wait for the server, so a response trickling
+        in can still overrun a little.
+        """
+
+        from requests.exceptions import ConnectionError, Timeout
+
+        kwargs.setdefault("verify", self.verifyCert)
+        timeout = kwargs.pop("timeout", self.timeout)
+
+        retries = self.retries if retry else 0
+        for attempt in range(retries + 1):
+            last = attempt == retries
+            try:
+                with self.scheduler.slot(until) as slot:
+                    remaining = self._remaining(until)
+                    kwargs["timeout"] = timeout if remaining is None \
+                                        else min(timeout, remaining)
+                    with self._phase("http") as phase:
+                        response = self.session.request(method, url, **kwargs)
+                        slot.status = response.status_code
+                        slot.retryAfter = response.headers.get("retry-after")
+                        if not kwargs.get("stream"):
+                            phase.bytes = len(response.content)
+            except (ConnectionError, Timeout):
+                if last: raise
+            else:
+                if (response.status_code < 500 and response.status_code != 429) \
+                   or last:
+                    return response
+                response.close()
 
-        self.randomness = SystemRandom()
+            backoff = self.retryBackoff * 2 ** attempt
+            if until != None and time() + backoff >= until:
+                raise DeadlineExceeded("The operation took too long, after " + \
+                                       "{} attempts.".format(attempt + 1))
+            sleep(backoff)
 
     def _randomBytes(self, length):
         """
         Return a specified number of bytes from the OSs random facility.
         """
 
-        if length <= 0: raise Exception("length must be a positive integer.")
-        return "".join([chr(self.randomness.getrandbits(8)) for i in range(length)])
+        return self.entropy.read(length)
 
     def _generateSalt(self):
 
-        return self.generateRandomBytes(self.saltLength)
+        return self._randomBytes(self.saltLength)
 
     def _parseCiphertext(self, ciphertext):
 
-        output = b64decode(ciphertext)
+        with self._phase("base64", len(ciphertext)):
+            output = b64decode(ciphertext)
         if not output.startswith(self.saltPadding):
             raise Exception("Bad salt padding.")
         if not len(output) % self.blockSize == 0:
@@ -71,12 +264,13 @@ class Kopy(object):
         if len(ciphertext) % self.blockSize != 0:
             raise Exception("Bad ciphertext.")
 
-        return b64encode(self.ciphertextFormat.format(salt=salt,
-                        ciphertext=ciphertext))
+        with self._phase("base64", len(ciphertext)):
+            return b64encode(self.ciphertextFormat.format(salt=salt,
+                            ciphertext=ciphertext))
 
     def _newAES(self, key, iv):
 
-        return AES.new(key, AES.MODE_CBC, iv)
+        return self.backend.newCipher(key, iv)
 
     def _getAESArgs(self, passphrase, salt):
         """
@@ -84,19 +278,27 @@ class Kopy(object):
         """
 
         if len(salt) != 8: raise Exception("Bad salt.")
-        return self.opensslKeyDerivation(passphrase, salt,
-                                        self.keyLength, self.ivLength)
+        with self._phase("derive"):
+            return self.opensslKeyDerivation(passphrase, salt,
+                                            self.keyLength, self.ivLength)
 
-    def _composeDocument(self, document, encryption, keep):
+    def _composeDocument(self, document, encryption, keep, **extra):
         """
         Create a dictionary to represent the document, for requests.post()'s
-        "data" parameter.
+        "data" parameter. kopy.io stores any other fields it's given, so extra
+        metadata (like "compression") goes in as keyword arguments.
+
+        encryption is the name of the scheme the document was encrypted with,
+        or, for short, True for "encrypted" or False for none.
         """
 
         output = self.documentFormat()
+        output.update(extra)
         output["data"] = document
         output["keep"] = keep
-        output["security"] = "encrypted" if encryption else "default"
+        if not isinstance(encryption, basestring):
+            encryption = "encrypted" if encryption else "default"
+        output["security"] = encryption
 
         return output
 
@@ -105,23 +307,36 @@ class Kopy(object):
         Parse a JSON string into a native Python datastructure.
         """
 
-        output = loads(json)
+        from simplejson import loads
+
+        with self._phase("json", len(json)):
+            output = loads(json)
         return output
 
-    def _postDocument(self, document, encryption=False, keep=600):
+    def _postDocument(self, document, encryption=False, keep=600, until=None,
+                      **extra):
         """
         Send a request to the API to create a new document, and keep it for a
         certain number of seconds.
 
         Returns a dictionary with a "key" element, containing the new document's
-        identifier.
+        identifier. If document is a bytearray of base 64, it's escaped as
+        it's sent, rather than copied into a str first.
         """
 
-        return self._parseDocument(post(self.url, verify=self.verifyCert,
-                                  data=self._composeDocument(document, encryption,
-                                  keep)).content)
+        fields = self._composeDocument(document, encryption, keep, **extra)
+        if not isinstance(document, bytearray):
+            return self._parseDocument(self._request("POST", self.url, until,
+                                       data=fields).content)
 
-    def _getDocument(self, documentId):
+        # encrypt() returns a bytearray for buffers; send it without copying
+        del fields["data"]
+        body = FormBody(fields, document)
+        return self._parseDocument(self._request("POST", self.url, until,
+                                   data=body, headers={"Content-Type":
+                                   "application/x-www-form-urlencoded"}).content)
+
+    def _getDocument(self, documentId, until=None):
         """
         Retrieve a document from the API.
 
@@ -132,16 +347,146 @@ class Kopy(object):
         "encrypted").
         If the document was not found, it will have a "message" element with the
         value "Document not found."
+
+        If there's a cache, responses are served from and stored in it, under
+        the document's URL, so other servers' documents don't collide.
+        If hedgePercentile is set, slow requests are hedged; see _hedgedGet.
+        """
+
+        if self.cache and not self.refreshCache:
+            cached = self.cache.get(self.url + documentId)
+            if cached != None: return self._parseDocument(cached)
+
+        start = time()
+        if self.hedgePercentile:
+            document = self._hedgedGet(self.url + documentId, until)
+        else:
+            document = self._request("GET", self.url + documentId, until)
+        with self.latencyLock: self.latencies.append(time() - start)
+
+        self._checkResponse(document.status_code,
+                            document.headers.get("content-type"))
+        output = self._parseDocument(document.text)
+
+        if self.cache and document.status_code == 200 and "data" in output:
+            self.cache.put(self.url + documentId, document.text,
+                           output.get("keep"))
+        return output
+
+    def _hedgeDelay(self):
+        """
+        Returns how long to wait for a GET before sending a duplicate: the
+        hedgePercentile-th percentile of recent GETs' latencies, or None until
+        hedgeSamples of them have been timed.
+        """
+
+        with self.latencyLock: latencies = sorted(self.latencies)
+        if len(latencies) < self.hedgeSamples: return None
+        return max(self.hedgeMinimum, percentile(latencies, self.hedgePercentile))
+
+    def _hedgedGet(self, url, until=None):
+        """
+        GET url, and if there's no response after _hedgeDelay(), GET it
+        again, returning whichever response arrives first. Both requests go
+        through _request, so retry on their own; an exception is only raised
+        if both fail. The slower request is left to finish in the background.
+        """
+
+        from Queue import Queue, Empty
+
+        results = Queue()
+        def attempt():
+            try:
+                results.put((self._request("GET", url, until), None))
+            except Exception as e:
+                results.put((None, e))
+
+        def send():
+            thread = Thread(target=attempt)
+            thread.daemon = True
+            thread.start()
+
+        send()
+        sent, failed, wait = 1, 0, self._hedgeDelay()
+        while True:
+            try:
+                response, error = results.get(timeout=wait)
+            except Empty:
+                send()
+                with self.latencyLock: self.hedges += 1
+                sent, wait = 2, None
+                continue
+
+            if error is None: return response
+            failed += 1
+            if failed == sent: raise error
+            wait = None # for the other request
+
+    def _checkResponse(self, status, contentType):
+        """
+        Raise an exception if the server's response to a GET can't contain a
+        document.
         """
 
-        document = get(self.url + documentId, verify=self.verifyCert)
-        if not document.status_code in [200, 404]: 
+        if not status in [200, 404]:
             raise Exception("Failed to retrieve document due to unkown error.")
-        if not ("content-type" in document.headers and \
-                document.headers["content-type"] == "application/json"):
+        if contentType != "application/json":
             raise Exception("Document has invalid content-type.")
-        else:
-            return self._parseDocument(document.text)
+
+    def _bulk(self, function, items, workers=None, ordered=True):
+        """
+        Call function on each item from a pool of threads, yielding
+        (index, result, exception) tuples; one of result and exception is None.
+        If ordered, results are yielded in the order of items, as soon as all
+        earlier items have finished; otherwise as each item finishes.
+
+
+        Only a couple of items per thread are taken from items before their
+        results have been yielded, so items can be a generator reading a file.
+        """
+
+        from multiprocessing.pool import ThreadPool
+
+        workers = min(workers or self.workers, self.poolSize)
+        # There's no point in running more threads than pooled connections.
+        slots = Semaphore(2 * workers)
+        stopped = []
+
+        def feed():
+            # Runs in the pool's task handler thread
+            index = 0
+            source = iter(items)
+            while True:
+                slots.acquire()
+                if stopped: return
+                try:
+                    item = next(source)
+                except StopIteration:
+                    return
+                except Exception as e:
+                    yield index, Failure(e) # reading items failed; pass it on
+                    return
+                yield index, item
+                index += 1
+
+        def call(pair):
+            index, item = pair
+            try:
+                if isinstance(item, Failure): raise item.exception
+                return index, function(item), None
+            except Exception as e:
+                return index, None, e
+
+        pool = ThreadPool(workers)
+        try:
+            imap = pool.imap if ordered else pool.imap_unordered
+            for result in imap(call, feed()):
+                slots.release()
+                yield result
+        finally:
+            stopped.append(True)
+            slots.release() # in case feed() is waiting
+            pool.terminate()
 
     def _pad(self, message):
         """
@@ -149,8 +494,8 @@ class Kopy(object):
         characters to pad (ie, pad one byte with \x01). Pad to self.blockSize.
         """
 
-        pad = self.blockSize - (len(message) % self.blockSize)
-        return message + "".join([chr(pad) for i in range(pad)])
+        with self._phase("pad", len(message)):
+            return self.backend.pad(message, self.blockSize)
 
     def _unpad(self, message):
         """
@@ -158,41 +503,147 @@ class Kopy(object):
         characters to pad (ie, pad one byte with \x01).
         """
 
-        if len(message) % self.blockSize != 0:
-            raise Exception("Message is not properly sized.")
-
-        pad = ord(message[-1])
-        if pad > self.blockSize: raise Exception("Bad padding.")
-
-        output = message[:-pad]
-        padding = message[-pad:]
-        for i in padding:
-            if ord(i) != pad: raise Exception("Bad padding.")
-
-        return output
+        with self._phase("unpad", len(message)):
+            return self.backend.unpad(message, self.blockSize)
 
     def encrypt(self, document, passphrase, salt=None):
         """
         Encrypt a message with AES-256-CBC and OpenSSL-compatble passphrase.
         If no salt is given, a salt is generated; this is probably what you want.
+
+        document may be a str or any other buffer (bytearray, memoryview,
+        mmap); see encryptInto. The ciphertext of a buffer is returned as a
+        bytearray, so it isn't copied again.
         """
 
+        if not isinstance(document, basestring):
+            output = bytearray(self.encryptedSize(len(document)))
+            self.encryptInto(document, output, passphrase, salt)
+            return output
+
         if not salt: salt = self._generateSalt()
         key, iv = self._getAESArgs(passphrase, salt)
         document = self._pad(document)
 
-        aes = self._newAES(key, iv)
-        return self._formatCiphertext(salt, aes.encrypt(document))
+        with self._phase("encrypt", len(document)):
+            document = self._newAES(key, iv).encrypt(document)
+        return self._formatCiphertext(salt, document)
 
     def decrypt(self, document, passphrase):
         """
         Decrypt a message with AES-256-CBC and OpenSSL-compatible passphrase.
+        document may be a str or any other buffer; see decryptInto.
         """
 
+        if not isinstance(document, basestring):
+            output = bytearray(len(document) * 3 / 4)
+            return readable(output)[:self.decryptInto(document, output, passphrase)]
+
         salt, ciphertext = self._parseCiphertext(document)
         key, iv = self._getAESArgs(passphrase, salt)
-        aes = self._newAES(key, iv)
-        return self._unpad(aes.decrypt(ciphertext))
+        with self._phase("decrypt", len(ciphertext)):
+            document = self._newAES(key, iv).decrypt(ciphertext)
+        return self._unpad(document)
+
+    def encryptedSize(self, size):
+        """
+        Returns the length of the base 64 ciphertext of size bytes of
+        plaintext.
+        """
+
+        padded = size + self.blockSize - size % self.blockSize
+        return (padded + self.blockSize + 2) / 3 * 4 # the header is a block
+
+    def _chunks(self, data):
+        """
+        Yields views of successive streamChunkSize pieces of a buffer,
+        without copying it.
+        """
+
+        for start in range(0, len(data), self.streamChunkSize):
+            if isinstance(data, memoryview):
+                yield data[start:start + self.streamChunkSize]
+            else:
+                yield buffer(data, start, self.streamChunkSize)
+
+    def encryptInto(self, document, output, passphrase, salt=None):
+        """
+        Encrypt document, which may be any buffer (str, bytearray, memoryview,
+        mmap), and write the base 64 ciphertext into the writable buffer
+        output (bytearray, writable mmap or memoryview), which must hold at
+        least encryptedSize(len(document)) bytes. Returns the number of bytes
+        written.
+
+        The document is encrypted streamChunkSize bytes at a time, so it's
+        never copied whole; only the input and output are held in memory.
+        """
+
+        encryptor = self.encryptor(passphrase, salt)
+        offset = 0
+        for chunk in list(self._chunks(document)) + [None]:
+            piece = encryptor.finalize() if chunk is None else encryptor.update(chunk)
+            output[offset:offset + len(piece)] = piece
+            offset += len(piece)
+        return offset
+
+    def decryptInto(self, document, output, passphrase):
+        """
+        Decrypt base 64 ciphertext from any buffer into the writable buffer
+        output, which must hold at least len(document) * 3 / 4 bytes. Returns
+        the length of the plaintext.
+        """
+
+        decryptor = self.decryptor(passphrase)
+        offset = 0
+        for chunk in list(self._chunks(document)) + [None]:
+            piece = decryptor.finalize() if chunk is None else decryptor.update(chunk)
+            output[offset:offset + len(piece)] = piece
+            offset += len(piece)
+        return offset
+
+    def encryptor(self, passphrase, salt=None, scheme="encrypted"):
+        """
+        Return an Encryptor, for encrypting a document a chunk at a time, or
+        if scheme is "chunked", its equivalent from api.chunked.
+        """
+
+        if scheme == "chunked":
+            from api import chunked
+            return chunked.Encryptor(self, passphrase, salt)
+        return Encryptor(self, passphrase, salt)
+
+    def decryptor(self, passphrase, scheme="encrypted"):
+        """
+        Return a Decryptor, for decrypting a document a chunk at a time.
+        """
+
+        if scheme == "chunked":
+            from api import chunked
+            return chunked.Decryptor(self, passphrase)
+        return Decryptor(self, passphrase)
+
+    def encryptStream(self, source, destination, passphrase, salt=None):
+        """
+        Encrypt everything read from the file-like object source, and write the
+        base 64 output to destination. Memory use doesn't depend on the size of
+        the input.
+        """
+
+        encryptor = self.encryptor(passphrase, salt)
+        for chunk in iter(lambda: source.read(self.streamChunkSize), ""):
+            destination.write(encryptor.update(chunk))
+        destination.write(encryptor.finalize())
+
+    def decryptStream(self, source, destination, passphrase):
+        """
+        Decrypt base 64 ciphertext read from the file-like object source, and
+        write the plaintext to destination.
+        """
+
+        decryptor = self.decryptor(passphrase)
+        for chunk in iter(lambda: source.read(self.streamChunkSize), ""):
+            destination.write(decryptor.update(chunk))
+        destination.write(decryptor.finalize())
 
     def generateRandomBytes(self, length=14):
         """
@@ -201,58 +652,560 @@ class Kopy(object):
 
         The default length is the same as kopy.io uses.
 
-        The entropy should be at its upper bound, which is 8 * length bits.
-        But I'm not a cryptographer.
+        Each digit carries 4 bits of entropy.
         """
 
         if length <= 0: raise Exception("length must be a positive integer.")
-
-        output = ""
-        while len(output) < length:
-            output += md5(self._randomBytes(self.passwordRandBytes)).hexdigest()
-        return output[:length]
-
-        # Regarding md5; the reasoning here is that its best not to expose
-        # naked output from our CSPRNG, but thats really the OSs job, so this
-        # is probably just a waste of clock cycles.
+        return self._randomBytes((length + 1) / 2).encode("hex")[:length]
 
     def opensslKeyDerivation(self, password, salt, key_len, iv_len):
         """
         Derive the key and the IV from the given password and salt.
         Salt is the first 8 bytes of ciphertext.
 
-        Stolen shamelessly from this Stack Overflow posting:
+        Originally stolen shamelessly from this Stack Overflow posting:
         https://stackoverflow.com/questions/13907841/implement-openssl-aes-encryption-in-python
         """
-        dtot =  md5(password + salt).digest()
-        d = [ dtot ]
-        while len(dtot)<(iv_len+key_len):
-            d.append( md5(d[-1] + password + salt).digest() )
-            dtot += d[-1]
-        return dtot[:key_len], dtot[key_len:key_len+iv_len]
 
-    def createDocument(self, document, passphrase=None, keep=600):
+        return self.backend.deriveKey(password, salt, key_len, iv_len)
+
+    def createDocument(self, document, passphrase=None, keep=600,
+                       compression=None, binary=False, deadline=None, **extra):
         """
         Puts a document on kopy.io, and returns its identifier. If a passphrase
         is given, the document will be encrypted. The document will expire after
         "keep" seconds.
+
+        compression may be "zlib", "lzma", or "auto" to compress documents
+        bigger than compressionThreshold when it helps. Compressed documents
+        can't be read on the kopy.io web site, only with kopycat. So can binary
+        plaintext documents, which are base 64 encoded to survive the trip.
+
+        If it takes longer than deadline seconds (by default, self.deadline),
+        from encryption to the server's response and including any retries,
+        DeadlineExceeded is raised.
+
+        Documents are encrypted with self.scheme: "encrypted", which the web
+        site can read, or "chunked", which is faster for big documents.
+
+        If there's an upload index, and an identical document was uploaded
+        the same way before and hasn't expired, its identifier is returned
+        instead.
+
+        Any other keyword arguments are stored with the document as metadata.
+        """
+
+        index = self.uploadIndex
+        if index:
+            key = index.key(document, passphrase, url=self.url, keep=keep,
+                            compression=compression, binary=binary, extra=extra,
+                            scheme=self.scheme)
+            earlier = index.get(key)
+            if earlier: return earlier[0]
+
+        identifier = self._uploadDocument(document, passphrase, keep,
+                                          compression, binary, deadline, extra)
+        if index: index.put(key, identifier, None, keep)
+        return identifier
+
+    def _createGenerated(self, document, keep=600, compression=None):
+        """
+        Put a document on kopy.io encrypted with a passphrase from
+        generateRandomBytes(), and return (identifier, passphrase). If
+        there's an upload index, an identical document uploaded this way
+        before is reused, passphrase and all.
         """
 
-        if passphrase != None: document = self.encrypt(document, passphrase)
+        index = self.uploadIndex
+        if index:
+            key = index.key(document, generated=True, url=self.url, keep=keep,
+                            compression=compression, scheme=self.scheme)
+            earlier = index.get(key)
+            if earlier: return earlier
+
+        passphrase = self.generateRandomBytes()
+        identifier = self._uploadDocument(document, passphrase, keep, compression)
+        if index: index.put(key, identifier, passphrase, keep)
+        return identifier, passphrase
+
+    def _uploadDocument(self, document, passphrase=None, keep=600,
+                        compression=None, binary=False, deadline=None,
+                        extra={}):
+
+        until = self._until(deadline)
+        document, fields = self._encodeDocument(document, passphrase,
+                                                compression, binary)
+        self._remaining(until)
+        extra = dict(extra, **fields)
         identifier = self._postDocument(document,
-                                       encryption = (passphrase != None),
-                                       keep=keep)
+                                       encryption=passphrase != None and self.scheme,
+                                       keep=keep, until=until, **extra)
+        return self._documentKey(identifier)
+
+    def createStream(self, source, passphrase=None, keep=600, compression=None,
+                     binary=False, deadline=None, **extra):
+        """
+        Like createDocument, but reads the document from the file-like object
+        source streamChunkSize bytes at a time, and uploads it as it's read.
+        Reading, compression and encryption, and sending each run in their
+        own thread, at most pipelineDepth chunks apart, so the upload starts
+        before source reaches its end, and takes about as long as the
+        slowest of them rather than all three. The document is never held
+        in memory whole.
+
+        The request body is sent with chunked transfer encoding, which the
+        server has to accept (api.server does.) It can only be sent once, so
+        the upload isn't retried. As the size isn't known beforehand,
+        compression "auto" means zlib. The upload index isn't consulted.
+        """
+
+        from itertools import chain
+        from urllib import quote_plus, urlencode
+
+        until = self._until(deadline)
+        stages = []
+        if compression == "auto": compression = "zlib"
+        if compression and compression != "none":
+            stages.append(Compressor(compression))
+            extra["compression"] = compression
+            binary = True
+
+        if passphrase != None:
+            stages.append(self.encryptor(passphrase, scheme=self.scheme))
+        elif binary:
+            stages.append(Base64Encoder())
+            extra["encoding"] = "base64"
+
+        if passphrase is None and not binary:
+            quote = quote_plus
+        else: # base 64, which only has three characters to escape
+            quote = quoteBase64
+
+        fields = self._composeDocument(None, passphrase != None and self.scheme,
+                                       keep, **extra)
+        del fields["data"]
+        body = chain([urlencode(fields) + "&data="],
+                     self._pipeline(source, stages, quote))
+        response = self._request("POST", self.url, until, retry=False, data=body,
+                                 headers={"Content-Type":
+                                          "application/x-www-form-urlencoded"})
+        return self._documentKey(self._parseDocument(response.content))
+
+    def _pipeline(self, source, stages, quote):
+        """
+        Generator for createStream's request body: one thread reads source,
+        another passes what it reads through stages (see _decode) and then
+        quote, and the results are yielded here. An exception in either
+        thread is raised here instead; if the generator is closed, both
+        threads stop.
+        """
+
+        from Queue import Queue, Empty, Full
+
+        read, encoded = Queue(self.pipelineDepth), Queue(self.pipelineDepth)
+        stopped = Event()
+
+        def put(queue, item):
+            while not stopped.is_set():
+                try:
+                    return queue.put(item, timeout=0.1)
+                except Full:
+                    pass
+
+        def get(queue):
+            while not stopped.is_set():
+                try:
+                    return queue.get(timeout=0.1)
+                except Empty:
+                    pass
+
+        def reader():
+            try:
+                for chunk in iter(lambda: source.read(self.streamChunkSize), ""):
+                    put(read, chunk)
+                put(read, None)
+            except Exception as e:
+                put(read, Failure(e))
+
+        def encoder():
+            try:
+                while not stopped.is_set():
+                    chunk = get(read)
+                    if isinstance(chunk, Failure): return put(encoded, chunk)
+                    output = self._decode(stages, chunk or "", chunk is None)
+                    if output: put(encoded, quote(output))
+                    if chunk is None: return put(encoded, None)
+            except Exception as e:
+                put(encoded, Failure(e))
+
+        for stage in [reader, encoder]:
+            thread = Thread(target=stage)
+            thread.daemon = True # the reader may be stuck waiting on a pipe
+            thread.start()
+
+        try:
+            while True:
+                item = encoded.get()
+                if item is None: return
+                if isinstance(item, Failure): raise item.exception
+                yield item
+        finally:
+            stopped.set()
+
+    def _encodeDocument(self, document, passphrase=None, compression=None,
+                        binary=False):
+        """
+        Compress and encrypt a document, as requested, for upload. Returns the
+        document and a dictionary of extra fields describing it.
+
+        Plaintext documents have to be text; if binary is set, or the document
+        was compressed, they're base 64 encoded (and marked as such.)
+
+        document may be any buffer, such as an mmap of a file; it's only
+        copied if it's uploaded as it is. Its ciphertext is returned as a
+        bytearray, which _postDocument sends without copying.
+        """
+
+        extra = {}
+        codec = compression
+        if codec == "auto":
+            codec = None
+            if len(document) >= self.compressionThreshold:
+                codec = chooseCompression(len(document))
+
+        if codec and codec != "none":
+            with self._phase("compress", len(document)):
+                compressed = compress(readable(document), codec)
+            # "auto" only keeps the compressed version if it's smaller
+            if compression != "auto" or len(compressed) < len(document):
+                document = compressed
+                extra["compression"] = codec
+                binary = True
+
+        if passphrase != None and self.scheme == "chunked":
+            encryptor = self.encryptor(passphrase, scheme="chunked")
+            document = encryptor.update(document) + encryptor.finalize()
+        elif passphrase != None:
+            document = self.encrypt(document, passphrase)
+        elif binary:
+            with self._phase("base64", len(document)):
+                document = b64encode(readable(document))
+            extra["encoding"] = "base64"
+        if not isinstance(document, bytearray): document = toBytes(document)
+        return document, extra
+
+    def _documentKey(self, identifier):
+        """
+        Pull the new document's identifier out of the server's response to a
+        POST.
+        """
+
         if not "key" in identifier:
             raise Exception("An unknown error occured.")
         return identifier["key"]
 
-    def retrieveDocument(self, documentId, passphrase=None):
+    def uploadDocuments(self, documents, passphrase=None, keep=600,
+                        generate=False, load=None, workers=None, ordered=True,
+                        compression=None):
+        """
+        Put many documents on kopy.io concurrently, yielding
+        (index, (identifier, passphrase), exception) tuples as they finish;
+        see _bulk. exception is None if the upload succeeded.
+
+        Each item may be a document, or a (document, passphrase) tuple to
+        override the passphrase argument. If generate is set, items with no
+        passphrase get their own from generateRandomBytes(). If load is given,
+        it's called on each document in the worker thread, before uploading
+        (for instance, to read it from a file.)
+        """
+
+        def upload(item):
+            document, p = item if isinstance(item, tuple) else (item, passphrase)
+            if load: document = load(document)
+            if p == None and generate:
+                return self._createGenerated(document, keep, compression)
+            return self.createDocument(document, p, keep, compression), p
+
+        return self._bulk(upload, documents, workers, ordered)
+
+    def createDocuments(self, documents, passphrase=None, keep=600,
+                        generate=False, load=None, workers=None,
+                        compression=None):
+        """
+        Like uploadDocuments, but returns a list of (identifier, passphrase)
+        tuples in the same order as documents. Raises the exception of the
+        first document that failed, if any did.
+        """
+
+        output = []
+        for index, result, e in self.uploadDocuments(documents, passphrase,
+                                    keep, generate, load, workers,
+                                    compression=compression):
+            if e != None: raise e
+            output.append(result)
+        return output
+
+    def createMultipart(self, source, passphrase=None, keep=600,
+                        shardSize=None, workers=None, compression=None):
+        """
+        Put a large document on kopy.io as several smaller ones, uploaded
+        concurrently, and returns the identifier of a manifest listing them.
+        source is a file-like object; it's read a shard at a time, so memory
+        use depends on shardSize and workers, not on the document's size.
+
+        Fetch the document again with retrieveDocument and retrieveMultipart.
+        """
+
+        shardSize = shardSize or self.shardSize
+        shards = iter(lambda: source.read(shardSize), "")
+
+        def upload(shard):
+            documentId = self.createDocument(shard, passphrase, keep,
+                                             compression, binary=True)
+            return {"id": documentId, "size": len(shard),
+                    "sha256": sha256(shard).hexdigest()}
+
+        manifest = []
+        for index, shard, e in self._bulk(upload, shards, workers):
+            if e != None: raise e
+            manifest.append(shard)
+
+        from simplejson import dumps
+        manifest = dumps({"size": sum(shard["size"] for shard in manifest),
+                          "shards": manifest})
+        return self.createDocument(manifest, passphrase, keep,
+                                   multipart="manifest")
+
+    def isMultipart(self, document):
+        """
+        Returns True if a retrieved document is the manifest of a multipart
+        document.
+        """
+
+        return document.get("multipart") == "manifest"
+
+    def retrieveMultipart(self, document, passphrase=None, workers=None):
+        """
+        Given a retrieved manifest, fetch the pieces of a multipart document
+        concurrently, and yield them in order. Each piece is checked against
+        the manifest.
+        """
+
+        manifest = self._parseDocument(document["data"])
+        shards = manifest["shards"]
+        pieces = self.retrieveDocuments([(shard["id"], passphrase)
+                                         for shard in shards], workers=workers)
+
+        for index, piece, e in pieces:
+            if e != None: raise e
+            data = piece["data"]
+            if len(data) != shards[index]["size"] or \
+               sha256(data).hexdigest() != shards[index]["sha256"]:
+                raise Exception("Part {} of the document is corrupt.".format(index))
+            yield data
+
+    def createBundle(self, entries, passphrase=None, keep=600,
+                     compression="auto"):
+        """
+        Put many small files on kopy.io as one document, and return its
+        identifier. entries are (name, data) or (name, data, mode) tuples;
+        names are relative paths, like "etc/hosts". See api.bundle.
+
+        Read the files back with readBundle.
+        """
+
+        from api import bundle
+        return self.createDocument(bundle.pack(entries), passphrase, keep,
+                                   compression, binary=True,
+                                   bundle=bundle.version)
+
+    def isBundle(self, document):
+        """
+        Returns True if a retrieved document is a bundle.
+        """
+
+        return "bundle" in document
+
+    def readBundle(self, documentId, passphrase=None, open=None, names=None):
+        """
+        Download a bundle, and return its index: a list of dictionaries, each
+        with an entry's "name", "size", "mode", "offset" and "sha256".
+
+        If open is given, it's called with each entry named in names (or
+        every entry), and returns a file-like object to write the entry's
+        contents to, which is closed afterwards. The document is streamed, so
+        other entries are never held in memory, and the download stops once
+        the wanted entries are done; without open, after the index.
+        """
+
+        from api import bundle
+        reader = bundle.Reader(open, names)
+        try:
+            self.streamDocument(documentId, reader, passphrase)
+        except bundle.Finished:
+            pass
+        else:
+            reader.close()
+        return reader.index
+
+    def retrieveDocuments(self, documents, passphrase=None, workers=None,
+                          ordered=True):
+        """
+        Get many documents from kopy.io concurrently, yielding
+        (index, document, exception) tuples; see _bulk. By default they're
+        yielded in the same order as documents.
+
+        Each item may be a document identifier, or a (identifier, passphrase)
+        tuple to override the passphrase argument.
+        """
+
+        def retrieve(item):
+            documentId, p = item if isinstance(item, tuple) else (item, passphrase)
+            return self.retrieveDocument(documentId, p)
+
+        return self._bulk(retrieve, documents, workers, ordered)
+
+    def retrieveDocument(self, documentId, passphrase=None, deadline=None):
         """
         Gets a document from kopy.io, decrypts it if its encrypted, and returns
         it as a dictionary. The actual document will be in the "data" element.
+
+        As with createDocument, DeadlineExceeded is raised if it takes longer
+        than deadline seconds, or self.deadline.
+        """
+
+        until = self._until(deadline)
+        document = self._getDocument(documentId, until)
+        self._remaining(until)
+        return self._openDocument(document, passphrase)
+
+    def streamDocument(self, documentId, destination, passphrase=None):
+        """
+        Like retrieveDocument, but writes the document to the file-like object
+        destination as it arrives: the response is parsed, decoded, decrypted
+        and decompressed a chunk at a time, so memory use doesn't depend on
+        the document's size. Multipart documents are written piece by piece.
+        Returns the document's other fields.
+
+        This only works if the server sends the document's "security" field
+        before its data; otherwise, the data is kept in a temporary file until
+        the rest of the response has arrived. If there's a cache, the
+        response is kept as it arrives too, unless it outgrows the cache, and
+        stored once it has all been read and decoded.
+        """
+
+        if self.cache and not self.refreshCache:
+            cached = self.cache.get(self.url + documentId)
+            if cached != None:
+                document = self._openDocument(self._parseDocument(cached),
+                                              passphrase)
+                self._writeStream(document, destination, passphrase)
+                return document
+
+        from tempfile import SpooledTemporaryFile
+        from api.jsonstream import DocumentParser
+
+        until = self._until()
+        response = self._request("GET", self.url + documentId, until, stream=True)
+        try:
+            self._checkResponse(response.status_code,
+                                response.headers.get("content-type"))
+            parser = DocumentParser()
+            stages = spool = None
+            raw, rawSize = ([], 0) if self.cache else (None, 0)
+            for chunk in response.iter_content(self.streamChunkSize):
+                self._remaining(until)
+                if raw is not None:
+                    raw.append(chunk)
+                    rawSize += len(chunk)
+                    if rawSize > self.cache.maxBytes: raw = None # too big to keep
+                with self._phase("json", len(chunk)):
+                    pieces = parser.feed(chunk)
+                for piece in pieces:
+                    if stages is None and spool is None:
+                        if "security" in parser.dataKeys:
+                            known = dict((key, parser.fields[key])
+                                         for key in parser.dataKeys)
+                            stages, output = self._decoders(known, passphrase,
+                                                            destination)
+                        else:
+                            spool = SpooledTemporaryFile(16 * self.streamChunkSize)
+                    if spool: spool.write(piece)
+                    else: output.write(self._decode(stages, piece))
+            fields = parser.close()
+        finally:
+            response.close()
+
+        if stages is None:
+            if spool is None: # there wasn't any data
+                self._checkDocument(fields, passphrase)
+                raise Exception("Document contained no data.")
+            stages, output = self._decoders(fields, passphrase, destination)
+            spool.seek(0)
+            for piece in iter(lambda: spool.read(self.streamChunkSize), ""):
+                output.write(self._decode(stages, piece))
+        elif (set(fields) - parser.dataKeys) & \
+             set(["security", "encoding", "compression", "multipart"]):
+            raise Exception("The server described the document after sending " + \
+                            "it, so it can't be streamed.")
+        output.write(self._decode(stages, "", True))
+
+        if raw is not None:
+            try:
+                self.cache.put(self.url + documentId,
+                               "".join(raw).decode("utf-8"),
+                               fields.get("keep"))
+            except UnicodeDecodeError:
+                pass # not JSON, as kopy.io sends it
+
+        del fields["data"]
+        if output is not destination: # a multipart manifest
+            self._writeStream(dict(fields, data=output.getvalue()), destination,
+                              passphrase)
+        return fields
+
+    def _decoders(self, document, passphrase, destination):
+        """
+        Check a document's fields, and return a list of objects to decode
+        its data a chunk at a time (with update() and finalize() methods),
+        and where to write the output.
         """
 
-        document = self._getDocument(documentId)
+        from StringIO import StringIO
+
+        self._checkDocument(dict(document, data=None), passphrase)
+        stages = []
+        if document.get("security") in ["encrypted", "chunked"]:
+            stages.append(self.decryptor(passphrase, document["security"]))
+        elif document.get("encoding") == "base64":
+            stages.append(Base64Decoder())
+        if "compression" in document:
+            stages.append(Decompressor(document["compression"]))
+        return stages, StringIO() if self.isMultipart(document) else destination
+
+    def _decode(self, stages, data, final=False):
+        """
+        Pass data through each of stages, finalizing them if final is set.
+        """
+
+        for stage in stages:
+            data = stage.update(data)
+            if final: data += stage.finalize()
+        return data
+
+    def _writeStream(self, document, destination, passphrase=None):
+
+        if self.isMultipart(document):
+            for piece in self.retrieveMultipart(document, passphrase):
+                destination.write(piece)
+        else:
+            destination.write(document["data"])
+
+    def _checkDocument(self, document, passphrase=None):
+        """
+        Raise an exception if a document returned by the API can't be opened
+        with passphrase.
+        """
 
         # 404s
         if "message" in document and document["message"] == self.docNotFound:
@@ -266,18 +1219,339 @@ class Kopy(object):
         if not "data" in document:
             raise Exception("Document contained no data.")
 
-        # Handle encryption
         if "security" in document:
             if not document["security"] in self.cryptoSchemes:
                 raise Exception("Document uses unknown encryption.")
-            elif document["security"] == "encrypted":
-                if passphrase == None:
-                    raise Exception("Document is encrypted, but no passphrase" + \
-                                    " was given.")
-                else: # Encryption
-                    document["data"] = self.decrypt(document["data"], passphrase)
+            elif document["security"] != "default" and passphrase == None:
+                raise Exception("Document is encrypted, but no passphrase" + \
+                                " was given.")
 
-            elif document["security"] == "default": # Plain text
-                pass
+    def _openDocument(self, document, passphrase=None):
+        """
+        Check a document returned by the API, and decrypt and decompress it if
+        need be.
+        """
+
+        self._checkDocument(document, passphrase)
+
+        # Handle encryption
+        if document.get("security") == "encrypted":
+            document["data"] = self.decrypt(document["data"], passphrase)
+        elif document.get("security") == "chunked":
+            decryptor = self.decryptor(passphrase, "chunked")
+            document["data"] = decryptor.update(str(document["data"])) + \
+                               decryptor.finalize() # base 64 is ASCII
+
+        # Binary plaintext documents
+        if document.get("encoding") == "base64" and \
+           document.get("security") in [None, "default"]:
+            with self._phase("base64", len(document["data"])):
+                document["data"] = b64decode(document["data"])
+
+        # Handle compression
+        if "compression" in document:
+            with self._phase("decompress", len(document["data"])):
+                document["data"] = decompress(document["data"],
+                                              document["compression"])
 
         return document
+
+
+class Encryptor(object):
+
+    """
+    Incremental version of Kopy.encrypt. Feed it plaintext with update(), and
+    it returns base 64 ciphertext as it becomes available; finalize() pads the
+    last block. Joined together, the output is identical to Kopy.encrypt's.
+
+    At most a block of plaintext and two bytes of ciphertext are held back
+    between calls.
+    """
+
+    def __init__(self, kopy, passphrase, salt=None):
+
+        if not salt: salt = kopy._generateSalt()
+        if len(salt) != kopy.saltLength: raise Exception("Bad salt.")
+
+        key, iv = kopy._getAESArgs(passphrase, salt)
+        self.kopy = kopy
+        self.aes = kopy._newAES(key, iv)
+        self.plaintext = "" # < blockSize bytes, waiting for a full block
+        self.ciphertext = kopy.saltPadding + salt # < 3 bytes, waiting to be b64'd
+        self.finished = False
+
+    def _encode(self, ciphertext):
+
+        # b64 works on groups of 3 bytes; anything left over waits for the
+        # next call so the output can simply be concatenated.
+        ciphertext = self.ciphertext + ciphertext
+        end = len(ciphertext) - len(ciphertext) % 3
+        self.ciphertext = ciphertext[end:]
+        return b64encode(ciphertext[:end])
+
+    def update(self, chunk):
+        """
+        Encrypt a chunk of plaintext, returning whatever base 64 output is ready.
+        """
+
+        if self.finished: raise Exception("Encryptor has already been finalized.")
+
+        # chunk may be any buffer; it's only copied if the previous one left
+        # part of a block over
+        plaintext = self.plaintext + toBytes(chunk) if self.plaintext else readable(chunk)
+        end = len(plaintext) - len(plaintext) % self.kopy.blockSize
+        self.plaintext = toBytes(buffer(plaintext, end))
+        with self.kopy._phase("encrypt", end):
+            ciphertext = self.aes.encrypt(buffer(plaintext, 0, end))
+        return self._encode(ciphertext)
+
+    def finalize(self):
+        """
+        Pad and encrypt the final block, returning the rest of the output.
+        """
+
+        if self.finished: raise Exception("Encryptor has already been finalized.")
+        self.finished = True
+
+        ciphertext = self.ciphertext + self.aes.encrypt(self.kopy._pad(self.plaintext))
+        self.ciphertext = self.plaintext = ""
+        return b64encode(ciphertext)
+
+class Decryptor(object):
+
+    """
+    Incremental version of Kopy.decrypt. Feed it base 64 ciphertext with
+    update(), and it returns plaintext as it becomes available; finalize()
+    checks and strips the padding.
+
+    The last block is always held back, since it may turn out to be padding.
+    """
+
+    def __init__(self, kopy, passphrase):
+
+        self.kopy = kopy
+        self.passphrase = passphrase
+        self.aes = None # created once the salt has been read
+        self.decoder = Base64Decoder()
+        self.ciphertext = ""
+        self.finished = False
+
+    def _readHeader(self):
+
+        header = self.ciphertext[:self.kopy.blockSize]
+        if not header.startswith(self.kopy.saltPadding):
+            raise Exception("Bad salt padding.")
+
+        salt = header[len(self.kopy.saltPadding):]
+        key, iv = self.kopy._getAESArgs(self.passphrase, salt)
+        self.aes = self.kopy._newAES(key, iv)
+        self.ciphertext = self.ciphertext[self.kopy.blockSize:]
+
+    def update(self, chunk):
+        """
+        Decrypt a chunk of base 64 ciphertext, returning whatever plaintext is
+        ready.
+        """
+
+        if self.finished: raise Exception("Decryptor has already been finalized.")
+
+        self.ciphertext += self.decoder.update(chunk)
+        if self.aes is None:
+            if len(self.ciphertext) < self.kopy.blockSize: return ""
+            self._readHeader()
+
+        end = len(self.ciphertext) - len(self.ciphertext) % self.kopy.blockSize
+        end -= self.kopy.blockSize # hold back the block which may be padding
+        if end <= 0: return ""
+
+        ciphertext = self.ciphertext[:end]
+        self.ciphertext = self.ciphertext[end:]
+        with self.kopy._phase("decrypt", end):
+            return self.aes.decrypt(ciphertext)
+
+    def finalize(self):
+        """
+        Decrypt and unpad the final block.
+        """
+
+        if self.finished: raise Exception("Decryptor has already been finalized.")
+        self.finished = True
+
+        self.decoder.finalize()
+        if self.aes is None: raise Exception("Bad salt padding.")
+        if len(self.ciphertext) != self.kopy.blockSize:
+            raise Exception("Message isn't sized correctly.")
+
+        return self.kopy._unpad(self.aes.decrypt(self.ciphertext))
+
+class Base64Decoder(object):
+
+    """
+    Decodes base 64 a chunk at a time, ignoring whitespace. Characters which
+    don't make up a whole group of four wait for the next chunk.
+    """
+
+    def __init__(self):
+
+        self.encoded = "" # < 4 characters, waiting to be decoded
+
+    def update(self, chunk):
+
+        encoded = self.encoded + toBytes(chunk).translate(None, whitespace)
+        end = len(encoded) - len(encoded) % 4
+        self.encoded = encoded[end:]
+        return b64decode(encoded[:end])
+
+    def finalize(self):
+
+        if self.encoded: raise Exception("Message isn't sized correctly.")
+        return ""
+
+class Base64Encoder(object):
+
+    """
+    Encodes base 64 a chunk at a time, with the same interface as
+    Base64Decoder. Bytes which don't make up a whole group of three wait for
+    the next chunk.
+    """
+
+    def __init__(self):
+
+        self.data = "" # < 3 bytes, waiting to be encoded
+
+    def update(self, chunk):
+
+        data = self.data + toBytes(chunk)
+        end = len(data) - len(data) % 3
+        self.data = data[end:]
+        return b64encode(data[:end])
+
+    def finalize(self):
+
+        data, self.data = self.data, ""
+        return b64encode(data)
+
+class Compressor(object):
+
+    """
+    Compresses a document a chunk at a time, with the same interface as
+    Base64Decoder.
+    """
+
+    def __init__(self, codec):
+
+        self.compressor = compressor(codec)
+
+    def update(self, chunk):
+
+        return self.compressor.compress(readable(chunk))
+
+    def finalize(self):
+
+        return self.compressor.flush()
+
+class Decompressor(object):
+
+    """
+    Decompresses a document a chunk at a time, with the same interface as
+    Base64Decoder.
+    """
+
+    def __init__(self, codec):
+
+        self.decompressor = decompressor(codec)
+
+    def update(self, chunk):
+
+        return self.decompressor.decompress(chunk)
+
+    def finalize(self):
+
+        flush = getattr(self.decompressor, "flush", None) # lzma's doesn't have one
+        return flush() if flush else ""
+
+class FormBody(object):
+
+    """
+    A urlencoded form whose last field, "data", is a bytearray of base 64,
+    as a file-like object for requests.post(). The data is escaped a piece
+    at a time as it's read, so it's never copied whole; requests finds the
+    length by seeking to the end, and rewinds it for each retry.
+    """
+
+    def __init__(self, fields, data):
+
+        from urllib import urlencode
+
+        self.head = urlencode(fields) + "&data="
+        self.data = data
+        self.length = len(self.head) + len(data) + \
+                      2 * sum(data.count(c) for c in "+/=")
+        self.offset = 0 # into head + data, before escaping
+        self.position = 0 # after escaping
+
+    def __len__(self):
+
+        return self.length
+
+    def tell(self):
+
+        return self.position
+
+    def seek(self, offset, whence=0):
+
+        if offset != 0 or whence not in (0, 2):
+            raise IOError("A form body can only seek to its start or end.")
+        self.offset = 0 if whence == 0 else len(self.head) + len(self.data)
+        self.position = 0 if whence == 0 else self.length
+
+    def read(self, size=-1):
+
+        if size < 0: size = len(self.head) + len(self.data)
+        start = self.offset - len(self.head)
+        if start < 0:
+            piece = self.head[self.offset:self.offset + size]
+        else:
+            piece = buffer(self.data, start, size)[:]
+        self.offset += len(piece)
+        if start >= 0: piece = quoteBase64(piece)
+        self.position += len(piece)
+        return piece
+
+def quoteBase64(data):
+    """ Escapes base 64 for a urlencoded form; only three characters need it. """
+
+    return data.replace("+", "%2B").replace("/", "%2F").replace("=", "%3D")
+
+def readable(data):
+    """
+    Returns data (a string, bytearray, mmap or buffer) as something the C
+    libraries in Python 2 accept, without copying it. memoryviews, which
+    most of them don't accept, are copied.
+    """
+
+    if isinstance(data, memoryview): return data.tobytes()
+    if isinstance(data, (basestring, buffer)): return data
+    return buffer(data)
+
+def toBytes(data):
+    """ Returns a copy of any buffer's contents as a str. """
+
+    return data if isinstance(data, basestring) else readable(data)[:]
+
+class DeadlineExceeded(Exception):
+
+    """
+    Raised when an operation runs out of time; see Kopy.deadline.
+    """
+
+class Failure(object):
+
+    """
+    Wraps an exception raised while reading items for Kopy._bulk, so it can be
+    reported like any other.
+    """
+
+    def __init__(self, exception):
+
+        self.exception = exception
@@ -0,0 +1,183 @@
+"""
+Load generation against kopy.io, or anything implementing the same API.
+"""
+
+from random import Random
+from string import ascii_letters, digits
+from threading import Thread, Lock
+from time import time, sleep
+
+from api.stats import percentile
+
+class Phase(object):
+
+    """
+    Latency and error statistics for one kind of operation.
+    """
+
+    buckets = [0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1, 2, 5, 10]
+    # upper bounds, in seconds, of the histogram's buckets
+
+    def __init__(self, name):
+
+        self.name = name
+        self.latencies = []
+        self.errors = 0
+        self.bytes = 0
+        self.lock = Lock()
+
+    def record(self, latency, size=0, error=False):
+
+        with self.lock:
+            if error:
+                self.errors += 1
+            else:
+                self.latencies.append(latency)
+                self.bytes += size
+
+    def histogram(self):
+        """ Returns a list of (upper bound in seconds, count) tuples. """
+
+        counts = [0] * (len(self.buckets) + 1)
+        for latency in self.latencies:
+            for i, bound in enumerate(self.buckets):
+                if latency <= bound: break
+            else:
+                i = len(self.buckets)
+            counts[i] += 1
+        return zip(self.buckets + [float("inf")], counts)
+
+    def report(self, elapsed, width=40):
+        """ Returns a human-readable summary of the phase. """
+
+        latencies = sorted(self.latencies)
+        total = len(latencies) + self.errors
+        lines = ["{}: {} requests, {} errors ({:.1%}), {:.1f} req/s, {:.2f} MB/s".format(
+                    self.name, total, self.errors,
+                    float(self.errors) / total if total else 0,
+                    total / elapsed if elapsed else 0,
+                    self.bytes / elapsed / 1024 ** 2 if elapsed else 0)]
+        if not latencies: return "\n".join(lines)
+
+        lines.append("  latency ms: p50 {:.1f}  p95 {:.1f}  p99 {:.1f}  max {:.1f}".format(
+                     *[percentile(latencies, p) * 1000 for p in [50, 95, 99, 100]]))
+
+        histogram = self.histogram()
+        peak = max(count for bound, count in histogram)
+        for bound, count in histogram:
+            if not count: continue
+            label = "<= {:g} ms".format(bound * 1000) if bound != float("inf") else "> 10 s"
+            lines.append("  {:>12} {:>7} {}".format(label, count,
+                         "#" * int(round(width * count / peak))))
+        return "\n".join(lines)
+
+class LoadTest(object):
+
+    """
+    Drives a mix of uploads and downloads through a Kopy instance from
+    concurrency threads, until duration seconds have passed or requests
+    requests have been made.
+
+    If rate is given, requests are started on a fixed schedule of rate per
+    second (as far as the threads can keep up), and latency is measured from
+    when each request was due to start, so a backed-up server isn't hidden by
+    a client which slowed down to match it.
+    """
+
+    passphrase = "loadtest"
+
+    def __init__(self, kopy, concurrency=8, rate=None, duration=10,
+                 requests=None, uploads=0.5, sizes=(1024,), encrypted=0.5,
+                 keep=600, seed=None):
+
+        self.kopy = kopy
+        self.concurrency = concurrency
+        self.rate = rate
+        self.duration = duration
+        self.requests = requests
+        self.uploads = uploads
+        self.sizes = list(sizes)
+        self.encrypted = encrypted
+        self.keep = keep
+        self.random = Random(seed)
+        self.block = "".join(self.random.choice(ascii_letters + digits)
+                             for i in range(4096)) # payloads are made of this
+
+        self.phases = {"upload": Phase("upload"), "download": Phase("download")}
+        self.documents = [] # (documentId, passphrase) for downloads to choose from
+        self.lock = Lock()
+        self.started = 0
+        self.elapsed = 0
+
+    def _payload(self):
+
+        size = self.random.choice(self.sizes)
+        return (self.block * (size / len(self.block) + 1))[:size]
+
+    def _next(self, start):
+        """
+        Claim the next request; returns (operation, time it's due) or None
+        when the test is over.
+        """
+
+        with self.lock:
+            if self.requests != None and self.started >= self.requests: return None
+            due = start + self.started / float(self.rate) if self.rate else time()
+            if self.duration != None and due - start >= self.duration: return None
+            self.started += 1
+            upload = not self.documents or self.random.random() < self.uploads
+            encrypted = self.random.random() < self.encrypted
+            if upload:
+                return ("upload", self._payload(),
+                        self.passphrase if encrypted else None), due
+            return ("download",) + self.random.choice(self.documents), due
+
+    def _upload(self, document, passphrase):
+
+        documentId = self.kopy.createDocument(document, passphrase, self.keep)
+        with self.lock: self.documents.append((documentId, passphrase))
+        return len(document)
+
+    def _download(self, documentId, passphrase):
+
+        return len(self.kopy.retrieveDocument(documentId, passphrase)["data"])
+
+    def _worker(self, start):
+
+        while True:
+            request = self._next(start)
+            if request is None: return
+            operation, due = request
+            delay = due - time()
+            if delay > 0: sleep(delay)
+
+            try:
+                if operation[0] == "upload":
+                    size = self._upload(*operation[1:])
+                else:
+                    size = self._download(*operation[1:])
+            except Exception:
+                self.phases[operation[0]].record(time() - due, error=True)
+            else:
+                self.phases[operation[0]].record(time() - due, size)
+
+    def run(self):
+        """
+        Run the test, and return the phases' statistics.
+        """
+
+        start = time()
+        threads = [Thread(target=self._worker, args=(start,))
+                   for i in range(self.concurrency)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            while thread.is_alive(): thread.join(0.1) # stay interruptible
+        self.elapsed = time() - start
+        return self.phases
+
+    def report(self):
+
+        return "\n".join(self.phases[name].report(self.elapsed)
+                         for name in ["upload", "download"])
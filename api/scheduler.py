@@ -0,0 +1,190 @@
+"""
+Admission control for requests to the server: a token bucket limiting their
+rate, and a limit on how many are in flight at once which adapts to how the
+server is coping, as TCP's congestion window does (additive increase,
+multiplicative decrease.)
+"""
+
+from threading import Condition
+from time import time
+
+from api.kopy import DeadlineExceeded
+
+class Slot(object):
+
+    """
+    Context manager for one request, from Scheduler.slot(). Set status to
+    the response's status code (and retryAfter to its Retry-After header, if
+    any) before it ends; if it ends with an exception, the request failed,
+    unless it was DeadlineExceeded, which isn't the server's fault.
+    """
+
+    def __init__(self, scheduler, until=None):
+
+        self.scheduler = scheduler
+        self.until = until
+        self.status = None
+        self.retryAfter = None
+        self.start = None
+
+    def __enter__(self):
+
+        self.scheduler._acquire(self.until)
+        self.start = time()
+        return self
+
+    def __exit__(self, type, value, traceback):
+
+        if type and issubclass(type, DeadlineExceeded):
+            self.scheduler._release(None, None, cancelled=True)
+        else:
+            self.scheduler._release(time() - self.start,
+                                    None if type else self.status,
+                                    self.retryAfter)
+
+class Scheduler(object):
+
+    """
+    Holds requests back until one of limit slots is free, and, if there's a
+    rate, a token is; tokens accumulate at rate per second, up to burst.
+
+    limit (and rate) are halved when the server is struggling: it answers
+    429 or 5xx, a request fails outright, or a response takes latencyFactor
+    times as long as the fastest recent ones. They're only cut once per
+    round trip, as the other requests in flight will have suffered too.
+    Each healthy response adds 1 / limit to limit, so it grows by about one
+    per round trip, up to maximum; rate climbs back by a twentieth of its
+    maximum. A Retry-After header holds every request back until then.
+    If adaptive is unset, limit and rate stay put.
+
+    metrics() returns the current state.
+    """
+
+    adaptive = True
+    decrease = 0.5 # limit and rate are multiplied by this on congestion
+    latencyFactor = 3.0
+    slowFloor = 0.1 # seconds; faster responses never count as slow
+    baselineDrift = 0.01 # how fast the baseline latency follows slower ones
+
+    def __init__(self, maximum=10, minimum=1, rate=None, burst=None):
+
+        self.maximum = maximum
+        self.minimum = minimum
+        self.limit = float(maximum)
+        self.maxRate = rate
+        self.rate = rate # requests per second, or None for no limit
+        self.burst = burst or max(1, rate or 1)
+        self.tokens = float(self.burst)
+        self.refilled = time()
+        self.resumeAt = 0 # set by Retry-After
+
+        self.inFlight = 0
+        self.queued = 0
+        self.baseline = None # latency of the fastest recent responses
+        self.latency = 0 # smoothed latency
+        self.decreased = 0 # when limit was last cut
+        self.requests = 0
+        self.congestion = 0 # responses which cut limit
+        self.throttled = 0 # 429s
+        self.condition = Condition()
+
+    def slot(self, until=None):
+        """
+        Returns a Slot, to wrap a request in. Waiting for it raises
+        DeadlineExceeded if it's not free by until (a time.time().)
+        """
+
+        return Slot(self, until)
+
+    def metrics(self):
+        """
+        Returns a dictionary: the current limit on requests in flight,
+        inFlight, queued (waiting for a slot or token), rate (or None),
+        latency (smoothed, in seconds), and counts of requests, congestion
+        signals and 429s.
+        """
+
+        with self.condition:
+            return {"limit": int(self.limit), "inFlight": self.inFlight,
+                    "queued": self.queued, "rate": self.rate,
+                    "latency": self.latency, "requests": self.requests,
+                    "congestion": self.congestion, "throttled": self.throttled}
+
+    def _refill(self, now):
+
+        if self.rate:
+            self.tokens = min(self.burst, self.tokens +
+                              (now - self.refilled) * self.rate)
+        self.refilled = now
+
+    def _acquire(self, until=None):
+
+        with self.condition:
+            self.queued += 1
+            try:
+                while True:
+                    now = time()
+                    self._refill(now)
+                    wait = None
+                    if now < self.resumeAt:
+                        wait = self.resumeAt - now
+                    elif self.inFlight < max(self.minimum, int(self.limit)):
+                        if not self.rate or self.tokens >= 1: break
+                        wait = (1 - self.tokens) / self.rate
+                    if until != None:
+                        if now >= until:
+                            raise DeadlineExceeded("The operation took too " + \
+                                                   "long, waiting its turn.")
+                        wait = until - now if wait is None else min(wait, until - now)
+                    self.condition.wait(wait)
+            finally:
+                self.queued -= 1
+
+            if self.rate: self.tokens -= 1
+            self.inFlight += 1
+
+    def _release(self, seconds, status, retryAfter=None, cancelled=False):
+        """
+        Account for a request which took seconds and got status (None if it
+        failed outright), or was cancelled before it was sent.
+        """
+
+        with self.condition:
+            now = time()
+            self.inFlight -= 1
+            if cancelled:
+                self.condition.notify_all()
+                return
+            self.requests += 1
+            self.latency = seconds if not self.latency \
+                           else self.latency * 0.9 + seconds * 0.1
+
+            if status == 429:
+                self.throttled += 1
+                try:
+                    self.resumeAt = max(self.resumeAt, now + float(retryAfter))
+                except (TypeError, ValueError):
+                    pass # absent, or an HTTP date
+
+            slow = self.baseline != None and seconds > self.slowFloor and \
+                   seconds > self.baseline * self.latencyFactor
+            if not self.adaptive:
+                pass
+            elif status is None or status == 429 or status >= 500 or slow:
+                if now - self.decreased >= self.latency:
+                    self.decreased = now
+                    self.congestion += 1
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    if self.rate:
+                        self.rate = max(self.maxRate / 100.0,
+                                        self.rate * self.decrease)
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+                if self.rate:
+                    self.rate = min(self.maxRate, self.rate + self.maxRate / 20.0)
+
+            if status != None and status < 500 and status != 429:
+                self.baseline = seconds if self.baseline is None else \
+                                min(seconds, self.baseline + self.baselineDrift *
+                                    (seconds - self.baseline))
+            self.condition.notify_all()
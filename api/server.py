@@ -0,0 +1,202 @@
+"""
+A local stand-in for kopy.io's /documents API (see apinotes.md), for tests,
+benchmarks and load testing without touching the real site.
+"""
+
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from random import SystemRandom
+from sys import exc_info
+from socket import error as socket_error, IPPROTO_TCP, SHUT_RDWR, TCP_NODELAY
+from string import ascii_letters, digits
+from threading import Thread, Lock
+from time import sleep, time
+from urlparse import parse_qsl
+from collections import OrderedDict
+from simplejson import dumps
+
+class Handler(BaseHTTPRequestHandler):
+
+    """
+    Serves POST /documents and GET /documents/<id>, the same way kopy.io does.
+    """
+
+    protocol_version = "HTTP/1.1" # so clients can keep connections alive
+    prefix = "/documents"
+
+    def log_message(self, format, *args):
+
+        pass # keep test and benchmark output clean
+
+    def setup(self):
+
+        BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(IPPROTO_TCP, TCP_NODELAY, 1)
+        # Headers and body go out in separate writes; without this, keep-alive
+        # connections stall on delayed ACKs.
+        self.server.connected(self.connection)
+
+    def _respond(self, status, document):
+
+        fields = sorted(document.items(), key=lambda (k, v): (k == "data", k))
+        if not self.server.dataLast: fields.reverse()
+        body = dumps(OrderedDict(fields))
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _readBody(self):
+
+        if self.headers.get("transfer-encoding", "").lower() != "chunked":
+            return self.rfile.read(int(self.headers.get("content-length", 0)))
+
+        body = []
+        while True:
+            size = int(self.rfile.readline().split(";")[0], 16)
+            if not size: break
+            body.append(self.rfile.read(size))
+            self.rfile.readline() # the CRLF after each chunk
+        while self.rfile.readline() not in ["\r\n", "\n", ""]:
+            pass # trailers
+        return "".join(body)
+
+    def _injectFailure(self):
+        """
+        Simulate a slow or failing server, if it has been told to.
+        Returns True if a failure response was sent.
+        """
+
+        if self.server.delay: sleep(self.server.delay)
+        if self.server.stall(): sleep(self.server.stallTime)
+        if self.server.fail():
+            self._readBody()
+            self._respond(self.server.failureStatus,
+                          {"message": "Service unavailable."})
+            return True
+        return False
+
+    def do_POST(self):
+
+        if self._injectFailure(): return
+        if self.path.rstrip("/") != self.prefix:
+            self._readBody()
+            return self._respond(404, {"message": "Not found."})
+
+        document = dict(parse_qsl(self._readBody(), keep_blank_values=True))
+        self._respond(200, {"key": self.server.store(document)})
+
+    def do_GET(self):
+
+        if self._injectFailure(): return
+        documentId = self.path[len(self.prefix) + 1:]
+        if not self.path.startswith(self.prefix + "/") or not documentId:
+            return self._respond(404, {"message": "Not found."})
+
+        document = self.server.documents.get(documentId)
+        if document is None:
+            return self._respond(404, {"message": "Document not found."})
+        self._respond(200, document)
+
+class Server(ThreadingMixIn, HTTPServer):
+
+    """
+    A threaded HTTP server holding documents in memory. Use start() to serve
+    from a background thread, and point Kopy.url at self.url.
+
+    Set failures to have the next n requests answered with a 503 (or
+    failureStatus, say 429), delay to have every request wait that many
+    seconds before being handled, and stalls to have just the next n
+    requests wait stallTime seconds.
+    Documents are sent with "data" as the last field, or the first if
+    dataLast is unset.
+    """
+
+    daemon_threads = True
+    keyLength = 5
+
+    def __init__(self, host="127.0.0.1", port=0):
+
+        HTTPServer.__init__(self, (host, port), Handler)
+        self.documents = {}
+        self.connections = 0
+        self.sockets = set()
+        self.failures = 0
+        self.failureStatus = 503
+        self.delay = 0
+        self.stalls = 0
+        self.stallTime = 1
+        self.dataLast = True
+        self.lock = Lock()
+        self.randomness = SystemRandom()
+
+    @property
+    def url(self):
+
+        return "http://{}:{}{}/".format(self.server_address[0],
+                                        self.server_address[1], Handler.prefix)
+
+    def connected(self, sock):
+
+        with self.lock:
+            self.connections += 1
+            self.sockets.add(sock)
+
+    def shutdown_request(self, request):
+
+        with self.lock: self.sockets.discard(request)
+        HTTPServer.shutdown_request(self, request)
+
+    def handle_error(self, request, client_address):
+
+        if isinstance(exc_info()[1], socket_error): return # the client gave up
+        HTTPServer.handle_error(self, request, client_address)
+
+    def fail(self):
+
+        with self.lock:
+            if self.failures <= 0: return False
+            self.failures -= 1
+            return True
+
+    def stall(self):
+
+        with self.lock:
+            if self.stalls <= 0: return False
+            self.stalls -= 1
+            return True
+
+    def store(self, document):
+
+        with self.lock:
+            while True:
+                key = "".join(self.randomness.choice(ascii_letters + digits)
+                              for i in range(self.keyLength))
+                if not key in self.documents: break
+            self.documents[key] = document
+        return key
+
+    def start(self):
+
+        thread = Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+
+        self.shutdown()
+        self.server_close()
+
+        # Hang up on idle keep-alive connections, and give their threads a
+        # moment to finish.
+        with self.lock:
+            for sock in self.sockets:
+                try:
+                    sock.shutdown(SHUT_RDWR)
+                except socket_error:
+                    pass
+
+        deadline = time() + 1
+        while self.sockets and time() < deadline: sleep(0.01)
@@ -0,0 +1,104 @@
+"""
+Timing events for the stages of Kopy's requests, and a collector which sums
+them up.
+"""
+
+import sys
+from collections import namedtuple
+from threading import Lock
+from timeit import default_timer
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+Event = namedtuple("Event", ["phase", "seconds", "bytes", "peakMemory"])
+# bytes is how much data the phase processed (0 if it isn't meaningful), and
+# peakMemory the process' peak resident set size so far, in bytes, or None
+# where it can't be measured.
+
+def peakMemory():
+    """ Returns the process' peak resident set size in bytes, or None. """
+
+    if resource is None: return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # Linux says KB
+
+def percentile(samples, p):
+    """ Returns the p-th percentile of a sorted list. """
+
+    if not samples: return 0
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+class Timer(object):
+
+    """
+    Context manager which times a phase, and passes an Event to each of
+    listeners when it ends (even if it raised.) If there are no listeners, it
+    costs next to nothing.
+
+    The number of bytes processed may be given up front, or set on the timer
+    before it ends, when it's only known afterwards.
+    """
+
+    def __init__(self, listeners, phase, bytes=0):
+
+        self.listeners = listeners
+        self.phase = phase
+        self.bytes = bytes
+        self.start = None
+
+    def __enter__(self):
+
+        if self.listeners: self.start = default_timer()
+        return self
+
+    def __exit__(self, *exception):
+
+        if self.start is None or not self.listeners: return
+        event = Event(self.phase, default_timer() - self.start, self.bytes,
+                      peakMemory())
+        for listener in list(self.listeners): listener(event)
+
+class Stats(object):
+
+    """
+    A listener which totals up events by phase; pass it to Kopy.addListener.
+    Safe to use from several threads.
+    """
+
+    def __init__(self):
+
+        self.phases = {} # phase -> [count, seconds, bytes]
+        self.peakMemory = None
+        self.lock = Lock()
+
+    def __call__(self, event):
+
+        with self.lock:
+            totals = self.phases.setdefault(event.phase, [0, 0.0, 0])
+            totals[0] += 1
+            totals[1] += event.seconds
+            totals[2] += event.bytes
+            if event.peakMemory != None:
+                self.peakMemory = max(self.peakMemory, event.peakMemory)
+
+    def report(self):
+        """ Returns a table of the phases, slowest first. """
+
+        with self.lock:
+            phases = sorted(self.phases.items(), key=lambda p: -p[1][1])
+            peak = self.peakMemory
+
+        lines = ["{:<12} {:>7} {:>11} {:>11} {:>10}".format("phase", "calls",
+                                                             "total ms",
+                                                             "bytes", "MB/s")]
+        for phase, (count, seconds, size) in phases:
+            lines.append("{:<12} {:>7} {:>11.2f} {:>11} {:>10}".format(phase,
+                         count, seconds * 1000, size,
+                         "{:.1f}".format(size / seconds / 1024 ** 2)
+                         if size and seconds else "-"))
+        if peak != None:
+            lines.append("peak memory: {:.1f} MB".format(peak / 1024.0 ** 2))
+        return "\n".join(lines)
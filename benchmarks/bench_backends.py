@@ -0,0 +1,46 @@
+#!/usr/bin/python
+
+"""
+Report AES-256-CBC throughput, in MB/s, for each crypto backend installed,
+and check they all produce the same output.
+"""
+
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from api.backends import availableBackends, measure, PurePythonBackend
+from api.kopy import Kopy
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--size", type=int, default=4,
+                        help="Megabytes to encrypt per iteration. (Default is 4.)")
+    parser.add_argument("-t", "--seconds", type=float, default=2,
+                        help="Minimum time to spend on each backend.")
+    arguments = parser.parse_args()
+
+    document = os.urandom(64 * 1024)
+    salt = "A" * Kopy.saltLength
+    outputs = set()
+
+    print "{:<14} {:>10}".format("backend", "MB/s")
+    for backend in availableBackends():
+        backend = backend()
+        size = arguments.size * 1024 * 1024
+        if isinstance(backend, PurePythonBackend): size = 64 * 1024
+        # otherwise, it'll be here all day
+
+        print "{:<14} {:>10.2f}".format(backend.name,
+                                        measure(backend, size, arguments.seconds))
+        outputs.add(Kopy(backend=backend).encrypt(document, "passphrase", salt))
+
+    if len(outputs) != 1:
+        print "Backends disagree on the ciphertext!"
+        exit(1)
+
+if __name__ == "__main__":
+    main()
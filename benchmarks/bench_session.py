@@ -0,0 +1,73 @@
+#!/usr/bin/python
+
+"""
+Compare per-request latency with and without connection reuse.
+
+"fresh" opens a new connection for every request, which is what kopycat did
+before Kopy kept a pooled session; "pooled" reuses one Kopy instance.
+
+By default this runs against the local stand-in server (api/server.py), where
+there's no TLS handshake, so the difference is a lower bound. Use --url to
+point it at a real endpoint.
+"""
+
+import argparse
+import os
+import sys
+from time import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from api.kopy import Kopy
+from api.server import Server
+
+def percentile(samples, p):
+
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p / 100.0))]
+
+def measure(newKopy, documentId, requests):
+
+    samples = []
+    for i in range(requests):
+        k = newKopy()
+        start = time()
+        k.retrieveDocument(documentId)
+        samples.append((time() - start) * 1000)
+    return samples
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-n", "--requests", type=int, default=200)
+    parser.add_argument("--url", help="Endpoint to use instead of a local server.")
+    parser.add_argument("--document", help="Document ID to fetch (with --url).")
+    arguments = parser.parse_args()
+
+    server = None
+    url = arguments.url
+    if not url:
+        server = Server().start()
+        url = server.url
+
+    pooled = Kopy()
+    pooled.url = url
+    documentId = arguments.document or pooled.createDocument("A" * 1024)
+
+    def fresh():
+        k = Kopy()
+        k.url = url
+        return k
+
+    print "{:<8} {:>10} {:>10} {:>10}".format("mode", "mean ms", "p50 ms", "p95 ms")
+    for mode, newKopy in [("fresh", fresh), ("pooled", lambda: pooled)]:
+        samples = measure(newKopy, documentId, arguments.requests)
+        print "{:<8} {:>10.3f} {:>10.3f} {:>10.3f}".format(mode,
+            sum(samples) / len(samples), percentile(samples, 50),
+            percentile(samples, 95))
+
+    if server: server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+#!/usr/bin/python
+
+"""
+Measures how much memory encrypting a file takes: the growth in peak RSS,
+as a multiple of the size of the base 64 ciphertext, for each way of doing it,
+including uploading it as kopycat does (to an api.server in this process.)
+Each method runs in a fresh process, so they don't skew each other.
+
+Only Linux can measure this: the peak is read from /proc/self/status after
+resetting it through /proc/self/clear_refs. ru_maxrss won't do, as a child
+process inherits its parent's across fork() and exec(), so a child of a big
+process would seem to grow by nothing.
+"""
+
+import argparse
+import mmap
+import os
+import sys
+from subprocess import check_output
+from tempfile import NamedTemporaryFile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from api.kopy import Kopy
+from api.server import Server
+
+passphrase = "9ACJQzDPFiVJXC"
+
+def readEncrypt(k, path):
+    """ Read the file into a string, and encrypt that. """
+
+    with open(path, "rb") as f:
+        return k.encrypt(f.read(), passphrase)
+
+def mmapEncryptInto(k, path):
+    """ Memory-map the file, and encrypt it into a preallocated buffer. """
+
+    with open(path, "rb") as f:
+        document = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    output = bytearray(k.encryptedSize(len(document)))
+    k.encryptInto(document, output, passphrase)
+    return output
+
+def mmapCreateDocument(k, path):
+    """ Memory-map the file, and upload it encrypted, like kopycat. """
+
+    with open(path, "rb") as f:
+        document = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return k.createDocument(document, passphrase)
+
+methods = {"read+encrypt": readEncrypt, "mmap+encryptInto": mmapEncryptInto,
+           "mmap+createDocument": mmapCreateDocument}
+
+def measurable():
+    """ Returns True if the peak RSS can be reset and read here. """
+
+    return os.access("/proc/self/clear_refs", os.W_OK) and \
+           os.access("/proc/self/status", os.R_OK)
+
+def resetPeak():
+    """ Reset this process' peak RSS to its current RSS. """
+
+    with open("/proc/self/clear_refs", "w") as f:
+        f.write("5")
+
+def peakMemory():
+    """ Returns this process' peak RSS since resetPeak(), in bytes. """
+
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmHWM:"): return int(line.split()[1]) * 1024
+    raise Exception("No VmHWM in /proc/self/status.")
+
+def child(method, path, url):
+    """
+    Run one method, printing how much the peak RSS grew, in bytes.
+    """
+
+    k = Kopy()
+    k.url = url
+    k.createDocument("warm up", passphrase) # load the backend and requests first
+    resetPeak()
+    before = peakMemory()
+    methods[method](k, path)
+    print peakMemory() - before
+
+def run(size, log=None):
+    """
+    Returns {method: peak RSS growth / ciphertext size}.
+    """
+
+    k = Kopy()
+    results = {}
+    server = Server().start()
+    with NamedTemporaryFile() as f:
+        for i in range(0, size, 1024 ** 2):
+            f.write(os.urandom(min(1024 ** 2, size - i)))
+        f.flush()
+
+        for method in sorted(methods):
+            growth = int(check_output([sys.executable, __file__, "--child",
+                                       method, f.name, server.url]))
+            results[method] = float(growth) / k.encryptedSize(size)
+            if log: log.write("{:<20} {:>8.1f} MB {:>6.2f}x ciphertext\n".format(
+                              method, growth / 1024.0 ** 2, results[method]))
+    server.stop()
+    return results
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("-s", "--size", type=int, default=64,
+                        help="Size of the file to encrypt, in MB. (Default is 64.)")
+    parser.add_argument("--max-ratio", type=float,
+                        help="Fail if mmap+createDocument needs more than " + \
+                        "this multiple of the ciphertext's size.")
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    arguments = parser.parse_args()
+
+    if arguments.child: return child(*arguments.child)
+
+    if not measurable(): sys.exit("Peak memory can't be measured here.")
+    results = run(arguments.size * 1024 ** 2, sys.stdout)
+    if arguments.max_ratio and results["mmap+createDocument"] > arguments.max_ratio:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/python
+
+"""
+Times kopycat's startup: how long common invocations which don't touch the
+network (--help, bad arguments, bad URLs) take from starting the interpreter
+to the first byte of output. If the best of --runs runs of any invocation
+takes longer than --budget seconds, the exit status is 1.
+"""
+
+import argparse
+import os
+import shutil
+import sys
+from subprocess import Popen, PIPE, STDOUT
+from tempfile import mkdtemp
+from timeit import default_timer
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+invocations = [["--help"],
+               ["--no-such-option"],
+               ["-t", "5y", os.devnull], # bad time
+               ["https://kopy.io/"]] # no document ID
+
+budget = 0.25 # seconds
+
+def firstOutput(arguments, env=None):
+    """
+    Run kopycat with arguments, returning the seconds until it wrote
+    anything to stdout or stderr.
+    """
+
+    start = default_timer()
+    process = Popen([sys.executable, os.path.join(root, "kopycat.py")] + arguments,
+                    stdin=PIPE, stdout=PIPE, stderr=STDOUT, env=env)
+    process.stdout.read(1)
+    elapsed = default_timer() - start
+    process.communicate()
+    return elapsed
+
+def run(runs=5, log=None):
+    """
+    Time each invocation, returning a list of (arguments, best seconds).
+    """
+
+    cache = mkdtemp() # so the user's cache isn't touched
+    env = dict(os.environ, XDG_CACHE_HOME=cache)
+    try:
+        results = []
+        for arguments in invocations:
+            best = min(firstOutput(arguments, env) for i in range(runs))
+            results.append((arguments, best))
+            if log: log.write("{:<28} {:>8.1f} ms\n".format(" ".join(arguments),
+                                                             best * 1000))
+        return results
+    finally:
+        shutil.rmtree(cache)
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-b", "--budget", type=float, default=budget,
+                        help="Seconds each invocation may take. " + \
+                        "(Default is {}.)".format(budget))
+    parser.add_argument("-r", "--runs", type=int, default=5,
+                        help="Runs of each invocation; the best counts.")
+    arguments = parser.parse_args()
+
+    over = [(a, t) for a, t in run(arguments.runs, sys.stdout) if t > arguments.budget]
+    for a, t in over:
+        print "OVER BUDGET kopycat {} took {:.1f} ms".format(" ".join(a), t * 1000)
+    if over: sys.exit(1)
+    print "Every invocation started within {:.0f} ms.".format(arguments.budget * 1000)
+
+if __name__ == "__main__":
+    main()
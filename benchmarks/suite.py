@@ -0,0 +1,153 @@
+#!/usr/bin/python
+
+"""
+Microbenchmarks for kopycat's crypto and codec hot paths.
+
+Each path is timed at payload sizes from 100 B up to --max-size, and the
+results are saved as JSON. Given a baseline (a previous run's results), any
+path which got slower by more than --threshold is reported, and the exit
+status is 1.
+"""
+
+import argparse
+import os
+import platform
+import sys
+from timeit import Timer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from simplejson import dumps, load, dump
+from api.kopy import Kopy
+
+sizes = [100, 10 * 1024, 1024 ** 2, 10 * 1024 ** 2, 100 * 1024 ** 2]
+
+def formatSize(size):
+
+    for unit, scale in [("MB", 1024 ** 2), ("KB", 1024)]:
+        if size >= scale: return "{}{}".format(size / scale, unit)
+    return "{}B".format(size)
+
+def measure(function, minTime=0.2):
+    """
+    Returns the best time, in seconds, for one call to function. Calls are
+    batched so each batch takes at least 10ms, and batches are repeated for at
+    least minTime seconds (and at least three times.)
+    """
+
+    timer = Timer(function)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= 0.01: break
+        number *= 10
+
+    best = elapsed / number
+    total, runs = elapsed, 1
+    while total < minTime or runs < 3:
+        elapsed = timer.timeit(number)
+        best = min(best, elapsed / number)
+        total += elapsed
+        runs += 1
+    return best
+
+def cases(k, maxSize):
+    """
+    Yield (name, bytes processed, function) for each benchmark.
+    """
+
+    passphrase, salt = "9ACJQzDPFiVJXC", "A" * k.saltLength
+
+    yield "opensslKeyDerivation", None, \
+        lambda: k.opensslKeyDerivation(passphrase, salt, k.keyLength, k.ivLength)
+    yield "generateRandomBytes", None, lambda: k.generateRandomBytes()
+
+    for size in [size for size in sizes if size <= maxSize]:
+        plaintext = os.urandom(size)
+        padded = k._pad(plaintext)
+        ciphertext = k.encrypt(plaintext, passphrase, salt)
+        raw = k._parseCiphertext(ciphertext)[1]
+        response = dumps({"data": ciphertext, "security": "encrypted", "keep": 600})
+
+        yield "_pad", size, lambda: k._pad(plaintext)
+        yield "_unpad", size, lambda: k._unpad(padded)
+        yield "encrypt", size, lambda: k.encrypt(plaintext, passphrase, salt)
+        yield "decrypt", size, lambda: k.decrypt(ciphertext, passphrase)
+        yield "_formatCiphertext", size, lambda: k._formatCiphertext(salt, raw)
+        yield "_parseCiphertext", size, lambda: k._parseCiphertext(ciphertext)
+        yield "_parseDocument", size, lambda: k._parseDocument(response)
+
+def run(maxSize, minTime, log=None):
+    """
+    Run every benchmark, returning the results as a dictionary.
+    """
+
+    k = Kopy()
+    results = {}
+    for name, size, function in cases(k, maxSize):
+        if size != None: name = "{}@{}".format(name, formatSize(size))
+        seconds = measure(function, minTime)
+        results[name] = {"seconds": seconds}
+        if size != None: results[name]["mbps"] = size / seconds / 1024 ** 2
+        if log: log.write("{:<28} {:>14.3f} us\n".format(name, seconds * 1e6))
+
+    return {"python": platform.python_version(), "machine": platform.machine(),
+            "backend": k.backend.name, "results": results}
+
+def compare(baseline, current, threshold):
+    """
+    Returns a list of (name, baseline seconds, current seconds) for each
+    benchmark in both which is more than threshold (a fraction) slower.
+    """
+
+    regressions = []
+    for name, result in sorted(current["results"].items()):
+        if not name in baseline["results"]: continue
+        before = baseline["results"][name]["seconds"]
+        if result["seconds"] > before * (1 + threshold):
+            regressions.append((name, before, result["seconds"]))
+    return regressions
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__,
+                                    formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("-o", "--output", help="Save results to this file.")
+    parser.add_argument("-b", "--baseline",
+                        help="Compare results with this file. If it doesn't " + \
+                        "exist, the results are saved there instead.")
+    parser.add_argument("-t", "--threshold", type=float, default=0.25,
+                        help="Fraction by which a benchmark may slow down " + \
+                        "before it counts as a regression. (Default is 0.25.)")
+    parser.add_argument("--max-size", type=int, default=sizes[-1],
+                        help="Largest payload, in bytes. (Default is 100 MB.)")
+    parser.add_argument("--min-time", type=float, default=0.2,
+                        help="Minimum seconds to spend on each benchmark.")
+    arguments = parser.parse_args()
+
+    results = run(arguments.max_size, arguments.min_time, sys.stderr)
+
+    if arguments.output:
+        with open(arguments.output, "w") as f: dump(results, f, indent=2)
+
+    if not arguments.baseline: return
+    if not os.path.exists(arguments.baseline):
+        with open(arguments.baseline, "w") as f: dump(results, f, indent=2)
+        print "Saved a new baseline to {}.".format(arguments.baseline)
+        return
+
+    with open(arguments.baseline) as f: baseline = load(f)
+    for key in ["python", "machine", "backend"]:
+        if baseline.get(key) != results[key]:
+            print "Warning: baseline {} was {}, now {}.".format(key,
+                                                    baseline.get(key), results[key])
+
+    regressions = compare(baseline, results, arguments.threshold)
+    for name, before, after in regressions:
+        print "REGRESSION {:<28} {:>12.3f} us -> {:>12.3f} us ({:+.0%})".format(
+            name, before * 1e6, after * 1e6, after / before - 1)
+    if regressions: exit(1)
+    print "No regressions beyond {:.0%}.".format(arguments.threshold)
+
+if __name__ == "__main__":
+    main()
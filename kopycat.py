@@ -2,12 +2,24 @@
 
 import argparse
 import errno
-from sys import stdin, stderr, exit
+import mmap
+import os
+import signal
+import sys
+from sys import exit
 from getpass import getpass
 from api.kopy import Kopy
+from api.backends import backends, getBackend
+from api.cache import DocumentCache, UploadIndex
+from api.compression import available as compressionCodecs
+from api import daemon
 
 # Everything actually interesting happens in api/kopy.py
 
+# Anything slow to import, and only needed for some commands (requests, the
+# crypto libraries, sqlite3, the stand-in server), is imported when it's
+# needed, so --help and bad arguments are reported quickly.
+
 class KopyException(Exception):
 
     # This is just so we can catch exceptions emmited by the
@@ -50,11 +62,58 @@ View a link securely:
     kopycat http://kopy.io/75fEl -e # Prompts you for the passphrase
     kopycat http://kopy.io/75fEl -f /path/to/passphrase.txt
 
+Save a document to a file; it's written as it downloads, however big it is:
+
+    kopycat http://kopy.io/75fEl#JpcOUW -o file.txt
+
 Upload a file to kopy.io:
 
     kopycat /path/to/file.txt # Will be stored plaintext
     kopycat /path/to/sensitive/file.txt -g # Generates a passphrase 
 
+Download every kopy.io URL listed in a file, one per line:
+
+    kopycat --urls links.txt > documents.txt
+    grep -o "https://kopy.io/[^ ]*" chat.log | kopycat --urls - --output-dir out/
+
+Upload a big file as several documents, 4 MB each, which are uploaded (and
+later downloaded) in parallel:
+
+    kopycat -g -m --shard-size 4m /path/to/big.log
+
+Upload many files at once, each with its own passphrase:
+
+    kopycat -g --ordered reports/*.txt # One URL per line, in the same order
+
+Pack a directory of small files into one document, then list it, or
+extract some of it:
+
+    kopycat -g -b config/ # One URL for the lot
+    kopycat http://kopy.io/75fEl#JpcOUW --list
+    kopycat -x restored/ http://kopy.io/75fEl#JpcOUW config/app.ini
+
+Follow a growing log, uploading what's appended to it every 5 minutes, or
+every megabyte, whichever comes first, with one URL per segment:
+
+    kopycat -g -F /var/log/app.log --interval 300 --segment-size 1m
+
+Keep a kopycat running in the background, so later invocations start faster
+and reuse its connections (they fall back to running by themselves if it
+isn't there):
+
+    kopycat --daemon &
+
+Encrypt every file in a directory, without uploading anything, on every CPU;
+openssl can decrypt the results too:
+
+    kopycat batch encrypt archives/ staging/ -f passphrase.txt
+    openssl enc -d -aes-256-cbc -a -md md5 -in staging/a.tar.enc > a.tar
+
+Measure how much load the client (or a server) can take:
+
+    kopycat loadtest --local -c 16 -t 30 --sizes 1k,100k
+    kopycat loadtest --endpoint http://paste.example.com/documents/ -r 50
+
 Bugs? Feature requests? Contributions?
 https://www.github.com/xmnr/kopycat
 """
@@ -63,12 +122,29 @@ https://www.github.com/xmnr/kopycat
     # Lookup table for translating to seconds
     # minute, hour, day respectively
 
+    sizes = {"k":1024, "m":1024**2, "g":1024**3}
+    # Likewise for bytes
+
+    daemonClient = True # pass commands to a running daemon, if there is one
+
+    segmentSize = 1024 * 1024 # bytes of a followed file per document, with -F
+    interval = 60 # seconds before uploading what's been appended, with -F
+    bundleMapSize = 1024 * 1024 # bundled files this big are mapped, not read
+
+    def __init__(self, stdin=None, stdout=None, stderr=None, **kwargs):
+
+        Kopy.__init__(self, **kwargs)
+        self.stdin = stdin or sys.stdin
+        self.stdout = stdout or sys.stdout
+        self.stderr = stderr or sys.stderr
+        self.statistics = None # an api.stats.Stats, with --stats
+
     # Internals
 
     def _succeed(self, message):
         """ Output to stdout and signal success. """
 
-        print message
+        self.stdout.write(message + "\n")
         exit(0)
 
     def _fail(self, message, n=None):
@@ -76,7 +152,7 @@ https://www.github.com/xmnr/kopycat
 
         # TODO: I could just import print_function from future....
         if not message.endswith("\n"): message += "\n"
-        stderr.write(message)
+        self.stderr.write(message)
         exit(n or 1)
 
     def _chopProtocol(self, url):
@@ -101,7 +177,7 @@ https://www.github.com/xmnr/kopycat
 
         return url
 
-    def _getFile(self, target):
+    def _openFile(self, target):
 
         if not isinstance(target, str): raise KopyException("Bad argument (this is a bug.)")
 
@@ -115,7 +191,7 @@ https://www.github.com/xmnr/kopycat
                 raise KopyException("Filename was potentially malicious, aborting.")
 
         try:
-            doc = open(target).read()
+            return open(target)
         except IOError as e:
             if e.errno == errno.EACCES:
                 raise KopyException("You don't have permission to read {}.".format(target))
@@ -124,8 +200,29 @@ https://www.github.com/xmnr/kopycat
             elif e.errno == errno.EISDIR:
                 raise KopyException("{} is a directory.".format(target))
             # TODO should we fail on symlinks unless explicitly allowed?
+            raise
 
-        return doc
+    def _getFile(self, target):
+        """
+        Returns a file's contents; regular files are memory-mapped rather
+        than read, so they're only copied as far as uploading needs.
+        """
+
+        with self._openFile(target) as f:
+            if os.fstat(f.fileno()).st_size and os.path.isfile(target):
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return f.read() # empty, or a pipe or device
+
+    def _writeDocument(self, f, document):
+        """
+        Write a document, which may be a string or (for multipart documents)
+        an iterable of strings, to a file.
+        """
+
+        if isinstance(document, basestring):
+            f.write(document)
+        else:
+            for piece in document: f.write(piece)
 
     def kopyUrl(self, target):
         """ Returns True if t is a URL pointing to kopy.io. """
@@ -153,6 +250,24 @@ https://www.github.com/xmnr/kopycat
 
         return self.times[unit] * quantity
 
+    def parseSize(self, s):
+        """
+        Convert a human-friendly representation of a size, such as 4m, to bytes.
+        """
+
+        unit = s[-1:].lower()
+        quantity = s[:-1] if unit in self.sizes else s
+
+        try:
+            quantity = int(quantity)
+        except ValueError:
+            raise KopyException("Invalid size: {} is not a number.".format(quantity))
+
+        if quantity <= 0:
+            raise KopyException("Invalid size: {} isn't positive.".format(s))
+
+        return quantity * self.sizes.get(unit, 1)
+
     def parseUrl(self, url):
         """ Split a kopy.io URL into the documentId and passphrase (if any.) """
 
@@ -181,17 +296,204 @@ https://www.github.com/xmnr/kopycat
     # Functionality
 
     def download(self, documentId, passphrase):
+        """
+        Returns a document's contents; for multipart documents, an iterator
+        over its pieces.
+        """
+
+        document = self.retrieveDocument(documentId, passphrase)
+        if self.isMultipart(document):
+            return self.retrieveMultipart(document, passphrase)
+        return document["data"]
+
+    def saveDocument(self, documentId, passphrase, path=None):
+        """
+        Download a document to a file, or stdout, as it arrives.
+        """
 
-        return self.retrieveDocument(documentId, passphrase)["data"]
+        if not path:
+            fields = self.streamDocument(documentId, self.stdout, passphrase)
+            if not self.isMultipart(fields): self.stdout.write("\n")
+            self.stdout.flush()
+            exit(0)
 
-    def outputDocument(self, document):
-        
-        self._succeed(document)
+        try:
+            with open(path, "wb") as f:
+                self.streamDocument(documentId, f, passphrase)
+        except:
+            if os.path.isfile(path): os.unlink(path) # don't leave half of it
+            raise
+        exit(0)
+
+    def bundleEntries(self, paths):
+        """
+        Returns bundle entries for files, and every file under directories,
+        named relative to the directory each path is in.
+
+        Only files of at least bundleMapSize bytes are memory-mapped; a map
+        holds a file descriptor open until the bundle is packed, and a
+        directory of small files can easily outnumber the limit on those.
+        """
+
+        entries = []
+        for path in paths:
+            if self.kopyUrl(path):
+                raise KopyException("Can't mix URLs with files to bundle: {}.".format(path))
+            base = os.path.dirname(os.path.normpath(path))
+            files = [path]
+            if os.path.isdir(path):
+                files = []
+                for directory, directories, names in os.walk(path):
+                    directories.sort()
+                    files += [os.path.join(directory, name) for name in sorted(names)]
+            for f in files:
+                name = os.path.relpath(f, base).replace(os.sep, "/")
+                status = os.stat(f)
+                if status.st_size >= self.bundleMapSize:
+                    data = self._getFile(f)
+                else:
+                    with self._openFile(f) as source:
+                        data = source.read()
+                entries.append((name, data, status.st_mode & 0777))
+        return entries
+
+    def unbundle(self, documentId, passphrase, directory=None, names=None):
+        """
+        List the files in a bundle, or extract them (or just those in names)
+        into directory.
+        """
+
+        if not directory:
+            for entry in self.readBundle(documentId, passphrase):
+                self.stdout.write("{:>10}  {}\n".format(entry["size"], entry["name"]))
+            exit(0)
+
+        def create(entry):
+            path = os.path.join(directory, *entry["name"].split("/"))
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            f = open(path, "wb")
+            if entry["mode"] != None: os.chmod(path, entry["mode"] & 0777)
+            return f
+
+        self.readBundle(documentId, passphrase, create, names or None)
+        exit(0)
+
+    def follow(self, path, passphrase, keep, sharable, segmentSize, interval,
+               compression=None):
+        """
+        Upload what's appended to a file as it grows, a segment at a time,
+        printing a URL for each, until interrupted. A segment which fails to
+        upload is reported, and tried again (after a pause, doubling with
+        each failure in a row) before anything newer.
+        """
+
+        from time import sleep
+        from api.follow import Follower
+
+        def upload(segment):
+            self.stdout.write(self.formatUrl(self.createDocument(segment,
+                              passphrase, keep, compression),
+                              passphrase if sharable else None) + "\n")
+            self.stdout.flush()
+
+        follower = Follower(path, segmentSize, interval)
+        segment = None # being uploaded
+        failures = 0 # in a row
+        try:
+            while True:
+                segment = follower.next()
+                try:
+                    upload(segment)
+                except Exception as e:
+                    follower.unread(segment)
+                    segment = None
+                    failures += 1
+                    self.stderr.write("Upload failed, will retry: {}\n".format(e))
+                    sleep(min(self.retryBackoff * 2 ** failures, interval))
+                else:
+                    segment = None
+                    failures = 0
+        except KeyboardInterrupt:
+            follower.unread(segment) # interrupted mid-upload
+            segment = follower.flush() # don't lose the last of it
+            while segment:
+                upload(segment)
+                segment = follower.flush()
+        finally:
+            follower.close()
+        exit(0)
 
     def outputUrl(self, documentId, passphrase=None):
 
         self._succeed(self.formatUrl(documentId, passphrase))
 
+    def uploadFiles(self, paths, passphrase, generate, keep, sharable,
+                    jobs, ordered, compression=None):
+        """
+        Upload several files concurrently, printing one URL per line as each
+        upload finishes (or, if ordered, in the same order as paths.)
+        """
+
+        for path in paths:
+            if self.kopyUrl(path):
+                raise KopyException("Can't mix URLs with files to upload: {}.".format(path))
+
+        if jobs > self.poolSize:
+            self.poolSize = jobs
+            self.session = self._newSession()
+            self.scheduler = None # to allow as many requests at once
+
+        failed = False
+        for index, result, e in self.uploadDocuments(paths, passphrase, keep,
+                                    generate, self._getFile, jobs, ordered,
+                                    compression):
+            if e != None:
+                failed = True
+                self.stderr.write("{}: {}\n".format(paths[index], e))
+            else:
+                documentId, p = result
+                self.stdout.write(self.formatUrl(documentId, p if sharable else None) + "\n")
+                self.stdout.flush()
+
+        exit(1 if failed else 0)
+
+    def downloadUrls(self, urls, passphrase, jobs, outputDirectory=None):
+        """
+        Download the documents at several kopy.io URLs concurrently. Documents
+        are written to stdout (or to files named after their identifiers in
+        outputDirectory) in the same order as urls, as soon as every document
+        before them has been written. Failures are reported on stderr, without
+        stopping the others.
+        """
+
+        urls = [url for url in (line.strip() for line in urls) if url]
+
+        def fetch(url):
+            documentId, p = self.parseUrl(url)
+            return documentId, self.download(documentId, p or passphrase)
+
+        if jobs > self.poolSize:
+            self.poolSize = jobs
+            self.session = self._newSession()
+            self.scheduler = None # to allow as many requests at once
+
+        failed = False
+        for index, result, e in self._bulk(fetch, urls, jobs):
+            if e != None:
+                failed = True
+                self.stderr.write("{}: {}\n".format(urls[index], e))
+            elif outputDirectory:
+                documentId, document = result
+                with open(os.path.join(outputDirectory, documentId), "w") as f:
+                    self._writeDocument(f, document)
+            else:
+                self._writeDocument(self.stdout, result[1])
+                self.stdout.write("\n")
+                self.stdout.flush()
+
+        exit(1 if failed else 0)
+
     def prompt(self):
         """ Prompt user for a passphrase. """
 
@@ -208,16 +510,16 @@ https://www.github.com/xmnr/kopycat
 
     # Command liney-ness
 
-    def arguments(self):
+    def arguments(self, args=None):
         """
-        Configure and parse arguments.
+        Configure and parse arguments (by default, from the command line.)
         """
 
         parser = argparse.ArgumentParser(description=self.description,
                                         epilog=self.examples,
                                         formatter_class=argparse.RawDescriptionHelpFormatter)
-        parser.add_argument("target", default=False, nargs="?",
-                            help="File to upload or kopy.io URL to download."+ \
+        parser.add_argument("target", nargs="*",
+                            help="File(s) to upload or kopy.io URL to download."+ \
                             " If URL contains an anchor, it is taken to be the" + \
                             " passphrase; however, this method is insecure.")
         parser.add_argument("-u", "--sharable", default=False, action="store_true",
@@ -244,32 +546,371 @@ https://www.github.com/xmnr/kopycat
         parser.add_argument("-k", "--keep", type=int, default=600,
                             help="Number of seconds to store the document. " + \
                             "(Default is 600, or 10 minites.)") 
+        parser.add_argument("-o", "--output",
+                            help="Write the downloaded document to this " + \
+                            "file, rather than stdout.")
+        parser.add_argument("-b", "--bundle", default=False, action="store_true",
+                            help="Pack the files given, and everything in " + \
+                            "any directories given, into one document.")
+        parser.add_argument("--list", default=False, action="store_true",
+                            help="List the files in a bundle.")
+        parser.add_argument("-x", "--extract", metavar="DIRECTORY",
+                            help="Extract the files in a bundle into this " + \
+                            "directory; if the URL is followed by names, " + \
+                            "only those files.")
+        parser.add_argument("-F", "--follow", metavar="FILE",
+                            help="Follow a growing file, uploading what's " + \
+                            "appended to it as a series of documents, and " + \
+                            "printing a URL for each, until interrupted.")
+        parser.add_argument("--segment-size", type=self.parseSize,
+                            default=self.segmentSize,
+                            help="With -F, upload once this much has been " + \
+                            "appended; in bytes, or with a unit: k, m or g. " + \
+                            "(Default is {}m.)".format(self.segmentSize / 1024**2))
+        parser.add_argument("--interval", type=float, default=self.interval,
+                            help="With -F, upload whatever has been " + \
+                            "appended this many seconds after it was. " + \
+                            "(Default is {}.)".format(self.interval))
+        parser.add_argument("--urls", help="Download every kopy.io URL " + \
+                            "listed in this file, one per line (- for stdin.)")
+        parser.add_argument("--output-dir", help="With --urls, write each " + \
+                            "document to a file in this directory, named " + \
+                            "after the document, instead of to stdout.")
+        parser.add_argument("-z", "--compress", nargs="?", const="auto",
+                            choices=["auto", "none"] + compressionCodecs(),
+                            help="Compress documents before uploading (and " + \
+                            "encrypting) them. With no argument, or \"auto\", " + \
+                            "pick a codec by size. Compressed documents can " + \
+                            "only be read with kopycat, not on kopy.io.")
+        parser.add_argument("--scheme", choices=["encrypted", "chunked"],
+                            default=self.scheme,
+                            help="How to encrypt documents: \"encrypted\" " + \
+                            "(AES-CBC) can be read on kopy.io; \"chunked\" " + \
+                            "(authenticated, and spread across CPUs) is " + \
+                            "faster for big documents, but only kopycat can " + \
+                            "read it. (Default is {}.)".format(self.scheme))
+        parser.add_argument("-m", "--multipart", default=False, action="store_true",
+                            help="Upload the document in pieces, as several " + \
+                            "documents at once, and return the URL of a " + \
+                            "manifest listing them.")
+        parser.add_argument("--pipeline", default=False, action="store_true",
+                            help="Start uploading the document while it's " + \
+                            "still being read and encrypted, rather than " + \
+                            "reading it all first. The server has to accept " + \
+                            "chunked request bodies, which kopy.io may not.")
+        parser.add_argument("--shard-size", type=self.parseSize,
+                            default=self.shardSize,
+                            help="Size of each piece of a multipart document, " + \
+                            "in bytes, or with a unit: k, m or g. " + \
+                            "(Default is {}m.)".format(self.shardSize / 1024**2))
+        parser.add_argument("-j", "--jobs", type=int, default=self.workers,
+                            help="Number of documents to upload or download " + \
+                            "at once. (Default is {}.)".format(self.workers))
+        parser.add_argument("--ordered", default=False, action="store_true",
+                            help="When uploading several files, print URLs " + \
+                            "in the order the files were given, rather than " + \
+                            "as each upload finishes.")
+        parser.add_argument("--rate", type=float,
+                            help="Make at most this many requests a second; " + \
+                            "fewer if the server starts struggling.")
+        parser.add_argument("--deadline", type=float,
+                            help="Give up on each upload or download after " + \
+                            "this many seconds, retries and all.")
+        parser.add_argument("--hedge", type=float, metavar="PERCENTILE",
+                            help="When downloading several documents, " + \
+                            "request any which are slower than this " + \
+                            "percentile of the others (e.g. 95) a second " + \
+                            "time, and use whichever response comes first.")
+        parser.add_argument("--no-cache", default=False, action="store_true",
+                            help="Don't use or update the local cache of " + \
+                            "downloaded documents.")
+        parser.add_argument("--refresh-cache", default=False, action="store_true",
+                            help="Download documents even if they're cached, " + \
+                            "and update the cache.")
+        parser.add_argument("--cache-size", type=int,
+                            default=DocumentCache.maxBytes / 1024 / 1024,
+                            help="Maximum size of the local cache, in MB. " + \
+                            "(Default is {}.)".format(DocumentCache.maxBytes / 1024 / 1024))
+        parser.add_argument("--dedup", default=False, action="store_true",
+                            help="Remember uploads, and rather than upload " + \
+                            "the same file the same way again, print the " + \
+                            "earlier URL, if it has a minute or more left.")
+        parser.add_argument("--backend", choices=[b.name for b in backends],
+                            help="Crypto library to use. (Default is the " + \
+                            "fastest one installed, or $KOPY_BACKEND.)")
+        parser.add_argument("--stats", default=False, action="store_true",
+                            help="When done, print how long each phase " + \
+                            "(key derivation, encryption, HTTP, JSON, ...) " + \
+                            "took to stderr.")
+        parser.add_argument("--daemon", default=False, action="store_true",
+                            help="Stay running, and carry out other kopycat " + \
+                            "commands for them, keeping connections and " + \
+                            "caches warm.")
+        parser.add_argument("--no-daemon", default=False, action="store_true",
+                            help="Don't pass this command to a running daemon.")
+        parser.add_argument("--socket", default=daemon.defaultSocket(),
+                            help="Unix socket the daemon listens on. " + \
+                            "(Default is {}.)".format(daemon.defaultSocket()))
         parser.add_argument("--debug", default=False, action="store_true",
                             help="Dump exceptions to the terminal.")
 
-        return parser.parse_args()
+        return parser.parse_args(args)
+
+    def loadtest(self, args):
+        """
+        Run a load test, configured by args (the command line after
+        "loadtest"), and print a report.
+        """
+
+        parser = argparse.ArgumentParser(prog="kopycat loadtest",
+                                        description="Drive a mix of uploads " + \
+                                        "and downloads against a kopy.io-" + \
+                                        "compatible server, and report " + \
+                                        "throughput, errors and latency.")
+        parser.add_argument("--endpoint", default=self.url,
+                            help="URL of the server's /documents/ API. " + \
+                            "(Default is {}.)".format(self.url))
+        parser.add_argument("--local", default=False, action="store_true",
+                            help="Start a stand-in server in this process, " + \
+                            "and test against that.")
+        parser.add_argument("-c", "--concurrency", type=int, default=8,
+                            help="Number of requests in flight at once.")
+        parser.add_argument("-r", "--rate", type=float,
+                            help="Requests to start per second. (Default is " + \
+                            "as many as possible.)")
+        parser.add_argument("-t", "--duration", type=float, default=10,
+                            help="Seconds to run for. (Default is 10.)")
+        parser.add_argument("-n", "--requests", type=int,
+                            help="Stop after this many requests.")
+        parser.add_argument("--uploads", type=float, default=0.5,
+                            help="Fraction of requests which are uploads; " + \
+                            "the rest are downloads. (Default is 0.5.)")
+        parser.add_argument("--encrypted", type=float, default=0.5,
+                            help="Fraction of uploads which are encrypted. " + \
+                            "(Default is 0.5.)")
+        parser.add_argument("--sizes", default="1k",
+                            help="Comma-separated document sizes to choose " + \
+                            "from; see --shard-size. (Default is 1k.)")
+        parser.add_argument("--retries", type=int, default=0,
+                            help="Retries per request. (Default is 0, so " + \
+                            "every failure shows up.)")
+        arguments = parser.parse_args(args)
+
+        from api.loadtest import LoadTest
+        from api.server import Server
+
+        server = Server().start() if arguments.local else None
+        kopy = Kopy(url=server.url if server else arguments.endpoint,
+                    poolSize=arguments.concurrency, retries=arguments.retries,
+                    backend=self.backend)
+        kopy.scheduler.adaptive = False # keep up the load, however it copes
+
+        test = LoadTest(kopy, arguments.concurrency, arguments.rate,
+                        arguments.duration, arguments.requests, arguments.uploads,
+                        [self.parseSize(s) for s in arguments.sizes.split(",")],
+                        arguments.encrypted)
+        try:
+            test.run()
+        finally:
+            if server: server.stop()
+        self._succeed(test.report())
+
+    def batch(self, args):
+        """
+        Encrypt or decrypt a directory tree, configured by args (the command
+        line after "batch"), and print a summary.
+        """
+
+        parser = argparse.ArgumentParser(prog="kopycat batch",
+                                        description="Encrypt or decrypt " + \
+                                        "every file under a directory, " + \
+                                        "locally, with a process per CPU. " + \
+                                        "Encrypted files get a .enc suffix, " + \
+                                        "and can be read by openssl enc -d " + \
+                                        "-aes-256-cbc -a -md md5.")
+        parser.add_argument("operation", choices=["encrypt", "decrypt"])
+        parser.add_argument("source", help="Directory to read.")
+        parser.add_argument("destination", help="Directory to write to.")
+        parser.add_argument("-e", "--encryption", default=False, action="store_true",
+                            help="Prompt for the passphrase.")
+        parser.add_argument("-f", "--passphrase-file",
+                            help="Read passphrase from a file.")
+        parser.add_argument("-S", "--strip", default=False, action="store_true",
+                            help="Strip whitespace from the passphrase file.")
+        parser.add_argument("-j", "--jobs", type=int,
+                            help="Number of processes. (Default is one per CPU.)")
+        parser.add_argument("--backend", choices=[b.name for b in backends],
+                            help="Crypto library to use.")
+        arguments = parser.parse_args(args)
+
+        if arguments.passphrase_file:
+            passphrase = self._getFile(arguments.passphrase_file)[:]
+            if arguments.strip: passphrase = passphrase.strip()
+        elif arguments.encryption:
+            try:
+                passphrase = self.prompt()
+            except EOFError:
+                raise KopyException("No passphrase was entered.")
+        else:
+            raise KopyException("A passphrase is needed; use -f or -e.")
+
+        from api.batch import Batch
 
-    def main(self):
+        try:
+            batch = Batch(arguments.operation, arguments.source,
+                          arguments.destination, passphrase, arguments.jobs,
+                          arguments.backend)
+        except Exception as e:
+            raise KopyException(str(e))
+        batch.run(self.stderr)
+        self.stdout.write(batch.report() + "\n")
+        exit(1 if batch.errors else 0)
 
+    def serveDaemon(self, path):
+        """
+        Run commands for other kopycats, sharing this one's connection pool
+        and crypto backend, until interrupted.
+        """
+
+        def run(args, stdin, stdout, stderr):
+            cli = CLI(stdin, stdout, stderr, session=self.session,
+                      backend=self.backend)
+            cli.daemonClient = False
+            try:
+                cli.main(args)
+            except SystemExit as e:
+                return e.code if isinstance(e.code, int) else 1
+            return 0
+
+        server = daemon.Daemon(path, run).listen()
+        signal.signal(signal.SIGTERM, lambda signum, frame: exit(0))
+        self.stderr.write("Listening on {}.\n".format(path))
         try:
+            server.serve() # removes the socket when it's interrupted
+        except KeyboardInterrupt:
+            pass
+        exit(0)
 
-            arguments = self.arguments()
+    def _openCache(self, arguments):
+        """
+        Open the document cache, unless told not to; only commands which
+        download anything need it, so the rest don't pay for sqlite.
+        """
+
+        if arguments.no_cache or self.cache: return
+        from sqlite3 import DatabaseError
+        try:
+            self.cache = DocumentCache(maxBytes=arguments.cache_size * 1024 * 1024)
+            self.refreshCache = arguments.refresh_cache
+        except (EnvironmentError, DatabaseError):
+            pass # carry on without it
+
+    def _useDaemon(self, arguments):
+        """
+        Returns True if a command can be passed to a daemon: it mustn't need
+        to prompt for a passphrase, follow a file, read stdin from a terminal,
+        or name files, to read or to write,
+        which only mean something to this process (like /dev/fd/3, from a
+        shell's process substitution, or /dev/stdout.)
+        """
+
+        prompts = arguments.encryption and not (arguments.passphrase_file or
+                                                arguments.stdin or
+                                                arguments.generate_passphrase)
+        paths = arguments.target + [arguments.passphrase_file or "",
+                                    arguments.urls or "", arguments.output or "",
+                                    arguments.output_dir or "",
+                                    arguments.extract or ""]
+        private = any(path.startswith(prefix) for path in paths
+                      for prefix in ["/dev/fd/", "/dev/std", "/proc/self/"])
+        # Following runs until interrupted, and the daemon serves one
+        # command at a time; a pipelined upload would wait for all of stdin
+        # to be passed on
+        return self.daemonClient and not arguments.daemon and \
+               not arguments.follow and not arguments.pipeline and \
+               not arguments.no_daemon and not prompts and not private and \
+               not self.stdin.isatty()
+
+    def main(self, args=None):
+
+        if args is None: args = sys.argv[1:]
+        try:
+            self.run(args)
+        finally:
+            if self.statistics:
+                self.stderr.write(self.statistics.report() + "\n")
+                if self.uploadIndex:
+                    self.stderr.write("dedup: {} hits, {} misses\n".format(
+                                      self.uploadIndex.hits,
+                                      self.uploadIndex.misses))
+                if self._scheduler:
+                    self.stderr.write(("requests: {requests}, {congestion} " + \
+                                       "congestion signals ({throttled} 429s); " + \
+                                       "now {limit} at once, {inFlight} in " + \
+                                       "flight, {queued} queued\n").format(
+                                      **self._scheduler.metrics()))
+
+    def run(self, args):
+
+        arguments = None # not parsed yet, for the subcommands
+        try:
+
+            if args[:1] == ["loadtest"]:
+                self.loadtest(args[1:])
+            if args[:1] == ["batch"]:
+                self.batch(args[1:])
+
+            arguments = self.arguments(args)
+
+            if arguments.daemon:
+                self.serveDaemon(arguments.socket)
+
+            if self._useDaemon(arguments):
+                status = daemon.call(arguments.socket, args, self.stdin,
+                                     self.stdout, self.stderr)
+                if status != None: exit(status)
 
             # Parse time
             if arguments.time:
                 arguments.keep = self.parseTime(arguments.time)
 
+            if arguments.backend:
+                self.backend = getBackend(arguments.backend)
+
+            self.scheme = arguments.scheme
+            self.deadline = arguments.deadline
+            self.rateLimit = arguments.rate
+            self.hedgePercentile = arguments.hedge
+
+            if arguments.stats:
+                from api.stats import Stats
+                self.statistics = Stats()
+                self.addListener(self.statistics) # reported by main()
+
+            if arguments.dedup:
+                from sqlite3 import DatabaseError
+                try:
+                    self.uploadIndex = UploadIndex()
+                except (EnvironmentError, DatabaseError):
+                    pass
+
+            if arguments.pipeline and len(arguments.target) > 1:
+                raise KopyException("--pipeline uploads a single file; " + \
+                                    "give one, or pipe it in.")
+
             # Fetch or parse passphrase
             passphrase = None
 
             if arguments.stdin:
-                if not arguments.target:
+                if not arguments.target and arguments.urls in [None, "-"]:
                     raise KopyException("target must be specified when using --stdin.")
-                passphrase = stdin.read()
+                passphrase = self.stdin.read()
             elif arguments.passphrase_file:
                 passphrase = open(arguments.passphrase_file).read()
             elif arguments.generate_passphrase:
-                passphrase = self.generateRandomBytes()
+                # Several files each get their own passphrase; see uploadFiles
+                if len(arguments.target) <= 1:
+                    passphrase = self.generateRandomBytes()
                 arguments.sharable = True
             elif arguments.encryption:
                 # Requires passphrase but none specified
@@ -281,24 +922,70 @@ https://www.github.com/xmnr/kopycat
 
             # Fetch piped documents
             document = None
-            if not arguments.target:
-                document = stdin.read()
+            target = arguments.target[0] if arguments.target else None
+            if not arguments.target and not arguments.urls and \
+               not arguments.multipart and not arguments.bundle and \
+               not arguments.follow and not arguments.pipeline and \
+               not arguments.list and not arguments.extract:
+                document = self.stdin.read()
 
             # Executing the user's request
 
-            if arguments.download:
-                self.outputDocument(self.download(arguments.download, passphrase))
+            if arguments.urls:
+                self._openCache(arguments)
+                urls = self.stdin if arguments.urls == "-" else open(arguments.urls)
+                self.downloadUrls(urls, passphrase, arguments.jobs,
+                                  arguments.output_dir)
+
+            elif arguments.list or arguments.extract:
+                names = arguments.target
+                documentId = arguments.download
+                if not documentId:
+                    if not names or not self.kopyUrl(names[0]):
+                        raise KopyException("Give the URL of a bundle to read.")
+                    documentId, p = self.parseUrl(names[0])
+                    if p != None: passphrase = p
+                    names = names[1:]
+                self._openCache(arguments)
+                self.unbundle(documentId, passphrase,
+                              None if arguments.list else arguments.extract, names)
+
+            elif arguments.download:
+                self._openCache(arguments)
+                self.saveDocument(arguments.download, passphrase, arguments.output)
+
+            elif arguments.follow:
+                self.follow(arguments.follow, passphrase, arguments.keep,
+                            arguments.sharable, arguments.segment_size,
+                            arguments.interval, arguments.compress)
+
+            elif arguments.bundle:
+                if not arguments.target:
+                    raise KopyException("Give the files or directories to bundle.")
+                if arguments.generate_passphrase and passphrase is None:
+                    passphrase = self.generateRandomBytes()
+                self.outputUrl(self.createBundle(self.bundleEntries(arguments.target),
+                                                 passphrase, arguments.keep,
+                                                 arguments.compress or "auto"),
+                               passphrase if arguments.sharable else None)
+
+            elif len(arguments.target) > 1:
+                self.uploadFiles(arguments.target, passphrase,
+                                 arguments.generate_passphrase, arguments.keep,
+                                 arguments.sharable, arguments.jobs,
+                                 arguments.ordered, arguments.compress)
 
             else:
-                if arguments.target and self.kopyUrl(arguments.target):
+                if target and self.kopyUrl(target):
 
                     # We have a target, and have inferred the user wants us to
                     # download a document, because they gave us a kopy.io URL.
 
-                    documentId, p = self.parseUrl(arguments.target)
+                    documentId, p = self.parseUrl(target)
                     if p != None: passphrase = p
                     # Should we print a warning if we overwrite password?
-                    self.outputDocument(self.download(documentId, passphrase))
+                    self._openCache(arguments)
+                    self.saveDocument(documentId, passphrase, arguments.output)
                 else:
 
                     # If they gave us a target that was not a URL, we infer it is a file we should
@@ -306,13 +993,36 @@ https://www.github.com/xmnr/kopycat
                     # If they've not given us a target, then they've passed us a document from stdin
                     # (ie, a pipe) and we've already read the contents into a the document variable.
 
+                    if arguments.multipart:
+                        source = self._openFile(target) if target else self.stdin
+                        self.outputUrl(self.createMultipart(source, passphrase,
+                                                            arguments.keep,
+                                                            arguments.shard_size,
+                                                            arguments.jobs,
+                                                            arguments.compress),
+                                       passphrase if arguments.sharable else None)
+
+                    if arguments.pipeline:
+                        source = self._openFile(target) if target else self.stdin
+                        self.outputUrl(self.createStream(source, passphrase,
+                                                         arguments.keep,
+                                                         arguments.compress),
+                                       passphrase if arguments.sharable else None)
+
                     if document == None: # document is a file
                         # There shouldn't be a way for target to be None
                         # here.
-                        document = self._getFile(arguments.target)
-                    self.outputUrl(self.createDocument(document,
-                                                       passphrase,
-                                                       arguments.keep),
+                        document = self._getFile(target)
+                    if arguments.generate_passphrase:
+                        documentId, passphrase = self._createGenerated(document,
+                                                     arguments.keep,
+                                                     arguments.compress)
+                    else:
+                        documentId = self.createDocument(document,
+                                                         passphrase,
+                                                         arguments.keep,
+                                                         arguments.compress)
+                    self.outputUrl(documentId,
                                    passphrase if arguments.sharable else None)
 
         except KopyException as e:
@@ -321,7 +1031,8 @@ https://www.github.com/xmnr/kopycat
 
         except Exception as e:
 
-            self._fail("An unknown error occured.\n{}".format(e.message if arguments.debug else ""))
+            debug = arguments and arguments.debug
+            self._fail("An unknown error occured.\n{}".format(e.message if debug else ""))
 
 if __name__ == "__main__":
     CLI().main()
@@ -0,0 +1,6 @@
+#!/bin/sh
+
+# Compares against benchmarks/baseline.json, which is created on the first run.
+python benchmarks/suite.py --baseline benchmarks/baseline.json "$@" || failed=1
+python benchmarks/startup.py || failed=1
+exit ${failed:-0}
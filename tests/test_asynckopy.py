@@ -0,0 +1,76 @@
+from unittest import TestCase
+import trollius as asyncio
+from api.asynckopy import AsyncKopy
+from api.server import Server
+
+class AsyncKopyTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.failures = 0
+        self.loop = asyncio.new_event_loop()
+        self.k = AsyncKopy(loop=self.loop)
+        self.k.url = self.server.url
+        self.k.retryBackoff = 0
+
+    def tearDown(self):
+        self.k.close()
+        self.loop.close()
+
+    def wait(self, coroutine):
+        return self.loop.run_until_complete(coroutine)
+
+    def testRoundTrip(self):
+
+        key = self.wait(self.k.createDocument("attack at dawn"))
+        self.assertEqual(self.wait(self.k.retrieveDocument(key))["data"],
+                        "attack at dawn")
+
+        key = self.wait(self.k.createDocument("attack at dawn", "passphrase"))
+        self.assertEqual(self.server.documents[key]["security"], "encrypted")
+        self.assertEqual(self.wait(self.k.retrieveDocument(key, "passphrase"))["data"],
+                        "attack at dawn")
+        self.assertRaises(Exception, self.wait, self.k.retrieveDocument(key))
+        self.assertRaises(Exception, self.wait, self.k.retrieveDocument("nonexistent"))
+
+    def testConcurrency(self):
+
+        documents = ["document {}".format(i) for i in range(50)]
+        keys = self.wait(asyncio.gather(*[self.k.createDocument(d, "passphrase")
+                                          for d in documents], loop=self.loop))
+        results = self.wait(asyncio.gather(*[self.k.retrieveDocument(key, "passphrase")
+                                             for key in keys], loop=self.loop))
+        self.assertEqual([r["data"] for r in results], documents)
+
+        connections = self.server.connections
+        self.wait(asyncio.gather(*[self.k.retrieveDocument(key, "passphrase")
+                                   for key in keys], loop=self.loop))
+        self.assertEqual(self.server.connections, connections)
+        # every connection was kept alive for reuse
+
+    def testRetries(self):
+
+        key = self.wait(self.k.createDocument("attack at dawn"))
+
+        self.server.failures = self.k.retries
+        self.assertEqual(self.wait(self.k.retrieveDocument(key))["data"],
+                        "attack at dawn")
+
+        self.server.failures = self.k.retries + 1
+        self.assertRaises(Exception, self.wait, self.k.retrieveDocument(key))
+
+        # being throttled is retried too
+        self.server.failureStatus = 429
+        try:
+            self.server.failures = self.k.retries
+            self.assertEqual(self.wait(self.k.retrieveDocument(key))["data"],
+                            "attack at dawn")
+        finally:
+            self.server.failureStatus = 503
@@ -0,0 +1,106 @@
+from unittest import TestCase
+from api.backends import availableBackends, getBackend, PurePythonCipher
+from api.kopy import Kopy
+from binascii import unhexlify
+
+class BackendTest(TestCase):
+
+    def setUp(self):
+        self.backends = [backend() for backend in availableBackends()]
+        self.key = "".join(chr(i) for i in range(32))
+        self.iv = "".join(chr(i) for i in range(16, 32))
+        self.plaintext = "".join(chr(i * 7 % 256) for i in range(16 * 40))
+
+    def testFIPS197(self):
+
+        # AES-256 example vector from FIPS-197, appendix C.3
+        plaintext = unhexlify("00112233445566778899aabbccddeeff")
+        ciphertext = unhexlify("8ea2b7ca516745bfeafc49904b496089")
+        for backend in self.backends:
+            self.assertEqual(backend.newCipher(self.key, "\x00"*16).encrypt(plaintext),
+                            ciphertext)
+            self.assertEqual(backend.newCipher(self.key, "\x00"*16).decrypt(ciphertext),
+                            plaintext)
+
+    def testIdenticalOutput(self):
+
+        outputs = set()
+        for backend in self.backends:
+            cipher = backend.newCipher(self.key, self.iv)
+            ciphertext = cipher.encrypt(self.plaintext[:48]) + \
+                         cipher.encrypt(self.plaintext[48:])
+            # chaining carries over between calls
+            outputs.add(ciphertext)
+
+            cipher = backend.newCipher(self.key, self.iv)
+            self.assertEqual(cipher.decrypt(ciphertext[:16]) +
+                             cipher.decrypt(ciphertext[16:]), self.plaintext)
+        self.assertEqual(len(outputs), 1)
+
+    def testKopyCompatibility(self):
+
+        ciphertext = "U2FsdGVkX1/XnDGaEACaoTEhm7YsBicuJNgLrFSMKe0="
+        salt = '\xd7\x9c1\x9a\x10\x00\x9a\xa1'
+        for backend in self.backends:
+            k = Kopy(backend=backend)
+            self.assertEqual(k.encrypt("attack at dawn", "9ACJQzDPFiVJXC", salt),
+                            ciphertext)
+            self.assertEqual(k.decrypt(ciphertext, "9ACJQzDPFiVJXC"),
+                            "attack at dawn")
+
+    def testPadding(self):
+
+        for backend in self.backends:
+            for length in range(40):
+                padded = backend.pad("A" * length, 16)
+                self.assertEqual(len(padded) % 16, 0)
+                self.assertEqual(backend.unpad(padded, 16), "A" * length)
+
+            self.assertRaises(Exception, backend.unpad, "", 16)
+            self.assertRaises(Exception, backend.unpad, "A"*15+"\x00", 16)
+            self.assertRaises(Exception, backend.unpad, "A"*14+"\x01\x02", 16)
+
+    def testCTR(self):
+
+        # CTR-AES256 example vector from NIST SP 800-38A, F.5.5
+        key = unhexlify("603deb1015ca71be2b73aef0857d77811f352c073b6108d72d9810a30914dff4")
+        counter = unhexlify("f0f1f2f3f4f5f6f7f8f9fafbfcfdfeff")
+        plaintext = unhexlify("6bc1bee22e409f96e93d7e117393172a" +
+                              "ae2d8a571e03ac9c9eb76fac45af8e51")
+        ciphertext = unhexlify("601ec313775789a5b7a7f504bbf3d228" +
+                               "f443e3ca4d62b59aca84e990cacaf5c5")
+        for backend in self.backends:
+            self.assertEqual(backend.newCTR(key, counter).encrypt(plaintext),
+                             ciphertext)
+            # the keystream carries over between calls of any length
+            cipher = backend.newCTR(key, counter)
+            self.assertEqual(cipher.encrypt(ciphertext[:5]) +
+                             cipher.encrypt(ciphertext[5:21]) +
+                             cipher.encrypt(ciphertext[21:]), plaintext)
+
+    def testHMACAndPBKDF2(self):
+
+        for backend in self.backends:
+            # RFC 4231, test case 2
+            mac = backend.newHMAC("Jefe")
+            mac.update("what do ya want ")
+            mac.update("for nothing?")
+            self.assertEqual(mac.digest(), unhexlify("5bdcc146bf60754e6a042426" +
+                             "089575c75a003f089d2739839dec58b964ec3843"))
+            self.assertEqual(backend.pbkdf2("password", "salt", 1, 32),
+                             unhexlify("120fb6cffcf8b32c43e7225256c4f837" +
+                                       "a86548c92ccc35480805987cb70be17b"))
+
+    def testPurePythonKeySizes(self):
+
+        # AES-128 example vector from FIPS-197, appendix C.1
+        cipher = PurePythonCipher(self.key[:16], "\x00"*16)
+        self.assertEqual(cipher.encrypt(unhexlify("00112233445566778899aabbccddeeff")),
+                        unhexlify("69c4e0d86a7b0430d8cdb78070b4c55a"))
+        self.assertRaises(Exception, PurePythonCipher, "A"*15, "\x00"*16)
+
+    def testGetBackend(self):
+
+        self.assertEqual(getBackend("python").name, "python")
+        self.assertRaises(Exception, getBackend, "rot13")
+        self.assertTrue(getBackend().name in [b.name for b in self.backends])
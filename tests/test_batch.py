@@ -0,0 +1,101 @@
+import os
+from shutil import rmtree
+from StringIO import StringIO
+from subprocess import Popen, PIPE
+from tempfile import mkdtemp
+from unittest import TestCase
+from api.batch import Batch, Wrapper
+from api.kopy import Kopy
+
+class WrapperTest(TestCase):
+
+    def testWrap(self):
+
+        output = StringIO()
+        w = Wrapper(output, 4)
+        for piece in ["ab", "cdefghi", "", "j"]: w.write(piece)
+        w.close()
+        self.assertEqual(output.getvalue(), "abcd\nefgh\nij\n")
+
+        output = StringIO()
+        w = Wrapper(output, 4)
+        w.write("abcd")
+        w.close()
+        self.assertEqual(output.getvalue(), "abcd\n")
+
+class BatchTest(TestCase):
+
+    passphrase = "9ACJQzDPFiVJXC"
+
+    def setUp(self):
+
+        self.directory = mkdtemp()
+        self.source = os.path.join(self.directory, "source")
+        os.makedirs(os.path.join(self.source, "sub"))
+        self.files = {"a.txt": "attack at dawn\n" * 1000, "empty": "",
+                      os.path.join("sub", "b.bin"): os.urandom(5000)}
+        for name, content in self.files.items():
+            with open(os.path.join(self.source, name), "wb") as f: f.write(content)
+
+    def tearDown(self):
+
+        rmtree(self.directory)
+
+    def path(self, *parts):
+
+        return os.path.join(self.directory, *parts)
+
+    def testRoundTrip(self):
+
+        b = Batch("encrypt", self.source, self.path("encrypted"), self.passphrase,
+                  processes=2).run()
+        self.assertEqual((b.files, b.errors), (3, []))
+        self.assertEqual(b.bytes, sum(len(c) for c in self.files.values()))
+        self.assertIn("Encrypted 3 files", b.report())
+
+        with open(self.path("encrypted", "a.txt.enc")) as f: encrypted = f.read()
+        self.assertTrue(all(len(line) <= 64 for line in encrypted.splitlines()))
+        self.assertEqual(Kopy().decrypt(encrypted, self.passphrase),
+                         self.files["a.txt"])
+
+        b = Batch("decrypt", self.path("encrypted"), self.path("decrypted"),
+                  self.passphrase, processes=2).run()
+        self.assertEqual((b.files, b.errors), (3, []))
+        for name, content in self.files.items():
+            with open(self.path("decrypted", name), "rb") as f:
+                self.assertEqual(f.read(), content)
+
+    def testOpenSSL(self):
+
+        Batch("encrypt", self.source, self.path("encrypted"), self.passphrase,
+              processes=1).run()
+        try:
+            openssl = Popen(["openssl", "enc", "-d", "-aes-256-cbc", "-a", "-md",
+                             "md5", "-pass", "pass:" + self.passphrase, "-in",
+                             self.path("encrypted", "sub", "b.bin.enc")],
+                            stdout=PIPE, stderr=PIPE)
+        except OSError:
+            self.skipTest("openssl isn't installed.")
+        self.assertEqual(openssl.communicate()[0], self.files[os.path.join("sub", "b.bin")])
+
+    def testFailures(self):
+
+        Batch("encrypt", self.source, self.path("encrypted"), self.passphrase,
+              processes=1).run()
+        log = StringIO()
+        b = Batch("decrypt", self.path("encrypted"), self.path("decrypted"),
+                  "wrong", processes=1).run(log)
+        self.assertTrue(b.errors)
+        self.assertEqual(len(log.getvalue().splitlines()), len(b.errors))
+        for path, error in b.errors:
+            self.assertFalse(os.path.exists(self.path("decrypted",
+                             os.path.basename(path)[:-4] + ".part")))
+
+    def testBadArguments(self):
+
+        self.assertRaises(Exception, Batch, "shred", self.source,
+                          self.path("out"), self.passphrase)
+        self.assertRaises(Exception, Batch, "encrypt", self.path("none"),
+                          self.path("out"), self.passphrase)
+        self.assertRaises(Exception, Batch, "encrypt", self.source,
+                          os.path.join(self.source, "out"), self.passphrase)
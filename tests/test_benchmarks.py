@@ -0,0 +1,41 @@
+from unittest import TestCase, skipUnless
+from benchmarks import memory
+from benchmarks.suite import compare, formatSize, measure
+
+class BenchmarkTest(TestCase):
+
+    def testCompare(self):
+
+        baseline = {"results": {"encrypt@1MB": {"seconds": 1.0},
+                                "decrypt@1MB": {"seconds": 1.0},
+                                "_pad@1MB": {"seconds": 1.0}}}
+        current = {"results": {"encrypt@1MB": {"seconds": 1.2},
+                               "decrypt@1MB": {"seconds": 1.3},
+                               "_unpad@1MB": {"seconds": 5.0}}}
+
+        self.assertEqual(compare(baseline, current, 0.25),
+                        [("decrypt@1MB", 1.0, 1.3)])
+        self.assertEqual(compare(baseline, current, 0.1),
+                        [("decrypt@1MB", 1.0, 1.3), ("encrypt@1MB", 1.0, 1.2)])
+
+    def testFormatSize(self):
+
+        self.assertEqual(formatSize(100), "100B")
+        self.assertEqual(formatSize(10 * 1024), "10KB")
+        self.assertEqual(formatSize(100 * 1024 ** 2), "100MB")
+
+    def testMeasure(self):
+
+        self.assertTrue(0 < measure(lambda: None, 0.01) < 0.01)
+
+    @skipUnless(memory.measurable(), "peak memory can't be measured here")
+    def testMemory(self):
+
+        ballast = "x" * (200 * 1024 ** 2) # the children's peaks are their own
+        results = memory.run(4 * 1024 ** 2)
+        del ballast
+        self.assertEqual(sorted(results), sorted(memory.methods))
+        self.assertTrue(results["mmap+encryptInto"] < results["read+encrypt"])
+        # uploading the ciphertext doesn't copy it again
+        self.assertTrue(results["mmap+createDocument"] <
+                        results["mmap+encryptInto"] + 0.25)
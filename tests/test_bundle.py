@@ -0,0 +1,85 @@
+from unittest import TestCase
+from hashlib import sha256
+from StringIO import StringIO
+from simplejson import dumps
+from api import bundle
+
+class Entry(StringIO):
+
+    def __init__(self, files, name):
+
+        StringIO.__init__(self)
+        self.files = files
+        self.name = name
+
+    def close(self):
+
+        self.files[self.name] = self.getvalue()
+
+class BundleTest(TestCase):
+
+    def setUp(self):
+
+        self.bundle = str(bundle.pack([("etc/hosts", "127.0.0.1 localhost\n"),
+                                       ("empty", "", 0600),
+                                       ("motd", buffer("hello"))]))
+
+    def read(self, names=None, size=3, open=True):
+
+        files = {}
+        reader = bundle.Reader((lambda entry: Entry(files, entry["name"]))
+                               if open else None, names)
+        try:
+            for i in range(0, len(self.bundle), size):
+                reader.write(self.bundle[i:i + size])
+            reader.close()
+        except bundle.Finished:
+            pass
+        return reader, files
+
+    def testRoundTrip(self):
+
+        for size in [1, 2, 7, 1000]:
+            reader, files = self.read(size=size)
+            self.assertEqual(files, {"etc/hosts": "127.0.0.1 localhost\n",
+                                     "empty": "", "motd": "hello"})
+        self.assertEqual([(e["name"], e["size"], e["mode"]) for e in reader.index],
+                         [("etc/hosts", 20, None), ("empty", 0, 0600),
+                          ("motd", 5, None)])
+
+    def testSelection(self):
+
+        reader, files = self.read(["motd"])
+        self.assertEqual(files, {"motd": "hello"})
+
+        reader, files = self.read(["etc/hosts"])
+        self.assertEqual(files, {"etc/hosts": "127.0.0.1 localhost\n"})
+
+        reader, files = self.read(open=False)
+        self.assertEqual(files, {})
+        self.assertEqual(len(reader.index), 3)
+
+        self.assertRaises(Exception, self.read, ["nonexistent"])
+
+    def testErrors(self):
+
+        for name in ["", "/etc/passwd", "../up", "a//b", "a/./b", "a\\b"]:
+            self.assertRaises(Exception, bundle.pack, [(name, "x")])
+        self.assertRaises(Exception, bundle.pack, [("a", "x"), ("a", "y")])
+
+        original = self.bundle
+        for mode in [04777, 02755, 01777, -1, "0777", 0.5]:
+            self.assertRaises(Exception, bundle.pack, [("a", "x", mode)])
+            # a hostile bundle, not made by pack()
+            self.bundle = bundle.magic + dumps([{"name": "a", "offset": 0,
+                          "size": 1, "mode": mode,
+                          "sha256": sha256("x").hexdigest()}]) + "\nx"
+            self.assertRaises(Exception, self.read)
+        self.bundle = original
+
+        self.bundle = self.bundle[:-1]
+        self.assertRaises(Exception, self.read)
+        self.bundle = self.bundle[:-2] + "xx"
+        self.assertRaises(Exception, self.read)
+        self.bundle = "not a bundle"
+        self.assertRaises(Exception, self.read)
@@ -0,0 +1,191 @@
+from unittest import TestCase
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp
+import os
+from api.cache import DocumentCache, UploadIndex
+from api.kopy import Kopy
+from api.server import Server
+
+class DocumentCacheTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, "cache", "documents.sqlite")
+        self.c = DocumentCache(self.path, maxBytes=100)
+        self.now = 1000.0
+        self.c.clock = lambda: self.now
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testGetPut(self):
+
+        self.assertEqual(self.c.get("12345"), None)
+        self.c.put("12345", u'{"data": "A"}', keep=600)
+        self.assertEqual(self.c.get("12345"), u'{"data": "A"}')
+        reopened = DocumentCache(self.path)
+        reopened.clock = self.c.clock
+        self.assertEqual(reopened.get("12345"), u'{"data": "A"}')
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0600)
+
+    def testExpiry(self):
+
+        self.c.put("12345", u"A", keep=600)
+        self.c.put("23456", u"B", keep="not a number") # maxAge
+        self.c.put("34567", u"C", keep=0) # not cached at all
+        self.assertEqual(self.c.get("34567"), None)
+
+        self.now += 600
+        self.assertEqual(self.c.get("12345"), None)
+        self.assertEqual(self.c.get("23456"), u"B")
+        self.now += self.c.maxAge
+        self.assertEqual(self.c.get("23456"), None)
+
+    def testEviction(self):
+
+        for i in range(5):
+            self.now += 1
+            self.c.put(str(i), u"A" * 30)
+        self.assertTrue(self.c.size() <= 100)
+        self.assertEqual(self.c.get("0"), None)
+        self.assertEqual(self.c.get("1"), None)
+
+        self.now += 1
+        self.c.get("2") # now most recently used
+        self.now += 1
+        self.c.put("5", u"A" * 30)
+        self.assertEqual(self.c.get("3"), None)
+        self.assertEqual(self.c.get("2"), u"A" * 30)
+
+        self.c.put("6", u"A" * 101) # too big to cache
+        self.assertEqual(self.c.get("6"), None)
+
+class UploadIndexTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.i = UploadIndex(os.path.join(self.directory, "uploads.sqlite"))
+        self.now = 1000.0
+        self.i.clock = lambda: self.now
+
+    def tearDown(self):
+        rmtree(self.directory)
+
+    def testKeys(self):
+
+        key = self.i.key("attack at dawn", url="a")
+        self.assertEqual(key, self.i.key(buffer("attack at dawn"), url="a"))
+        others = [self.i.key("attack at noon", url="a"),
+                  self.i.key("attack at dawn", url="b"),
+                  self.i.key("attack at dawn", "passphrase", url="a"),
+                  self.i.key("attack at dawn", "other", url="a"),
+                  self.i.key("attack at dawn", generated=True, url="a"),
+                  self.i.key("attack at dawn", url="a", compression="zlib")]
+        self.assertEqual(len(set(others + [key])), 7)
+
+    def testGetPut(self):
+
+        self.assertEqual(self.i.get("key"), None)
+        self.i.put("key", "12345", "passphrase", 600)
+        self.assertEqual(self.i.get("key"), ("12345", "passphrase"))
+        self.now += 600 - self.i.minimumLife
+        self.assertEqual(self.i.get("key"), ("12345", "passphrase"))
+        self.now += 1 # too close to expiring
+        self.assertEqual(self.i.get("key"), None)
+        self.assertEqual((self.i.hits, self.i.misses), (2, 2))
+
+class KopyCacheTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.server = Server().start()
+        self.k = Kopy(cache=DocumentCache(os.path.join(self.directory, "cache")))
+        self.k.url = self.server.url
+
+    def tearDown(self):
+        self.server.stop()
+        rmtree(self.directory)
+
+    def testRetrieve(self):
+
+        key = self.k.createDocument("attack at dawn", "passphrase", keep=60)
+        self.assertEqual(self.k.retrieveDocument(key, "passphrase")["data"],
+                        "attack at dawn")
+        self.assertTrue("U2FsdGVkX1" in self.k.cache.get(self.k.url + key))
+        # stored as received, still encrypted
+
+        self.server.documents[key] = {"data": "changed", "security": "default"}
+        self.assertEqual(self.k.retrieveDocument(key, "passphrase")["data"],
+                        "attack at dawn")
+
+        self.k.refreshCache = True
+        self.assertEqual(self.k.retrieveDocument(key)["data"], "changed")
+        self.k.refreshCache = False
+        self.assertEqual(self.k.retrieveDocument(key)["data"], "changed")
+
+        self.assertRaises(Exception, self.k.retrieveDocument, "nonexistent")
+        self.assertEqual(self.k.cache.get(self.k.url + "nonexistent"), None)
+
+    def testServers(self):
+
+        key = self.k.createDocument("attack at dawn", keep=60)
+        self.k.retrieveDocument(key)
+
+        # the same identifier on another server is another document
+        other = Server().start()
+        try:
+            other.documents[key] = {"data": "retreat", "security": "default"}
+            self.k.url = other.url
+            self.assertEqual(self.k.retrieveDocument(key)["data"], "retreat")
+        finally:
+            other.stop()
+
+    def testStream(self):
+
+        key = self.k.createDocument("attack at dawn", "passphrase", keep=60)
+        output = StringIO()
+        self.k.streamDocument(key, output, "passphrase")
+        self.assertEqual(output.getvalue(), "attack at dawn")
+        self.assertTrue("U2FsdGVkX1" in self.k.cache.get(self.k.url + key))
+
+        # the second download is served from the cache
+        self.server.documents[key] = {"data": "changed", "security": "default"}
+        output = StringIO()
+        self.k.streamDocument(key, output, "passphrase")
+        self.assertEqual(output.getvalue(), "attack at dawn")
+
+        # responses bigger than the whole cache aren't kept
+        self.k.cache.maxBytes = 1000
+        key = self.k.createDocument("A" * 2000)
+        self.k.streamDocument(key, StringIO())
+        self.assertEqual(self.k.cache.get(self.k.url + key), None)
+
+        # nor are ones which couldn't be read
+        key = self.k.createDocument("attack at dawn", "passphrase")
+        self.assertRaises(Exception, self.k.streamDocument, key, StringIO(), "wrong")
+        self.assertEqual(self.k.cache.get(self.k.url + key), None)
+
+    def testDedup(self):
+
+        self.k.uploadIndex = UploadIndex(os.path.join(self.directory, "uploads"))
+
+        key = self.k.createDocument("attack at dawn", "passphrase")
+        self.assertEqual(self.k.createDocument("attack at dawn", "passphrase"), key)
+        self.assertNotEqual(self.k.createDocument("attack at dawn"), key)
+        self.assertNotEqual(self.k.createDocument("attack at dawn", "other"), key)
+        self.assertEqual(len(self.server.documents), 3)
+
+        # a paste uploaded to last two minutes isn't reused for a month
+        key = self.k.createDocument("report", keep=120)
+        self.assertNotEqual(self.k.createDocument("report", keep=30 * 86400), key)
+        self.assertEqual(self.k.createDocument("report", keep=120), key)
+        self.assertEqual(len(self.server.documents), 5)
+
+        results = self.k.createDocuments(["A", "A", "B"], generate=True, workers=1)
+        self.assertEqual(results[0], results[1])
+        self.assertNotEqual(results[0][1], results[2][1])
+        self.assertEqual(self.k.retrieveDocument(*results[1])["data"], "A")
+        self.assertEqual(len(self.server.documents), 7)
+        self.assertEqual((self.k.uploadIndex.hits, self.k.uploadIndex.misses),
+                         (3, 7))
@@ -0,0 +1,112 @@
+from unittest import TestCase
+from base64 import b64encode, b64decode
+from struct import pack
+from api import chunked
+from api.backends import availableBackends
+from api.kopy import Kopy
+
+class ChunkedTest(TestCase):
+
+    def setUp(self):
+        self.iterations, self.chunkSize = chunked.iterations, chunked.chunkSize
+        chunked.iterations, chunked.chunkSize = 1000, 1000
+        self.k = Kopy()
+        self.document = "".join(chr(i * 7 % 256) for i in range(4500))
+
+    def tearDown(self):
+        chunked.iterations, chunked.chunkSize = self.iterations, self.chunkSize
+
+    def encrypt(self, document, passphrase="passphrase", salt=None, pieces=1):
+        encryptor = self.k.encryptor(passphrase, salt, scheme="chunked")
+        step = len(document) / pieces + 1
+        return "".join(encryptor.update(document[i:i + step])
+                       for i in range(0, len(document), step)) + \
+               encryptor.finalize()
+
+    def decrypt(self, ciphertext, passphrase="passphrase", pieces=1):
+        decryptor = self.k.decryptor(passphrase, "chunked")
+        step = len(ciphertext) / pieces + 1
+        return "".join(decryptor.update(ciphertext[i:i + step])
+                       for i in range(0, len(ciphertext), step)) + \
+               decryptor.finalize()
+
+    def testRoundTrip(self):
+
+        for size in [0, 1, 999, 1000, 1001, 4500]:
+            document = self.document[:size]
+            ciphertext = self.encrypt(document)
+            # a tag per chunk, and at least one chunk
+            self.assertEqual(len(b64decode(ciphertext)), chunked.headerLength +
+                             size + max(1, (size + 999) / 1000) * chunked.tagLength)
+            self.assertEqual(self.decrypt(ciphertext), document)
+            self.assertEqual(self.decrypt(ciphertext, pieces=7), document)
+
+    def testIncremental(self):
+
+        salt = "s" * 16
+        ciphertext = self.encrypt(self.document, salt=salt)
+        self.assertEqual(self.encrypt(self.document, salt=salt, pieces=9), ciphertext)
+        self.assertEqual(self.encrypt(buffer(self.document), salt=salt), ciphertext)
+        self.assertNotEqual(self.encrypt(self.document), ciphertext)
+
+    def testBackends(self):
+
+        outputs = set()
+        for backend in availableBackends():
+            self.k.backend = backend()
+            ciphertext = self.encrypt(self.document, salt="s" * 16)
+            self.assertEqual(self.decrypt(ciphertext), self.document)
+            outputs.add(ciphertext)
+        self.assertEqual(len(outputs), 1)
+
+    def testTampering(self):
+
+        raw = b64decode(self.encrypt(self.document))
+        header, size = chunked.headerLength, 1000 + chunked.tagLength
+        chunks = [raw[i:i + size] for i in range(header, len(raw), size)]
+        flipped = raw[:header + 10] + chr(ord(raw[header + 10]) ^ 1) + raw[header + 11:]
+
+        for damaged in [flipped, # corrupted
+                        raw[:-1], # truncated mid-chunk
+                        raw[:header + 4 * size], # last chunk dropped
+                        raw[:header] + chunks[1] + chunks[0] + "".join(chunks[2:]),
+                        raw[:header] + "".join(chunks[:2])]: # truncated between chunks
+            self.assertRaises(Exception, self.decrypt, b64encode(damaged))
+
+        self.assertRaises(Exception, self.decrypt, b64encode(raw), "wrong")
+
+    def testEarlyRejection(self):
+
+        raw = b64decode(self.encrypt(self.document))
+        offset = chunked.headerLength + 5
+        raw = raw[:offset] + chr(ord(raw[offset]) ^ 1) + raw[offset + 1:]
+
+        # the first chunk is checked as soon as the second starts to arrive
+        decryptor = self.k.decryptor("passphrase", "chunked")
+        self.assertRaises(Exception, decryptor.update,
+                          b64encode(raw[:chunked.headerLength + 1040]))
+
+    def testHeader(self):
+
+        raw = b64decode(self.encrypt(self.document))
+        for header in ["KopyXX01" + raw[8:], # not chunked
+                       raw[:8] + "\x00" * 4 + raw[12:], # no chunk size
+                       raw[:12] + "\xff" * 4 + raw[16:]]: # absurd iterations
+            self.assertRaises(Exception, self.decrypt, b64encode(header))
+        self.assertRaises(Exception, self.decrypt, "")
+
+    def testLimits(self):
+
+        # headers asking for too much work or memory are refused before any
+        # keys are derived
+        header = lambda size, count: chunked.magic + pack(">II", size, count) + \
+                                     "s" * 16
+        keys = chunked.Keys.fromHeader(self.k, "passphrase",
+                                       header(chunked.maxChunkSize, 1000))
+        self.assertEqual(keys.chunkSize, chunked.maxChunkSize)
+        for size, count in [(chunked.maxChunkSize + 1, 1000), (2 ** 30, 1000),
+                            (1000, chunked.maxIterations + 1), (1000, 10 ** 7)]:
+            self.assertRaises(Exception, chunked.Keys.fromHeader, self.k,
+                              "passphrase", header(size, count))
+        self.assertTrue(chunked.maxIterations <= 10 ** 6)
+        self.assertTrue(chunked.maxChunkSize <= 2 ** 20)
@@ -1,5 +1,13 @@
 from unittest import TestCase
+from StringIO import StringIO
+from tempfile import NamedTemporaryFile, mkdtemp
+from shutil import rmtree
+from threading import Timer
 from kopycat import CLI
+from api.server import Server
+import mmap
+import os
+import resource
 
 class CLITest(TestCase):
 
@@ -23,6 +31,18 @@ class CLITest(TestCase):
         self.assertRaises(Exception, self.c.parseTime, "1")
         self.assertRaises(Exception, self.c.parseTime, "1min")
 
+    def testSize(self):
+
+        self.assertEqual(self.c.parseSize("100"), 100)
+        self.assertEqual(self.c.parseSize("1k"), 1024)
+        self.assertEqual(self.c.parseSize("4M"), 4*1024**2)
+        self.assertEqual(self.c.parseSize("2g"), 2*1024**3)
+
+        self.assertRaises(Exception, self.c.parseSize, "")
+        self.assertRaises(Exception, self.c.parseSize, "m")
+        self.assertRaises(Exception, self.c.parseSize, "0k")
+        self.assertRaises(Exception, self.c.parseSize, "10y")
+
     def testUrlParse(self):
 
         self.assertEqual(self.c.parseUrl("https://kopy.io/12345"), ("12345", None))
@@ -58,3 +78,125 @@ class CLITest(TestCase):
         self.assertTrue(self.c.kopyUrl("http://kopy.io/12345#AAAAA"))
         
         # Should kopyUrl raise errors for URLs w/o a document ID?
+
+    def testGetFile(self):
+
+        with NamedTemporaryFile() as f:
+            self.assertEqual(self.c._getFile(f.name), "")
+            f.write("attack at dawn")
+            f.flush()
+            document = self.c._getFile(f.name)
+            self.assertTrue(isinstance(document, mmap.mmap))
+            self.assertEqual(document[:], "attack at dawn")
+        self.assertRaises(Exception, self.c._getFile, "/nonexistent")
+
+    def testSubcommandFailure(self):
+
+        def fail(args):
+            raise ValueError("boom")
+
+        # reported like any other failure, though the main arguments weren't
+        # parsed
+        c = CLI(stderr=StringIO())
+        c.loadtest = fail
+        self.assertRaises(SystemExit, c.run, ["loadtest", "--local"])
+        self.assertEqual(c.stderr.getvalue(), "An unknown error occured.\n")
+
+    def testBatchFailure(self):
+
+        def prompt():
+            raise EOFError() # as getpass does, with nothing to read
+
+        c = CLI(stdout=StringIO(), stderr=StringIO())
+        c.prompt = prompt
+        self.assertRaises(SystemExit, c.run, ["batch", "encrypt", "src", "dst", "-e"])
+        self.assertEqual(c.stderr.getvalue(), "No passphrase was entered.\n")
+
+        c = CLI(stdout=StringIO(), stderr=StringIO())
+        c.batch = lambda args: {}["boom"]
+        self.assertRaises(SystemExit, c.run, ["batch", "encrypt", "src", "dst"])
+        self.assertEqual(c.stderr.getvalue(), "An unknown error occured.\n")
+
+    def testCacheOnlyForDownloads(self):
+
+        directory = mkdtemp()
+        server = Server().start()
+        environ = os.environ.get("XDG_CACHE_HOME")
+        os.environ["XDG_CACHE_HOME"] = directory
+        try:
+            c = CLI(stdin=StringIO("attack at dawn"), stdout=StringIO())
+            c.url = server.url
+            self.assertRaises(SystemExit, c.run, ["--no-daemon"])
+            self.assertFalse(c.cache)
+            self.assertFalse(os.path.exists(os.path.join(directory, "kopycat")))
+
+            documentId = c.stdout.getvalue().strip().split("/")[-1].rstrip("#")
+            c = CLI(stdin=StringIO(), stdout=StringIO())
+            c.url = server.url
+            self.assertRaises(SystemExit, c.run, ["--no-daemon", "-d", documentId])
+            self.assertEqual(c.stdout.getvalue().strip(), "attack at dawn")
+            self.assertTrue(c.cache)
+        finally:
+            if environ is None: del os.environ["XDG_CACHE_HOME"]
+            else: os.environ["XDG_CACHE_HOME"] = environ
+            server.stop()
+            rmtree(directory)
+
+    def testFollowFailures(self):
+
+        directory = mkdtemp()
+        path = os.path.join(directory, "log")
+        open(path, "w").close()
+        uploads = []
+
+        def createDocument(segment, *args):
+            uploads.append(segment)
+            if len(uploads) == 1: raise Exception("boom")
+            if len(uploads) == 2: raise KeyboardInterrupt()
+            return "12345"
+
+        c = CLI(stdout=StringIO(), stderr=StringIO())
+        c.createDocument = createDocument
+        c.retryBackoff = 0
+        appender = Timer(0.1, lambda: open(path, "a").write("0123456789"))
+        appender.start()
+        try:
+            self.assertRaises(SystemExit, c.follow, path, None, 600, False, 10, 60)
+        finally:
+            appender.cancel()
+            rmtree(directory)
+
+        # the segment survived both the failure and the interruption
+        self.assertEqual(uploads, ["0123456789"] * 3)
+        self.assertEqual(c.stdout.getvalue(), "https://kopy.io/12345#\n")
+        self.assertEqual(c.stderr.getvalue(), "Upload failed, will retry: boom\n")
+
+    def testPipelineTargets(self):
+
+        c = CLI(stdout=StringIO(), stderr=StringIO())
+        c.createStream = c.uploadFiles = lambda *args: self.fail("uploaded")
+        self.assertRaises(SystemExit, c.run, ["--no-daemon", "--pipeline",
+                                              "first.txt", "second.txt"])
+        self.assertEqual(c.stderr.getvalue(), "--pipeline uploads a single " + \
+                         "file; give one, or pipe it in.\n")
+        self.assertEqual(c.stdout.getvalue(), "")
+
+    def testBundleEntries(self):
+
+        directory = mkdtemp()
+        limits = resource.getrlimit(resource.RLIMIT_NOFILE)
+        try:
+            os.mkdir(os.path.join(directory, "conf"))
+            for i in range(300):
+                with open(os.path.join(directory, "conf", "{}.ini".format(i)), "w") as f:
+                    f.write("setting = {}\n".format(i))
+
+            # more files than descriptors
+            resource.setrlimit(resource.RLIMIT_NOFILE, (200, limits[1]))
+            entries = self.c.bundleEntries([os.path.join(directory, "conf")])
+        finally:
+            resource.setrlimit(resource.RLIMIT_NOFILE, limits)
+            rmtree(directory)
+
+        self.assertEqual(len(entries), 300)
+        self.assertEqual(entries[0][:2], ("conf/0.ini", "setting = 0\n"))
@@ -0,0 +1,100 @@
+import os
+from shutil import rmtree
+from StringIO import StringIO
+from tempfile import mkdtemp, TemporaryFile
+from threading import Thread
+from unittest import TestCase
+from api import daemon
+from kopycat import CLI
+
+class DaemonTest(TestCase):
+
+    def setUp(self):
+
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, "kopycat.sock")
+        self.calls = []
+
+        def run(args, stdin, stdout, stderr):
+            self.calls.append((args, os.getcwd()))
+            if "--no-stdin" in args: return 0
+            stdout.write(stdin.readline().upper())
+            stdout.write(stdin.read(3))
+            stderr.write("rest: " + stdin.read())
+            return len(args)
+
+        self.daemon = daemon.Daemon(self.path, run).listen()
+        self.thread = Thread(target=self.daemon.serve)
+        self.thread.start()
+
+    def tearDown(self):
+
+        self.daemon.stop()
+        self.thread.join()
+        rmtree(self.directory)
+
+    def call(self, args, data, cwd=None):
+
+        stdin = TemporaryFile()
+        stdin.write(data)
+        stdin.seek(0)
+        stdout, stderr = StringIO(), StringIO()
+        status = daemon.call(self.path, args, stdin, stdout, stderr, cwd)
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def testCall(self):
+
+        self.assertEqual(self.call(["-g", "a b"], "first\nsecond\n", "/"),
+                         (2, "FIRST\nsec", "rest: ond\n"))
+        self.assertEqual(self.calls, [(["-g", "a b"], "/")])
+        self.assertEqual(self.call([], "x" * 300000)[0], 0) # several frames
+        self.assertEqual(os.stat(self.path).st_mode & 0777, 0600)
+
+    def testStdinLeftAlone(self):
+
+        # a command which doesn't read stdin leaves it for the next one, as
+        # in a shell loop
+        stdin = TemporaryFile()
+        stdin.write("first\nsecond\n")
+        stdin.seek(0)
+        self.assertEqual(daemon.call(self.path, ["--no-stdin"], stdin,
+                                     StringIO(), StringIO()), 0)
+        self.assertEqual(os.read(stdin.fileno(), 100), "first\nsecond\n")
+
+    def testNoDaemon(self):
+
+        self.assertEqual(daemon.call(os.path.join(self.directory, "none"), [],
+                                     None, None, None), None)
+
+    def testAlreadyListening(self):
+
+        self.assertRaises(Exception, daemon.Daemon(self.path, None).listen)
+
+    def testStop(self):
+
+        self.daemon.stop()
+        self.thread.join()
+        self.assertFalse(os.path.exists(self.path))
+
+class CLIDaemonTest(TestCase):
+
+    def useDaemon(self, *args):
+
+        c = CLI(stdin=TemporaryFile())
+        return c._useDaemon(c.arguments(list(args)))
+
+    def testUseDaemon(self):
+
+        self.assertTrue(self.useDaemon("file.txt", "-g"))
+        self.assertTrue(self.useDaemon("-d", "abcde", "-e", "-f", "passphrase.txt"))
+        self.assertFalse(self.useDaemon("-d", "abcde", "-e")) # prompts
+        self.assertFalse(self.useDaemon("-d", "abcde", "-f", "/dev/fd/63"))
+        # nor the files it writes to
+        self.assertTrue(self.useDaemon("abcde", "-o", "document.txt"))
+        self.assertFalse(self.useDaemon("abcde", "-o", "/dev/stdout"))
+        self.assertFalse(self.useDaemon("abcde", "-o", "/proc/self/fd/1"))
+        self.assertFalse(self.useDaemon("abcde", "-x", "/dev/fd/3"))
+        self.assertFalse(self.useDaemon("--urls", "urls.txt", "--output-dir",
+                                        "/proc/self/cwd"))
+        self.assertFalse(self.useDaemon("file.txt", "--no-daemon"))
+        self.assertFalse(self.useDaemon("--daemon"))
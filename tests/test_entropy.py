@@ -0,0 +1,40 @@
+from unittest import TestCase
+from threading import Thread
+import os
+from api.entropy import EntropyPool
+
+class EntropyPoolTest(TestCase):
+
+    def setUp(self):
+        self.pool = EntropyPool(refillSize=64)
+
+    def testRead(self):
+
+        data = [self.pool.read(n) for n in [1, 8, 63, 100, 14]]
+        self.assertEqual(map(len, data), [1, 8, 63, 100, 14])
+        self.assertRaises(Exception, self.pool.read, 0)
+
+    def testThreads(self):
+
+        output = []
+        def read():
+            for i in range(200): output.append(self.pool.read(16))
+        threads = [Thread(target=read) for i in range(4)]
+        for thread in threads: thread.start()
+        for thread in threads: thread.join()
+        self.assertEqual(len(set(output)), 800)
+
+    def testFork(self):
+
+        self.pool.read(1) # the rest of the pool is inherited by the child
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.write(w, self.pool.read(16))
+            os._exit(0)
+        os.close(w)
+        child = os.read(r, 16)
+        os.close(r)
+        os.waitpid(pid, 0)
+        self.assertEqual(len(child), 16)
+        self.assertNotEqual(child, self.pool.read(16))
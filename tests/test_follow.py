@@ -0,0 +1,59 @@
+from unittest import TestCase
+from shutil import rmtree
+from tempfile import mkdtemp
+import os
+from api.follow import Follower
+
+class FollowerTest(TestCase):
+
+    def setUp(self):
+        self.directory = mkdtemp()
+        self.path = os.path.join(self.directory, "log")
+        self.append("old\n")
+        self.f = Follower(self.path, segmentSize=10, interval=0.2, poll=0.01)
+
+    def tearDown(self):
+        self.f.close()
+        rmtree(self.directory)
+
+    def append(self, data, mode="ab"):
+        with open(self.path, mode) as f: f.write(data)
+
+    def testSegments(self):
+
+        self.assertEqual(self.f.next(timeout=0.05), None) # starts at the end
+
+        self.append("0123456789abc")
+        self.assertEqual(self.f.next(timeout=0), "0123456789") # full
+        self.assertEqual(self.f.next(timeout=0.05), None)
+        self.assertEqual(self.f.next(timeout=1), "abc") # after the interval
+
+        self.append("def")
+        self.assertEqual(self.f.flush(), None) # not read yet
+        self.f.next(timeout=0)
+        self.assertEqual(self.f.flush(), "def")
+
+        for i in range(3): self.append("x")
+        self.assertEqual(self.f.next(), "xxx")
+
+    def testTruncationAndRotation(self):
+
+        self.append("abc", "wb") # shorter than what's been read
+        self.assertEqual(self.f.next(timeout=1), "abc")
+
+        self.append("def")
+        os.rename(self.path, self.path + ".1")
+        self.append("ghi")
+        self.assertEqual(self.f.next(timeout=1), "defghi")
+
+    def testUnread(self):
+
+        self.append("0123456789abc")
+        segment = self.f.next(timeout=0)
+        self.f.unread(segment) # say, the upload failed
+        self.assertEqual(self.f.next(timeout=0), "0123456789")
+        self.assertEqual(self.f.next(timeout=1), "abc")
+
+        self.f.unread("abc")
+        self.append("def")
+        self.assertEqual(self.f.next(timeout=1), "abcdef") # oldest first
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+from unittest import TestCase
+from simplejson import dumps
+from api.jsonstream import DocumentParser
+
+class DocumentParserTest(TestCase):
+
+    def parse(self, response, size):
+
+        p = DocumentParser()
+        pieces = []
+        for i in range(0, len(response), size):
+            pieces += p.feed(response[i:i + size])
+        return "".join(pieces), p.close(), p.dataKeys
+
+    def testChunkBoundaries(self):
+
+        data = u'line "one"\n\\two\t/three é \U0001f600'
+        response = dumps({"security": "encrypted", "keep": 600, "ok": True,
+                          "none": None, "data": data, "ratio": -1.5e3},
+                         ensure_ascii=True,
+                         item_sort_key=lambda (k, v): (k == "ratio", k == "data"))
+        for size in [1, 2, 3, 7, 1000]:
+            output, fields, before = self.parse(response, size)
+            self.assertEqual(output.decode("utf-8"), data)
+            self.assertEqual(fields, {"security": "encrypted", "keep": 600,
+                                      "ok": True, "none": None, "ratio": -1500.0,
+                                      "data": None})
+            self.assertEqual(before, set(fields) - set(["data", "ratio"]))
+
+    def testNoData(self):
+
+        output, fields, before = self.parse('{"message": "Document not found."}', 5)
+        self.assertEqual((output, before), ("", None))
+        self.assertEqual(fields, {"message": "Document not found."})
+
+    def testMalformed(self):
+
+        for response in ['[1, 2]', '{"data" 1}', '{"data": "x"', '{"a": [1]}',
+                         '{"data": "\\q"}', '{} {}']:
+            p = DocumentParser()
+            self.assertRaises(Exception, lambda: (p.feed(response), p.close()))
@@ -1,6 +1,14 @@
 from unittest import TestCase 
-from api.kopy import Kopy
+from api.kopy import Kopy, DeadlineExceeded
+from api.server import Server
+from api.stats import Stats
 from base64 import b64encode, b64decode
+from StringIO import StringIO
+from tempfile import TemporaryFile
+from simplejson import loads
+import mmap
+from threading import Event
+from time import time
 
 class KopyTest(TestCase):
 
@@ -49,6 +57,89 @@ class KopyTest(TestCase):
         self.assertEqual(self.k.decrypt(self.ciphertext, self.passphrase),
                         self.plaintext)
 
+    def testStreamEncryption(self):
+
+        plaintext = "".join(chr(i % 256) for i in range(1000))
+        expected = self.k.encrypt(plaintext, self.passphrase, salt=self.salt)
+
+        for size in [1, 7, 16, 33, 1000]:
+            encryptor = self.k.encryptor(self.passphrase, salt=self.salt)
+            output = [encryptor.update(plaintext[i:i+size])
+                      for i in range(0, len(plaintext), size)]
+            output.append(encryptor.finalize())
+            self.assertEqual("".join(output), expected)
+
+        encryptor = self.k.encryptor(self.passphrase, salt=self.salt)
+        self.assertEqual(encryptor.update(self.plaintext) + encryptor.finalize(),
+                        self.ciphertext)
+        self.assertRaises(Exception, encryptor.update, "A")
+        self.assertRaises(Exception, self.k.encryptor, self.passphrase, "A"*7)
+
+    def testStreamDecryption(self):
+
+        plaintext = "".join(chr(i % 256) for i in range(1000))
+        ciphertext = self.k.encrypt(plaintext, self.passphrase)
+
+        for size in [1, 3, 4, 21, 64, len(ciphertext)]:
+            decryptor = self.k.decryptor(self.passphrase)
+            output = [decryptor.update(ciphertext[i:i+size])
+                      for i in range(0, len(ciphertext), size)]
+            output.append(decryptor.finalize())
+            self.assertEqual("".join(output), plaintext)
+
+        # OpenSSL wraps its output at 64 characters
+        wrapped = "\n".join(ciphertext[i:i+64] for i in range(0, len(ciphertext), 64))
+        decryptor = self.k.decryptor(self.passphrase)
+        self.assertEqual(decryptor.update(wrapped) + decryptor.finalize(), plaintext)
+
+        decryptor = self.k.decryptor(self.passphrase)
+        self.assertRaises(Exception, decryptor.update, b64encode("A"*8 + "B"*24))
+        # Bad salt padding
+
+        decryptor = self.k.decryptor(self.passphrase)
+        decryptor.update(b64encode(self.s + "A"*8 + "B"*33))
+        self.assertRaises(Exception, decryptor.finalize)
+        # Bad size
+
+    def testStreamFiles(self):
+
+        plaintext = "attack at dawn\n" * 10000
+        ciphertext = StringIO()
+        self.k.encryptStream(StringIO(plaintext), ciphertext, self.passphrase)
+
+        output = StringIO()
+        ciphertext.seek(0)
+        self.k.decryptStream(ciphertext, output, self.passphrase)
+        self.assertEqual(output.getvalue(), plaintext)
+        self.assertEqual(self.k.decrypt(ciphertext.getvalue(), self.passphrase),
+                        plaintext)
+
+    def testBuffers(self):
+
+        plaintext = "attack at dawn\n" * 10000
+        ciphertext = self.k.encrypt(plaintext, self.passphrase, self.salt)
+        self.assertEqual(self.k.encryptedSize(len(plaintext)), len(ciphertext))
+
+        with TemporaryFile() as f:
+            f.write(plaintext)
+            f.flush()
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            for document in [bytearray(plaintext), memoryview(plaintext), mapped]:
+                self.assertEqual(self.k.encrypt(document, self.passphrase,
+                                                self.salt), ciphertext)
+
+        output = bytearray(len(ciphertext) + 10)
+        self.assertEqual(self.k.encryptInto(plaintext, output, self.passphrase,
+                                            self.salt), len(ciphertext))
+        self.assertEqual(output[:len(ciphertext)], ciphertext)
+
+        output = mmap.mmap(-1, len(plaintext) + 10)
+        self.assertEqual(self.k.decryptInto(memoryview(ciphertext), output,
+                                            self.passphrase), len(plaintext))
+        self.assertEqual(output[:len(plaintext)], plaintext)
+        self.assertEqual(self.k.decrypt(bytearray(ciphertext), self.passphrase),
+                         plaintext)
+
     # It would be nice if these tests weren't just lumps of binary
     # Doesn't seem to be a good alternative though
 
@@ -114,6 +205,8 @@ class KopyTest(TestCase):
     def testGenerateRandomBytes(self):
 
         self.assertEqual(len(self.k.generateRandomBytes(100)), 100)
+        self.assertEqual(len(self.k.generateRandomBytes(13)), 13)
+        int(self.k.generateRandomBytes(), 16) # hexadecimal
 
         # FIXME no way to differentiate this raising an exception and 
         # _randomBytes, atm
@@ -125,3 +218,338 @@ class KopyTest(TestCase):
         self.assertEqual(len(self.k._generateSalt()), 8)
 
     # TODO set up mocks to test HTTP components
+
+class KopyHTTPTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.server.failures = 0
+        self.server.stalls = 0
+        self.k = Kopy()
+        self.k.url = self.server.url
+        self.k.retryBackoff = 0
+
+    def testRoundTrip(self):
+
+        key = self.k.createDocument("attack at dawn", keep=60)
+        self.assertEqual(self.k.retrieveDocument(key)["data"], "attack at dawn")
+
+        key = self.k.createDocument("attack at dawn", "passphrase")
+        self.assertEqual(self.server.documents[key]["security"], "encrypted")
+        self.assertEqual(self.k.retrieveDocument(key, "passphrase")["data"],
+                        "attack at dawn")
+        self.assertRaises(Exception, self.k.retrieveDocument, key)
+
+    def testNotFound(self):
+
+        self.assertRaises(Exception, self.k.retrieveDocument, "nonexistent")
+
+    def testConnectionReuse(self):
+
+        key = self.k.createDocument("attack at dawn")
+        connections = self.server.connections
+        for i in range(10): self.k.retrieveDocument(key)
+        self.assertEqual(self.server.connections, connections)
+
+    def testRetries(self):
+
+        key = self.k.createDocument("attack at dawn")
+
+        self.server.failures = self.k.retries
+        self.assertEqual(self.k.retrieveDocument(key)["data"], "attack at dawn")
+
+        self.server.failures = self.k.retries + 1
+        self.assertRaises(Exception, self.k.retrieveDocument, key)
+        self.assertTrue(self.k.scheduler.metrics()["congestion"] > 0)
+
+    def testBufferUpload(self):
+
+        plaintext = "".join(chr(i % 256) for i in range(100000))
+        self.server.failures = self.k.retries # the body is sent again
+        key = self.k.createDocument(bytearray(plaintext), "passphrase")
+        self.assertEqual(self.k.decrypt(self.server.documents[key]["data"],
+                                        "passphrase"), plaintext)
+        self.assertEqual(self.k.retrieveDocument(key, "passphrase")["data"],
+                         plaintext)
+
+    def testDeadline(self):
+
+        key = self.k.createDocument("attack at dawn")
+        self.assertEqual(self.k.retrieveDocument(key, deadline=5)["data"],
+                         "attack at dawn")
+
+        self.server.stalls, self.server.stallTime = 1, 0.5
+        start = time()
+        self.assertRaises(DeadlineExceeded, self.k.retrieveDocument, key,
+                          deadline=0.2)
+        self.assertTrue(time() - start < 0.4)
+
+        # No retry is started if its backoff would overrun the deadline
+        self.k.retryBackoff = 0.1
+        self.server.failures = 10
+        self.assertRaises(DeadlineExceeded, self.k.createDocument,
+                          "attack at dawn", deadline=0.25)
+        self.assertTrue(self.server.failures >= 7)
+
+    def testHedging(self):
+
+        self.k.hedgePercentile, self.k.hedgeSamples = 50, 5
+        key = self.k.createDocument("attack at dawn")
+        for i in range(5): self.k.retrieveDocument(key)
+        self.assertEqual(self.k.hedges, 0)
+
+        self.server.stalls, self.server.stallTime = 1, 1
+        start = time()
+        self.assertEqual(self.k.retrieveDocument(key)["data"], "attack at dawn")
+        self.assertTrue(time() - start < 0.5)
+        self.assertEqual(self.k.hedges, 1)
+
+        self.server.failures = 2 * (self.k.retries + 1)
+        self.assertRaises(Exception, self.k.retrieveDocument, key)
+
+    def testBundle(self):
+
+        files = [("a", "attack at dawn"), ("b", "x" * 100000)]
+        key = self.k.createBundle(files, "passphrase")
+        self.assertTrue(self.k.isBundle(self.server.documents[key]))
+
+        index = self.k.readBundle(key, "passphrase")
+        self.assertEqual([(e["name"], e["size"]) for e in index],
+                         [("a", 14), ("b", 100000)])
+
+        output = {}
+        def create(entry):
+            output[entry["name"]] = f = StringIO()
+            f.close = lambda: None
+            return f
+        self.k.readBundle(key, "passphrase", create, ["a"])
+        self.assertEqual(output.keys(), ["a"])
+        self.assertEqual(output["a"].getvalue(), "attack at dawn")
+
+        key = self.k.createDocument("attack at dawn")
+        self.assertRaises(Exception, self.k.readBundle, key)
+
+    def testBulkUpload(self):
+
+        documents = ["document {}".format(i) for i in range(20)]
+        results = self.k.createDocuments(documents, generate=True, workers=4)
+        self.assertEqual(len(set(p for key, p in results)), 20)
+        for document, (key, p) in zip(documents, results):
+            self.assertEqual(self.k.retrieveDocument(key, p)["data"], document)
+
+        results = self.k.createDocuments([("A", "passphrase"), "B"], keep=60)
+        self.assertEqual(results[0][1], "passphrase")
+        self.assertEqual(results[1][1], None)
+        self.assertEqual(self.k.retrieveDocument(results[1][0])["data"], "B")
+
+    def testBulkUploadFailures(self):
+
+        def load(document):
+            if document == "bad": raise Exception("Bad document.")
+            return document
+
+        results = list(self.k.uploadDocuments(["A", "bad", "C"], load=load))
+        self.assertEqual([index for index, result, e in results], [0, 1, 2])
+        self.assertEqual(results[1][1], None)
+        self.assertEqual(results[1][2].message, "Bad document.")
+        self.assertEqual(results[2][2], None)
+
+        self.assertRaises(Exception, self.k.createDocuments, ["A", "bad"],
+                          load=load)
+
+    def testBulkDownload(self):
+
+        keys = [self.k.createDocument("document {}".format(i), "passphrase")
+                for i in range(20)]
+        results = list(self.k.retrieveDocuments(keys + ["nonexistent"],
+                                                "passphrase", workers=4))
+
+        self.assertEqual([index for index, result, e in results], range(21))
+        for i, (index, result, e) in enumerate(results[:-1]):
+            self.assertEqual(result["data"], "document {}".format(i))
+        self.assertEqual(results[-1][1], None)
+        self.assertNotEqual(results[-1][2], None)
+
+        index, result, e = next(self.k.retrieveDocuments([(keys[0], "wrong")]))
+        self.assertNotEqual(e, None)
+
+    def testCompression(self):
+
+        document = "GET /index.html 500\n" * 1000
+        for passphrase in [None, "passphrase"]:
+            for codec in ["zlib", "auto"]:
+                key = self.k.createDocument(document, passphrase, compression=codec)
+                stored = self.server.documents[key]
+                self.assertEqual(stored["compression"], "zlib")
+                self.assertTrue(len(stored["data"]) < len(document) / 10)
+                self.assertEqual(self.k.retrieveDocument(key, passphrase)["data"],
+                                document)
+
+        key = self.k.createDocument("attack at dawn", compression="auto")
+        self.assertFalse("compression" in self.server.documents[key])
+        # too small to bother
+
+        self.server.documents[key]["compression"] = "rot13"
+        self.assertRaises(Exception, self.k.retrieveDocument, key)
+
+    def testMultipart(self):
+
+        document = "".join(chr(i % 251) for i in range(10000))
+        for passphrase in [None, "passphrase"]:
+            key = self.k.createMultipart(StringIO(document), passphrase,
+                                         shardSize=1000, workers=3)
+            manifest = self.k.retrieveDocument(key, passphrase)
+            self.assertTrue(self.k.isMultipart(manifest))
+            self.assertEqual("".join(self.k.retrieveMultipart(manifest,
+                                                              passphrase)),
+                            document)
+
+        # Corrupt a piece
+        shard = loads(manifest["data"])["shards"][3]["id"]
+        self.server.documents[shard]["data"] = self.k.encrypt("A"*1000, "passphrase")
+        self.assertRaises(Exception, list, self.k.retrieveMultipart(manifest,
+                                                                    "passphrase"))
+
+    def testBinaryDocument(self):
+
+        document = "".join(chr(i) for i in range(256))
+        key = self.k.createDocument(document, binary=True)
+        self.assertEqual(self.server.documents[key]["encoding"], "base64")
+        self.assertEqual(self.k.retrieveDocument(key)["data"], document)
+
+    def testChunkedScheme(self):
+
+        document = "".join(chr(i) for i in range(256)) * 1000
+        self.k.scheme = "chunked"
+        key = self.k.createDocument(document, "passphrase", compression="zlib")
+        self.assertEqual(self.server.documents[key]["security"], "chunked")
+        self.assertEqual(self.k.retrieveDocument(key, "passphrase")["data"], document)
+        output = StringIO()
+        self.k.streamDocument(key, output, "passphrase")
+        self.assertEqual(output.getvalue(), document)
+
+        key = self.k.createDocument(document, "passphrase")
+        self.assertEqual(Kopy(url=self.k.url).retrieveDocument(key,
+                         "passphrase")["data"], document)
+        self.assertRaises(Exception, self.k.retrieveDocument, key)
+        self.assertRaises(Exception, self.k.retrieveDocument, key, "wrong")
+
+        key = self.k.createDocument("attack at dawn")
+        self.assertEqual(self.server.documents[key]["security"], "default")
+
+        # unless asked, documents are still readable on kopy.io
+        key = Kopy(url=self.k.url).createDocument("attack at dawn", "passphrase")
+        self.assertEqual(self.server.documents[key]["security"], "encrypted")
+
+    def testCreateStream(self):
+
+        text = "attack at dawn\n" * 20000
+        binary = "".join(chr(i) for i in range(256)) * 1000
+        for document, passphrase, compression, isBinary, scheme in [
+                (text, None, None, False, "encrypted"),
+                ("", None, None, False, "encrypted"),
+                (text, "passphrase", None, False, "encrypted"),
+                (binary, "passphrase", "zlib", True, "chunked"),
+                (binary, None, "auto", True, "encrypted"),
+                (binary, None, None, True, "encrypted")]:
+            self.k.scheme = scheme
+            key = self.k.createStream(StringIO(document), passphrase,
+                                      compression=compression, binary=isBinary)
+            self.assertEqual(self.k.retrieveDocument(key, passphrase)["data"],
+                             document)
+            stored = self.server.documents[key]
+            self.assertEqual(stored["security"], scheme if passphrase else "default")
+            self.assertEqual(stored.get("compression"),
+                             "zlib" if compression else None)
+
+        # the body can't be sent twice
+        self.server.failures = 1
+        self.assertRaises(Exception, self.k.createStream, StringIO(text))
+
+    def testPipeline(self):
+
+        class Source(object):
+            # the second read waits until the first chunk has been encrypted
+            def __init__(self):
+                self.reads, self.eof = 0, Event()
+            def read(self, size):
+                self.reads += 1
+                if self.reads == 1: return "A" * size
+                self.eof.wait(5)
+                if self.reads == 2: return "B" * 10
+                return ""
+
+        source = Source()
+        encryptor = self.k.encryptor("passphrase")
+        body = self.k._pipeline(source, [encryptor], lambda data: data)
+        first = next(body)
+        self.assertFalse(source.eof.is_set())
+        source.eof.set()
+        self.assertEqual(self.k.decrypt(first + "".join(body), "passphrase"),
+                         "A" * self.k.streamChunkSize + "B" * 10)
+
+        class Broken(object):
+            def read(self, size):
+                raise IOError("disk on fire")
+
+        body = self.k._pipeline(Broken(), [], lambda data: data)
+        self.assertRaises(IOError, list, body)
+
+    def testStreamDocument(self):
+
+        documents = [("attack at dawn", None, None, False),
+                     ("attack at dawn" * 10000, "passphrase", "zlib", False),
+                     ("".join(chr(i) for i in range(256)) * 1000, None, "zlib", True),
+                     ("".join(chr(i) for i in range(256)) * 1000, "passphrase", None, True)]
+
+        for dataLast in [True, False]: # streamed, or spooled
+            self.server.dataLast = dataLast
+            for document, passphrase, compression, binary in documents:
+                key = self.k.createDocument(document, passphrase,
+                                            compression=compression, binary=binary)
+                output = StringIO()
+                fields = self.k.streamDocument(key, output, passphrase)
+                self.assertEqual(output.getvalue(), document)
+                self.assertEqual(fields.get("compression"), compression)
+        self.server.dataLast = True
+
+        document = "".join(chr(i) for i in range(256)) * 1000
+        key = self.k.createMultipart(StringIO(document), "passphrase",
+                                     shardSize=100000)
+        output = StringIO()
+        self.k.streamDocument(key, output, "passphrase")
+        self.assertEqual(output.getvalue(), document)
+
+        self.assertRaises(Exception, self.k.streamDocument, key, StringIO())
+        self.assertRaises(Exception, self.k.streamDocument, "nonexistent",
+                          StringIO())
+
+    def testListeners(self):
+
+        events = []
+        self.k.addListener(events.append)
+        key = self.k.createDocument("attack at dawn", "passphrase")
+        self.k.retrieveDocument(key, "passphrase")
+        self.k.removeListener(events.append)
+
+        phases = [event.phase for event in events]
+        for phase in ["derive", "pad", "encrypt", "base64", "http", "json",
+                      "decrypt", "unpad"]:
+            self.assertIn(phase, phases)
+        self.assertEqual([e.bytes for e in events if e.phase == "pad"], [14])
+        self.assertTrue(all(event.seconds >= 0 for event in events))
+
+        stats = Stats()
+        for event in events: stats(event)
+        self.assertEqual(stats.phases["http"][0], 2)
+        self.assertIn("unpad", stats.report())
+
+        self.k.createDocument("attack at dawn", "passphrase")
+        self.assertEqual(len(events), len(phases)) # no longer listening
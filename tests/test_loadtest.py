@@ -0,0 +1,60 @@
+from unittest import TestCase
+from api.kopy import Kopy
+from api.loadtest import LoadTest, Phase, percentile
+from api.server import Server
+
+class PhaseTest(TestCase):
+
+    def testPercentile(self):
+
+        samples = range(1, 101)
+        self.assertEqual(percentile(samples, 50), 51)
+        self.assertEqual(percentile(samples, 99), 100)
+        self.assertEqual(percentile(samples, 100), 100)
+        self.assertEqual(percentile([], 50), 0)
+
+    def testHistogram(self):
+
+        p = Phase("upload")
+        for latency in [0.0005, 0.003, 0.003, 20]: p.record(latency, 10)
+        p.record(1, error=True)
+        histogram = dict(p.histogram())
+        self.assertEqual(histogram[0.001], 1)
+        self.assertEqual(histogram[0.005], 2)
+        self.assertEqual(histogram[float("inf")], 1)
+        self.assertEqual(p.errors, 1)
+        self.assertEqual(p.bytes, 40)
+        self.assertIn("5 requests, 1 errors", p.report(1))
+
+class LoadTestTest(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = Server().start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def testRun(self):
+
+        k = Kopy(url=self.server.url, poolSize=4)
+        test = LoadTest(k, concurrency=4, duration=None, requests=40,
+                        sizes=[100, 5000], seed=1)
+        phases = test.run()
+
+        uploads, downloads = phases["upload"], phases["download"]
+        self.assertEqual(len(uploads.latencies) + len(downloads.latencies), 40)
+        self.assertEqual(uploads.errors + downloads.errors, 0)
+        self.assertTrue(uploads.latencies and downloads.latencies)
+        self.assertEqual(len(self.server.documents), len(uploads.latencies))
+        self.assertIn("download:", test.report())
+
+    def testErrors(self):
+
+        self.server.failures = 5
+        k = Kopy(url=self.server.url, retries=0)
+        k.retryBackoff = 0
+        test = LoadTest(k, concurrency=1, duration=None, requests=5, uploads=1)
+        phases = test.run()
+        self.assertEqual(phases["upload"].errors, 5)
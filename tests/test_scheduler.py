@@ -0,0 +1,69 @@
+from unittest import TestCase
+from threading import Thread
+from time import time, sleep
+from api.kopy import DeadlineExceeded
+from api.scheduler import Scheduler
+
+class SchedulerTest(TestCase):
+
+    def request(self, s, status=200, retryAfter=None, seconds=0):
+
+        with s.slot() as slot:
+            sleep(seconds)
+            slot.status, slot.retryAfter = status, retryAfter
+
+    def testAIMD(self):
+
+        s = Scheduler(8)
+        self.request(s, 503)
+        self.assertEqual(s.metrics()["limit"], 4)
+        for i in range(5): self.request(s) # about one per round trip
+        self.assertEqual(s.metrics()["limit"], 5)
+
+        try:
+            with s.slot(): raise IOError()
+        except IOError:
+            pass
+        self.assertEqual(s.metrics()["limit"], 2)
+        for i in range(100): self.request(s)
+        self.assertEqual(s.metrics()["limit"], 8) # no further than maximum
+
+        self.request(s, seconds=0.3) # much slower than usual
+        self.assertEqual(s.metrics()["limit"], 4)
+        self.assertEqual(s.metrics()["congestion"], 3)
+
+        s.adaptive = False
+        self.request(s, 503)
+        self.assertEqual(s.metrics()["limit"], 4)
+
+    def testRateLimit(self):
+
+        s = Scheduler(10, rate=20, burst=1)
+        start = time()
+        for i in range(5): self.request(s)
+        self.assertTrue(time() - start >= 0.15)
+
+        self.request(s, 429, "0.2")
+        self.assertEqual(s.metrics()["throttled"], 1)
+        self.assertEqual(s.metrics()["rate"], 10)
+        start = time()
+        self.request(s)
+        self.assertTrue(time() - start >= 0.15)
+
+    def testQueue(self):
+
+        s = Scheduler(1)
+        slot = s.slot()
+        slot.__enter__()
+        self.assertRaises(DeadlineExceeded, s.slot(time() + 0.05).__enter__)
+
+        thread = Thread(target=self.request, args=(s,))
+        thread.start()
+        sleep(0.05)
+        self.assertEqual(s.metrics()["queued"], 1)
+        self.assertEqual(s.metrics()["inFlight"], 1)
+        slot.status = 200
+        slot.__exit__(None, None, None)
+        thread.join()
+        self.assertEqual(s.metrics()["queued"], 0)
+        self.assertEqual(s.metrics()["requests"], 2)
@@ -0,0 +1,23 @@
+import sys
+from subprocess import Popen, PIPE
+from unittest import TestCase
+from benchmarks import startup
+
+class StartupTest(TestCase):
+
+    def testBudget(self):
+
+        for arguments, seconds in startup.run(runs=3):
+            self.assertTrue(seconds < startup.budget,
+                            "kopycat {} took {:.0f} ms".format(" ".join(arguments),
+                                                               seconds * 1000))
+
+    def testLazyImports(self):
+
+        heavy = ["requests", "Crypto", "cryptography", "sqlite3",
+                 "multiprocessing", "BaseHTTPServer", "simplejson"]
+        process = Popen([sys.executable, "-c", "import sys, kopycat; " + \
+                         "kopycat.CLI(); print ' '.join(sorted(sys.modules))"],
+                        cwd=startup.root, stdout=PIPE)
+        modules = process.communicate()[0].split()
+        self.assertEqual([m for m in heavy if m in modules], [])